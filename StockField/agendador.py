@@ -0,0 +1,172 @@
+import json
+import os
+import socket
+import time
+import uuid
+from datetime import datetime
+from functools import partial
+
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from models import obter_pool, verificar_produtos_a_vencer, reconstruir_resumos_estoque, fotografar_estoque
+from eventos import notificar_verificacao_validade
+from consumo import reconstruir_consumo
+
+# STOCKFIELD_AGENDADOR=0 desliga as tarefas neste processo
+AGENDADOR_ATIVO = os.environ.get("STOCKFIELD_AGENDADOR", "1") != "0"
+# Intervalos em segundos
+INTERVALO_VENCIMENTO = int(os.environ.get("STOCKFIELD_INTERVALO_VENCIMENTO", "900"))
+INTERVALO_ESTOQUE = int(os.environ.get("STOCKFIELD_INTERVALO_ESTOQUE", "3600"))
+INTERVALO_FOTOS = int(os.environ.get("STOCKFIELD_INTERVALO_FOTOS", "600"))
+INTERVALO_CONSUMO = int(os.environ.get("STOCKFIELD_INTERVALO_CONSUMO", "86400"))
+
+# Identifica este processo nas concessões das tarefas
+DONO = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def obter_concessao(db, nome: str, duracao: float) -> bool:
+    """
+    Tenta obter (ou renovar) a concessão da tarefa por `duracao` segundos.
+    Com vários workers só o dono da concessão executa a tarefa; os demais
+    só assumem quando ela expira, por exemplo se o dono parou.
+    """
+    agora = time.time()
+    cursor = db.execute("""
+        INSERT INTO tarefas_agendadas (nome, dono, concessao_ate) VALUES (?, ?, ?)
+        ON CONFLICT (nome) DO UPDATE SET
+            dono = excluded.dono,
+            concessao_ate = excluded.concessao_ate
+        WHERE tarefas_agendadas.dono = excluded.dono
+        OR tarefas_agendadas.concessao_ate < ?
+    """, (nome, DONO, agora + duracao, agora))
+    db.commit()
+    return cursor.rowcount == 1
+
+
+def executar_tarefa(nome: str, intervalo: int, funcao):
+    """Executa a tarefa se este processo tiver a concessão e grava o resultado."""
+    with obter_pool().conexao() as db:
+        # A concessão cobre duas execuções, então basta a tarefa rodar para renová-la
+        if not obter_concessao(db, nome, intervalo * 2):
+            return
+
+        inicio = time.perf_counter()
+        resultado, erro = None, None
+        try:
+            resultado = funcao(db)
+        except Exception as e:
+            db.rollback()
+            erro = str(e)
+            print(f"Erro na tarefa agendada {nome}: {e}")
+
+        db.execute("""
+            UPDATE tarefas_agendadas
+            SET ultima_execucao = ?, ultima_duracao_ms = ?, ultimo_resultado = ?, ultimo_erro = ?
+            WHERE nome = ? AND dono = ?
+        """, (
+            datetime.now().isoformat(timespec="seconds"),
+            round((time.perf_counter() - inicio) * 1000, 2),
+            json.dumps(resultado, ensure_ascii=False) if resultado is not None else None,
+            erro,
+            nome,
+            DONO
+        ))
+        db.commit()
+
+
+def tarefa_vencimentos(db, dias_alerta: int):
+    """Atualiza o status de validade de todos os produtos."""
+    resultado = verificar_produtos_a_vencer(db, dias_alerta)
+    notificar_verificacao_validade(db, resultado)
+    return {
+        "atualizados": len(resultado["atualizados"]),
+        "alertas": resultado["total_alertas"],
+        "data_verificacao": resultado["data_verificacao"]
+    }
+
+
+def tarefa_estoque(db):
+    """Recalcula os resumos de estoque e registra se os gatilhos divergiram."""
+    diferencas = reconstruir_resumos_estoque(db)
+    if diferencas:
+        print(f"Resumos de estoque corrigidos: {len(diferencas)} divergência(s)")
+    return {"divergencias": len(diferencas)}
+
+
+def tarefa_fotos_estoque(db):
+    """Grava as fotos do razão de estoque e registra produtos cujo saldo divergiu do razão."""
+    resultado = fotografar_estoque(db)
+    if resultado["divergencias"]:
+        print(f"Saldos divergentes do razão de estoque: {resultado['divergencias']}")
+    return {
+        "fotos": resultado["fotos"],
+        "produtos_lidos": resultado["produtos_lidos"],
+        "divergencias": len(resultado["divergencias"])
+    }
+
+
+def tarefa_consumo(db):
+    """Recalcula o consumo previsto de todas as saídas e registra se o incremental divergiu."""
+    resultado = reconstruir_consumo(db)
+    db.commit()
+    if resultado["divergencias"]:
+        print(f"Consumo previsto corrigido: {resultado['divergencias']} produto(s) divergente(s)")
+    return resultado
+
+
+def iniciar_agendador(dias_alerta: int = 7):
+    """Inicia as tarefas periódicas; a verificação de vencimentos roda logo na subida."""
+    if not AGENDADOR_ATIVO:
+        return None
+
+    agendador = BackgroundScheduler(job_defaults={"coalesce": True, "max_instances": 1})
+    agendador.add_job(
+        executar_tarefa, "interval",
+        seconds=INTERVALO_VENCIMENTO,
+        args=["vencimentos", INTERVALO_VENCIMENTO, partial(tarefa_vencimentos, dias_alerta=dias_alerta)],
+        id="vencimentos",
+        next_run_time=datetime.now()
+    )
+    agendador.add_job(
+        executar_tarefa, "interval",
+        seconds=INTERVALO_ESTOQUE,
+        args=["estoque", INTERVALO_ESTOQUE, tarefa_estoque],
+        id="estoque"
+    )
+    agendador.add_job(
+        executar_tarefa, "interval",
+        seconds=INTERVALO_FOTOS,
+        args=["fotos_estoque", INTERVALO_FOTOS, tarefa_fotos_estoque],
+        id="fotos_estoque"
+    )
+    agendador.add_job(
+        executar_tarefa, "interval",
+        seconds=INTERVALO_CONSUMO,
+        args=["consumo", INTERVALO_CONSUMO, tarefa_consumo],
+        id="consumo"
+    )
+    agendador.start()
+    return agendador
+
+
+def parar_agendador(agendador):
+    """Para as tarefas e libera as concessões para outro worker assumir."""
+    if agendador is None:
+        return
+    agendador.shutdown(wait=True)
+    with obter_pool().conexao() as db:
+        db.execute("UPDATE tarefas_agendadas SET concessao_ate = 0 WHERE dono = ?", (DONO,))
+        db.commit()
+
+
+def listar_tarefas(db):
+    cursor = db.cursor()
+    cursor.execute("SELECT * FROM tarefas_agendadas ORDER BY nome")
+    tarefas = []
+    for row in cursor.fetchall():
+        tarefa = dict(row)
+        if tarefa["ultimo_resultado"]:
+            tarefa["ultimo_resultado"] = json.loads(tarefa["ultimo_resultado"])
+        tarefa["ativa"] = tarefa["concessao_ate"] > time.time()
+        tarefas.append(tarefa)
+    return tarefas
@@ -0,0 +1,142 @@
+import json
+import uuid
+from datetime import datetime
+
+# Registro de auditoria (tabela logs).
+# Cada evento guarda a entidade afetada e um objeto JSON (coluna dados) com
+# os campos do evento. O evento é gravado na transação de quem chama, junto
+# com a alteração que descreve: o commit é sempre de quem chama.
+
+COMANDO_INSERIR = """
+    INSERT INTO logs (uuid, usuario_uuid, acao, entidade, entidade_uuid, dados, data)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Rótulos usados nos relatórios; chaves sem rótulo aparecem como estão
+# (é o caso dos eventos antigos, convertidos a partir do texto)
+ROTULOS = {
+    "movimento_uuid": "Movimento UUID",
+    "lote_uuid": "Lote UUID",
+    "nome": "Nome",
+    "produto": "Produto",
+    "fornecedor": "Fornecedor",
+    "quantidade": "Quantidade",
+    "variacao": "Quantidade",
+    "data": "Data",
+    "data_validade": "Data de validade",
+    "movimentos": "Movimentos",
+    "entradas": "Entradas",
+    "unidades_entrada": "Unidades de entrada",
+    "saidas": "Saídas",
+    "unidades_saida": "Unidades de saída",
+    "produtos": "Produtos",
+    "rejeitados": "Rejeitados",
+}
+
+# Entidade de cada ação já registrada antes dos campos estruturados
+ENTIDADES_ACOES = {
+    "Entrada de Estoque": "movimento",
+    "Saída de Estoque": "movimento",
+    "Movimentação em Lote": "lote",
+    "Novo Produto Cadastrado": "produto",
+    "Produto Deletado": "produto",
+    "Exclusão de Produto": "produto",
+    "Novo Fornecedor Cadastrado": "fornecedor",
+    "Fornecedor Deletado": "fornecedor",
+}
+
+
+def montar_evento(usuario_uuid: str, acao: str, entidade: str = None, entidade_uuid: str = None, dados: dict = None) -> tuple:
+    return (
+        str(uuid.uuid4()),
+        usuario_uuid,
+        acao,
+        entidade,
+        entidade_uuid,
+        json.dumps(dados or {}, ensure_ascii=False, default=str),
+        datetime.now().strftime("%Y-%m-%d %H:%M"),
+    )
+
+
+def registrar_evento(db, usuario_uuid: str, acao: str, entidade: str = None, entidade_uuid: str = None, **dados):
+    """Grava um evento na transação em andamento (sem commit)."""
+    db.execute(COMANDO_INSERIR, montar_evento(usuario_uuid, acao, entidade, entidade_uuid, dados))
+
+
+class BufferAuditoria:
+    """
+    Acumula eventos para gravá-los de uma vez com executemany.
+    Usado nos caminhos em lote; gravar() também não faz commit.
+    """
+
+    def __init__(self):
+        self._eventos = []
+
+    def __len__(self):
+        return len(self._eventos)
+
+    def registrar(self, usuario_uuid: str, acao: str, entidade: str = None, entidade_uuid: str = None, **dados):
+        self._eventos.append(montar_evento(usuario_uuid, acao, entidade, entidade_uuid, dados))
+
+    def gravar(self, db):
+        if self._eventos:
+            db.executemany(COMANDO_INSERIR, self._eventos)
+            self._eventos = []
+
+
+def carregar_dados(valor) -> dict:
+    return json.loads(valor) if valor else {}
+
+
+def formatar_valor(chave: str, valor) -> str:
+    if chave == "variacao":
+        return f"{valor:+d} unidades"
+    if chave in ("quantidade", "unidades_entrada", "unidades_saida"):
+        return f"{valor} unidades"
+    return str(valor)
+
+
+def campos_evento(entidade_uuid: str, dados: dict) -> list:
+    """Pares (rótulo, texto) de um evento, na ordem em que foram registrados."""
+    campos = []
+    if entidade_uuid and "UUID" not in dados:
+        campos.append(("UUID", entidade_uuid))
+    for chave, valor in dados.items():
+        if valor is None or valor == "":
+            continue
+        campos.append((ROTULOS.get(chave, chave), formatar_valor(chave, valor)))
+    return campos
+
+
+def converter_detalhes(detalhes: str) -> dict:
+    """Converte o texto antigo 'Chave: valor | ...' em um objeto."""
+    dados = {}
+    for parte in (detalhes or "").split("|"):
+        parte = parte.strip()
+        if not parte:
+            continue
+        if ":" in parte:
+            chave, valor = parte.split(":", 1)
+            dados[chave.strip()] = valor.strip()
+        else:
+            dados.setdefault("Detalhes", parte)
+    return dados
+
+
+def migrar_detalhes(cursor):
+    """Passo de migração: preenche entidade e dados dos eventos antigos."""
+    cursor.execute("SELECT uuid, acao, detalhes FROM logs WHERE dados IS NULL")
+    atualizacoes = []
+    for row in cursor.fetchall():
+        dados = converter_detalhes(row[2])
+        entidade_uuid = dados.get("UUID") or dados.get("Movimento UUID")
+        atualizacoes.append((
+            ENTIDADES_ACOES.get(row[1]),
+            entidade_uuid,
+            json.dumps(dados, ensure_ascii=False),
+            row[0],
+        ))
+    cursor.executemany(
+        "UPDATE logs SET entidade = ?, entidade_uuid = ?, dados = ? WHERE uuid = ?",
+        atualizacoes
+    )
@@ -0,0 +1,204 @@
+"""
+Benchmark de latência das rotas do StockField.
+
+Monta um banco sintético e determinístico num diretório temporário (com o
+gerador de gerar_dados.py), sobe a aplicação no próprio processo
+(TestClient, com sessão autenticada) e mede p50/p95/p99 e o número de
+comandos SQL de cada rota.
+
+    python benchmark.py
+    python benchmark.py --usuarios 20 --movimentos 5000 --saida resultados.json
+    python benchmark.py --base resultados.json --tolerancia 20
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+from gerar_dados import SENHA, cnpj_usuario, gerar
+
+
+def percentil(amostras: list, p: float) -> float:
+    """Percentil pelo método do posto mais próximo."""
+    ordenadas = sorted(amostras)
+    posto = max(1, math.ceil(p / 100 * len(ordenadas)))
+    return ordenadas[posto - 1]
+
+
+def medir(cliente, pool, nome: str, metodo: str, caminho: str, repeticoes: int, aquecimento: int, **kwargs):
+    amostras, comandos, erros = [], [], 0
+    for i in range(aquecimento + repeticoes):
+        antes = pool.estatisticas()["comandos"]
+        inicio = time.perf_counter()
+        resposta = cliente.request(metodo, caminho() if callable(caminho) else caminho,
+                                   **{k: v() if callable(v) else v for k, v in kwargs.items()})
+        _ = resposta.content
+        duracao = (time.perf_counter() - inicio) * 1000
+        if i < aquecimento:
+            continue
+        if resposta.status_code >= 400:
+            erros += 1
+        amostras.append(duracao)
+        comandos.append(pool.estatisticas()["comandos"] - antes)
+
+    return nome, {
+        "metodo": metodo,
+        "caminho": caminho if isinstance(caminho, str) else caminho(),
+        "repeticoes": repeticoes,
+        "erros": erros,
+        "p50_ms": round(percentil(amostras, 50), 3),
+        "p95_ms": round(percentil(amostras, 95), 3),
+        "p99_ms": round(percentil(amostras, 99), 3),
+        "media_ms": round(sum(amostras) / len(amostras), 3),
+        "comandos_sql": round(sum(comandos) / len(comandos), 1),
+    }
+
+
+def executar(args) -> dict:
+    diretorio = tempfile.mkdtemp(prefix="stockfield-bench-")
+    caminho = os.path.join(diretorio, "stockfield.db")
+    # Antes de importar a aplicação: main.py chama init_db() ao ser importado
+    os.environ["STOCKFIELD_DB"] = caminho
+    os.environ["STOCKFIELD_AGENDADOR"] = "0"
+
+    inicio = time.perf_counter()
+    gerar(caminho, args.usuarios, args.fornecedores, args.produtos, args.movimentos, args.logs,
+          args.semente, progresso=None)
+    print(f"Banco sintético montado em {time.perf_counter() - inicio:.1f}s: {caminho}")
+
+    # A aplicação resolve static/ e templates/ a partir do diretório atual
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    from fastapi.testclient import TestClient
+    import main
+    import models
+
+    pool = models.obter_pool()
+    with sqlite3.connect(caminho) as conn:
+        produtos_uuids = [row[0] for row in conn.execute("""
+            SELECT p.uuid FROM produtos p JOIN usuarios u ON u.uuid = p.usuario_uuid
+            WHERE u.cnpj = ? ORDER BY p.nome
+        """, (cnpj_usuario(0),))]
+        fornecedor_uuid = conn.execute("""
+            SELECT f.uuid FROM fornecedores f JOIN usuarios u ON u.uuid = f.usuario_uuid
+            WHERE u.cnpj = ? LIMIT 1
+        """, (cnpj_usuario(0),)).fetchone()[0]
+
+    rnd = random.Random(args.semente)
+
+    def movimento():
+        return {
+            "produto_uuid": rnd.choice(produtos_uuids),
+            "quantidade": 1,
+            "data": date.today().isoformat(),
+            "fornecedor_uuid": fornecedor_uuid,
+        }
+
+    login = {"cnpj": cnpj_usuario(0), "senha": SENHA}
+    login_admin = {"cnpj": "123.456.789-00", "senha": "useradm"}
+    r, a = args.repeticoes, args.aquecimento
+
+    rotas = {}
+    with TestClient(main.app) as usuario, TestClient(main.app) as admin, TestClient(main.app) as anonimo:
+        usuario.post("/login", data=login, follow_redirects=False)
+        admin.post("/login", data=login_admin, follow_redirects=False)
+
+        medicoes = [
+            medir(anonimo, pool, "login_action", "POST", "/login", r, a, data=login, follow_redirects=False),
+            medir(usuario, pool, "listar_produtos", "GET", "/produtos/", r, a),
+            medir(usuario, pool, "listar_produtos_filtrados", "GET",
+                  "/produtos/?estoque_baixo=true&ordenar_por=validade&limite=50", r, a),
+            medir(usuario, pool, "listar_fornecedores", "GET", "/fornecedores/", r, a),
+            medir(usuario, pool, "buscar_produtos", "GET", "/api/produtos/busca?q=adub npk", r, a),
+            # Entradas antes das saídas, para haver saldo
+            medir(usuario, pool, "registrar_entrada", "POST", "/movimentos/entrada", r, a, json=movimento),
+            medir(usuario, pool, "registrar_saida", "POST", "/movimentos/saida", r, a, json=movimento),
+            medir(usuario, pool, "relatorio_logs_pdf", "GET", "/relatorio/logs/pdf", max(1, r // 10), min(a, 1)),
+            medir(admin, pool, "obter_estatisticas_admin", "GET", "/api/admin/estatisticas", r, a),
+            medir(admin, pool, "obter_estatisticas_usuarios", "GET", "/api/admin/usuarios/estatisticas", r, a),
+            medir(admin, pool, "obter_estatisticas_produtos_admin", "GET", "/api/admin/produtos/estatisticas", r, a),
+            medir(admin, pool, "debug_estatisticas", "GET", "/api/debug/estatisticas", r, a),
+        ]
+        rotas.update(medicoes)
+
+    return {
+        "gerado_em": datetime.now().isoformat(timespec="seconds"),
+        "ambiente": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "plataforma": platform.platform(),
+        },
+        "dados": {
+            "usuarios": args.usuarios,
+            "fornecedores": args.fornecedores,
+            "produtos": args.produtos,
+            "movimentos": args.movimentos,
+            "logs": args.logs,
+            "semente": args.semente,
+        },
+        "rotas": rotas,
+    }
+
+
+def comparar(resultados: dict, base: dict, tolerancia: float) -> list:
+    """Rotas cujo p95 piorou mais que `tolerancia` por cento em relação à base."""
+    if base.get("dados") != resultados["dados"]:
+        print("Aviso: a base foi medida com outro conjunto de dados.")
+    regressoes = []
+    print(f"\n{'rota':36} {'p95 base':>10} {'p95 atual':>10} {'variação':>9}")
+    for nome, atual in resultados["rotas"].items():
+        anterior = base.get("rotas", {}).get(nome)
+        if not anterior:
+            print(f"{nome:36} {'-':>10} {atual['p95_ms']:>10.2f} {'nova':>9}")
+            continue
+        variacao = (atual["p95_ms"] - anterior["p95_ms"]) / max(anterior["p95_ms"], 1e-9) * 100
+        marca = " <- regressão" if variacao > tolerancia else ""
+        print(f"{nome:36} {anterior['p95_ms']:>10.2f} {atual['p95_ms']:>10.2f} {variacao:>+8.1f}%{marca}")
+        if marca:
+            regressoes.append(nome)
+    return regressoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--usuarios", type=int, default=5)
+    parser.add_argument("--fornecedores", type=int, default=10, help="Por usuário")
+    parser.add_argument("--produtos", type=int, default=500, help="Por usuário")
+    parser.add_argument("--movimentos", type=int, default=5000, help="Por usuário")
+    parser.add_argument("--logs", type=int, default=5000, help="Por usuário")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--repeticoes", type=int, default=50)
+    parser.add_argument("--aquecimento", type=int, default=5)
+    parser.add_argument("--saida", default="benchmark.json", help="Arquivo JSON com os resultados")
+    parser.add_argument("--base", help="Resultados anteriores para comparar")
+    parser.add_argument("--tolerancia", type=float, default=15.0, help="Piora aceita no p95, em %%")
+    args = parser.parse_args()
+    args.saida = os.path.abspath(args.saida)
+    if args.base:
+        args.base = os.path.abspath(args.base)
+
+    resultados = executar(args)
+    with open(args.saida, "w", encoding="utf-8") as arquivo:
+        json.dump(resultados, arquivo, ensure_ascii=False, indent=2)
+
+    print(f"\n{'rota':36} {'p50':>8} {'p95':>8} {'p99':>8} {'sql':>6} {'erros':>6}")
+    for nome, rota in resultados["rotas"].items():
+        print(f"{nome:36} {rota['p50_ms']:>8.2f} {rota['p95_ms']:>8.2f} {rota['p99_ms']:>8.2f} "
+              f"{rota['comandos_sql']:>6} {rota['erros']:>6}")
+    print(f"\nResultados gravados em {args.saida}")
+
+    if args.base:
+        with open(args.base, encoding="utf-8") as arquivo:
+            base = json.load(arquivo)
+        if comparar(resultados, base, args.tolerancia):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
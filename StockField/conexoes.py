@@ -0,0 +1,273 @@
+import asyncio
+import contextvars
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from instrumentacao import medicao_atual, registrar_comando
+
+# Threads dedicadas ao banco usadas pelas rotas async. É o limite explícito de
+# consultas simultâneas dessas rotas; o restante espera na fila do executor
+# sem ocupar o pool de threads do AnyIO.
+TRABALHADORES_BANCO = int(os.environ.get("STOCKFIELD_DB_WORKERS", "8"))
+
+# O AnyIO (usado pelo FastAPI para rodar rotas síncronas) limita o pool de
+# threads a 40 workers; somando as threads do executor, nenhuma rota espera
+# por conexão enquanto houver thread livre.
+TAMANHO_POOL = int(os.environ.get("STOCKFIELD_DB_POOL", str(40 + TRABALHADORES_BANCO)))
+
+# Configuração aplicada uma única vez em cada conexão nova
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA temp_store = MEMORY",
+]
+CACHE_COMANDOS = 256
+TENTATIVAS_BLOQUEIO = 3
+
+
+def _banco_bloqueado(erro: sqlite3.OperationalError) -> bool:
+    mensagem = str(erro)
+    return "database is locked" in mensagem or "database is busy" in mensagem
+
+
+class CursorPool(sqlite3.Cursor):
+    """
+    Cursor que repete o comando quando o banco continua bloqueado após o
+    busy_timeout e que soma comandos e tempos à medição da requisição.
+    """
+
+    def execute(self, sql, parameters=()):
+        return self.connection._com_tentativas(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.connection._com_tentativas(super().executemany, sql, seq_of_parameters, lote=True)
+
+    # O SQLite só produz as linhas seguintes ao ler, então a leitura também é tempo de banco
+    def fetchone(self):
+        return self._medir_leitura(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._medir_leitura(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._medir_leitura(super().fetchall)
+
+    def _medir_leitura(self, leitura, *args):
+        medicao = medicao_atual()
+        if medicao is None:
+            return leitura(*args)
+        inicio = time.perf_counter()
+        try:
+            return leitura(*args)
+        finally:
+            medicao.tempos["db"] += (time.perf_counter() - inicio) * 1000
+
+
+class ConexaoPool(sqlite3.Connection):
+    pool = None
+
+    def cursor(self, factory=CursorPool):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def _com_tentativas(self, operacao, sql, parametros, lote=False):
+        if self.pool is not None:
+            self.pool._contar("comandos")
+        medicao = medicao_atual()
+        if medicao is None:
+            return self._executar(operacao, sql, parametros)
+        inicio = time.perf_counter()
+        try:
+            return self._executar(operacao, sql, parametros)
+        finally:
+            registrar_comando(medicao, sql, parametros, (time.perf_counter() - inicio) * 1000, lote)
+
+    def _executar(self, operacao, *args):
+        for tentativa in range(TENTATIVAS_BLOQUEIO):
+            try:
+                return operacao(*args)
+            except sqlite3.OperationalError as erro:
+                if not _banco_bloqueado(erro) or tentativa == TENTATIVAS_BLOQUEIO - 1:
+                    raise
+                if self.pool is not None:
+                    self.pool._contar("repeticoes_bloqueio")
+                time.sleep(0.05 * (tentativa + 1))
+
+
+class PoolConexoes:
+    """
+    Pool de conexões SQLite já configuradas.
+    As conexões são criadas sob demanda até o tamanho máximo e reaproveitadas.
+    """
+
+    def __init__(self, caminho: str, tamanho: int = TAMANHO_POOL):
+        self.caminho = caminho
+        self.tamanho = tamanho
+        self._livres = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._criadas = 0
+        self._fechado = False
+        self._stats = {
+            "retiradas": 0,
+            "esperas": 0,
+            "tempo_espera_ms": 0.0,
+            "repeticoes_bloqueio": 0,
+            "comandos": 0,
+        }
+
+    def _contar(self, chave: str, valor=1):
+        with self._lock:
+            self._stats[chave] += valor
+
+    def _conectar(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.caminho,
+            check_same_thread=False,
+            cached_statements=CACHE_COMANDOS,
+            factory=ConexaoPool,
+        )
+        conn.pool = self
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def obter(self, timeout: float = 30.0) -> sqlite3.Connection:
+        try:
+            conn = self._livres.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                pode_criar = self._criadas < self.tamanho
+                if pode_criar:
+                    self._criadas += 1
+            if pode_criar:
+                try:
+                    conn = self._conectar()
+                except Exception:
+                    with self._lock:
+                        self._criadas -= 1
+                    raise
+            else:
+                inicio = time.perf_counter()
+                try:
+                    conn = self._livres.get(timeout=timeout)
+                except queue.Empty:
+                    raise RuntimeError("Nenhuma conexão livre no pool do banco de dados")
+                with self._lock:
+                    self._stats["esperas"] += 1
+                    self._stats["tempo_espera_ms"] += (time.perf_counter() - inicio) * 1000
+        self._contar("retiradas")
+        return conn
+
+    def devolver(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        if self._fechado:
+            conn.close()
+            return
+        self._livres.put(conn)
+
+    @contextmanager
+    def conexao(self):
+        conn = self.obter()
+        try:
+            yield conn
+        finally:
+            self.devolver(conn)
+
+    def fechar(self):
+        self._fechado = True
+        while True:
+            try:
+                self._livres.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            criadas = self._criadas
+        stats["tempo_espera_ms"] = round(stats["tempo_espera_ms"], 2)
+        stats.update({
+            "tamanho": self.tamanho,
+            "criadas": criadas,
+            "livres": self._livres.qsize(),
+            "em_uso": criadas - self._livres.qsize(),
+        })
+        return stats
+
+
+class ExecutorBanco:
+    """
+    Executor limitado para o acesso ao banco a partir de rotas async.
+    Cada tarefa roda em uma thread própria com uma conexão do pool, então uma
+    consulta lenta ocupa uma dessas threads, e não o loop de eventos.
+    """
+
+    def __init__(self, obter_pool, trabalhadores: int = TRABALHADORES_BANCO):
+        self._obter_pool = obter_pool
+        self.trabalhadores = trabalhadores
+        self._executor = ThreadPoolExecutor(
+            max_workers=trabalhadores,
+            thread_name_prefix="stockfield-db",
+        )
+        self._lock = threading.Lock()
+        self._stats = {
+            "tarefas": 0,
+            "pendentes": 0,
+            "em_execucao": 0,
+            "tempo_fila_ms": 0.0,
+        }
+
+    def _contar(self, chave: str, valor=1):
+        with self._lock:
+            self._stats[chave] += valor
+
+    def _rodar(self, enviada_em: float, funcao, args, kwargs):
+        with self._lock:
+            self._stats["em_execucao"] += 1
+            self._stats["tempo_fila_ms"] += (time.perf_counter() - enviada_em) * 1000
+        try:
+            with self._obter_pool().conexao() as conn:
+                return funcao(conn, *args, **kwargs)
+        finally:
+            with self._lock:
+                self._stats["em_execucao"] -= 1
+                self._stats["pendentes"] -= 1
+
+    async def executar(self, funcao, *args, **kwargs):
+        """Roda funcao(conn, *args, **kwargs) em uma thread do banco e aguarda o resultado."""
+        loop = asyncio.get_running_loop()
+        # Leva as variáveis de contexto da requisição para a thread
+        contexto = contextvars.copy_context()
+        with self._lock:
+            self._stats["tarefas"] += 1
+            self._stats["pendentes"] += 1
+        return await loop.run_in_executor(
+            self._executor, contexto.run,
+            self._rodar, time.perf_counter(), funcao, args, kwargs,
+        )
+
+    def fechar(self):
+        self._executor.shutdown(wait=True)
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["tempo_fila_ms"] = round(stats["tempo_fila_ms"], 2)
+        stats["trabalhadores"] = self.trabalhadores
+        return stats
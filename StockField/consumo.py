@@ -0,0 +1,172 @@
+import math
+import os
+from datetime import date, timedelta
+
+# Consumo previsto de cada produto: média exponencialmente ponderada das
+# saídas, com meia-vida em dias. Para cada produto guardamos só a soma das
+# saídas já decaída até o dia da última saída (saidas_ponderadas); uma nova
+# saída decai essa soma pelos dias passados e soma a quantidade, O(1) por
+# movimentação. A mesma soma sai de uma passada vetorizada (NumPy) pela
+# tabela de movimentos, em blocos, usada na migração e na conferência diária.
+
+MEIA_VIDA_CONSUMO = float(os.environ.get("STOCKFIELD_MEIA_VIDA_CONSUMO", "14"))
+TAU = MEIA_VIDA_CONSUMO / math.log(2)
+# Fração do peso de um dia: com consumo constante de c por dia a soma tende a c / FATOR_DIA
+FATOR_DIA = 1 - math.exp(-1 / TAU)
+
+# Além deste horizonte (dias) não há previsão de esgotamento: o consumo
+# restante é só o resíduo decaído de saídas antigas
+HORIZONTE_PREVISAO = int(os.environ.get("STOCKFIELD_HORIZONTE_PREVISAO", "3650"))
+
+ORDENACOES_PREVISAO = ["dias_para_esgotar", "consumo_diario", "quantidade", "nome"]
+
+# Linhas lidas por reconstruir_consumo, como arrays estruturados (os uuids
+# têm 36 caracteres)
+TIPO_SAIDA = [("produto_uuid", "U36"), ("dia", "datetime64[D]"), ("quantidade", "f8")]
+TIPO_CONSUMO = [("produto_uuid", "U36"), ("saidas_ponderadas", "f8"),
+                ("primeira_saida", "datetime64[D]"), ("ultima_saida", "datetime64[D]")]
+
+
+def registrar_consumo(db, produto_uuid: str, quantidade: int, dia: date):
+    """Soma uma saída à média do produto (na transação da saída)."""
+    atual = db.execute(
+        "SELECT saidas_ponderadas, primeira_saida, ultima_saida FROM consumo_produtos WHERE produto_uuid = ?",
+        (produto_uuid,)
+    ).fetchone()
+    if atual is None:
+        peso, primeira, ultima = float(quantidade), dia, dia
+    else:
+        peso, primeira, ultima = atual[0], date.fromisoformat(atual[1]), date.fromisoformat(atual[2])
+        dias = (dia - ultima).days
+        if dias >= 0:
+            peso = peso * math.exp(-dias / TAU) + quantidade
+            ultima = dia
+        else:
+            # Saída com data anterior à última: entra já decaída
+            peso += quantidade * math.exp(dias / TAU)
+        primeira = min(primeira, dia)
+
+    db.execute("""
+        INSERT INTO consumo_produtos (produto_uuid, saidas_ponderadas, primeira_saida, ultima_saida)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(produto_uuid) DO UPDATE SET
+            saidas_ponderadas = excluded.saidas_ponderadas,
+            primeira_saida = excluded.primeira_saida,
+            ultima_saida = excluded.ultima_saida
+    """, (produto_uuid, peso, primeira.isoformat(), ultima.isoformat()))
+
+
+def _somar_por_produto(np, uuids, primeiras, ultimas, pesos):
+    """
+    Junta as somas ponderadas por produto: cada peso vale no seu `ultimas` e
+    é decaído até a última saída do produto. Serve tanto para as saídas de
+    um bloco (primeira = última = dia, peso = quantidade) quanto para juntar
+    os resultados dos blocos.
+    """
+    produtos, indices = np.unique(uuids, return_inverse=True)
+    ultima = np.full(len(produtos), np.iinfo(np.int64).min)
+    np.maximum.at(ultima, indices, ultimas)
+    primeira = np.full(len(produtos), np.iinfo(np.int64).max)
+    np.minimum.at(primeira, indices, primeiras)
+    peso = np.bincount(
+        indices,
+        weights=pesos * np.exp((ultimas - ultima[indices]) / TAU),
+        minlength=len(produtos)
+    )
+    return produtos, primeira, ultima, peso
+
+
+def reconstruir_consumo(db, bloco: int = 100000) -> dict:
+    """
+    Recalcula consumo_produtos a partir de todas as saídas, vetorizado.
+    Cada bloco de `bloco` linhas vira um array (np.fromiter) e é somado por
+    produto na hora, então a memória cresce com os produtos e não com as
+    saídas. Não faz commit. Retorna quantos produtos foram gravados e
+    quantos divergiam do valor mantido a cada saída.
+    """
+    import numpy as np
+
+    cursor = db.execute("""
+        SELECT m.produto_uuid, substr(m.data, 1, 10), m.quantidade
+        FROM movimentos m
+        JOIN produtos p ON p.uuid = m.produto_uuid
+        WHERE m.tipo = 'saída'
+    """)
+    partes = []
+    while True:
+        linhas = cursor.fetchmany(bloco)
+        if not linhas:
+            break
+        saidas = np.fromiter(map(tuple, linhas), dtype=TIPO_SAIDA, count=len(linhas))
+        dias = saidas["dia"].astype(np.int64)
+        partes.append(_somar_por_produto(np, saidas["produto_uuid"], dias, dias, saidas["quantidade"]))
+
+    anteriores = np.fromiter(map(tuple, db.execute(
+        "SELECT produto_uuid, saidas_ponderadas, primeira_saida, ultima_saida FROM consumo_produtos"
+    ).fetchall()), dtype=TIPO_CONSUMO)
+    db.execute("DELETE FROM consumo_produtos")
+    if not partes:
+        return {"produtos": 0, "divergencias": len(anteriores)}
+
+    produtos, primeira, ultima, pesos = _somar_por_produto(
+        np, *(np.concatenate(coluna) for coluna in zip(*partes))
+    )
+    db.executemany(
+        "INSERT INTO consumo_produtos (produto_uuid, saidas_ponderadas, primeira_saida, ultima_saida) VALUES (?, ?, ?, ?)",
+        zip(produtos.tolist(), pesos.tolist(),
+            primeira.astype("datetime64[D]").astype(str).tolist(),
+            ultima.astype("datetime64[D]").astype(str).tolist())
+    )
+
+    # Produtos iguais ao valor mantido a cada saída; o resto (novos, sumidos
+    # ou diferentes) conta como divergência
+    posicoes = np.searchsorted(produtos, anteriores["produto_uuid"]).clip(max=len(produtos) - 1)
+    presentes = produtos[posicoes] == anteriores["produto_uuid"]
+    iguais = (
+        presentes
+        & (primeira[posicoes] == anteriores["primeira_saida"].astype(np.int64))
+        & (ultima[posicoes] == anteriores["ultima_saida"].astype(np.int64))
+        & np.isclose(pesos[posicoes], anteriores["saidas_ponderadas"], rtol=1e-9, atol=0)
+    )
+    divergencias = len(produtos) - int(iguais.sum()) + int((~presentes).sum())
+    return {"produtos": len(produtos), "divergencias": divergencias}
+
+
+def prever_esgotamento(saidas_ponderadas, primeira_saida, ultima_saida, quantidade: int, hoje: date) -> dict:
+    """Consumo diário previsto hoje e em quantos dias o estoque atual acaba."""
+    if saidas_ponderadas is None:
+        return {"consumo_diario": None, "dias_para_esgotar": None, "data_prevista_esgotamento": None}
+
+    peso = saidas_ponderadas * math.exp(-max((hoje - date.fromisoformat(ultima_saida)).days, 0) / TAU)
+    # Poucos dias de histórico ainda não acumularam o peso todo
+    historico = max((hoje - date.fromisoformat(primeira_saida)).days + 1, 1)
+    consumo = peso * FATOR_DIA / (1 - math.exp(-historico / TAU))
+
+    dias = None
+    if consumo > 1e-9 and quantidade / consumo <= min(HORIZONTE_PREVISAO, (date.max - hoje).days - 1):
+        dias = round(quantidade / consumo, 1)
+    return {
+        "consumo_diario": round(consumo, 3),
+        "dias_para_esgotar": dias,
+        "data_prevista_esgotamento": (hoje + timedelta(days=math.floor(dias))).isoformat() if dias is not None else None,
+    }
+
+
+def carregar_previsoes(db, usuario_uuid: str, hoje: date) -> list:
+    """Previsão de esgotamento de todos os produtos do usuário que já tiveram saídas."""
+    cursor = db.execute("""
+        SELECT p.uuid, p.nome, p.categoria, p.quantidade, p.estoque_minimo, p.status,
+               c.saidas_ponderadas, c.primeira_saida, c.ultima_saida
+        FROM consumo_produtos c
+        JOIN produtos p ON p.uuid = c.produto_uuid
+        WHERE p.usuario_uuid = ?
+    """, (usuario_uuid,))
+    previsoes = []
+    for row in cursor.fetchall():
+        produto = dict(row)
+        previsao = prever_esgotamento(
+            produto.pop("saidas_ponderadas"), produto.pop("primeira_saida"), produto.pop("ultima_saida"),
+            produto["quantidade"], hoje
+        )
+        previsoes.append({**produto, **previsao})
+    return previsoes
@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+
+from models import obter_versoes
+
+# Estatísticas globais das páginas de administração.
+# Cada tabela é lida uma única vez, com uma consulta agrupada, e o resultado
+# fica em memória. A validade é dupla: as versões globais das coleções
+# (versoes_dados, incrementadas pelos gatilhos de qualquer escrita) e um TTL
+# curto, que limita a idade do valor mesmo se alguma escrita escapar dos gatilhos.
+
+TTL_ESTATISTICAS = float(os.environ.get("STOCKFIELD_TTL_ESTATISTICAS", "30"))
+COLECOES = ["usuarios", "produtos", "fornecedores", "movimentos"]
+
+
+def calcular_estatisticas(db) -> dict:
+    cursor = db.cursor()
+
+    cursor.execute("SELECT tipo, COUNT(*) as total FROM usuarios GROUP BY tipo")
+    usuarios_por_tipo = {row["tipo"]: row["total"] for row in cursor.fetchall()}
+
+    # Coberta pelo índice (status, data_validade)
+    cursor.execute("SELECT status, COUNT(*) as total FROM produtos GROUP BY status")
+    produtos_por_status = {row["status"]: row["total"] for row in cursor.fetchall()}
+
+    # Uma busca no índice de produtos por fornecedor, em vez do produto cartesiano
+    cursor.execute("""
+        SELECT
+            COUNT(*) as total,
+            COALESCE(SUM(produtos > 0), 0) as ativos,
+            COALESCE(SUM(produtos), 0) as produtos_vinculados
+        FROM (
+            SELECT (SELECT COUNT(*) FROM produtos p WHERE p.fornecedor_uuid = f.uuid) as produtos
+            FROM fornecedores f
+        )
+    """)
+    fornecedores = dict(cursor.fetchone())
+
+    # Cada movimento busca seu produto e o fornecedor do produto pela chave primária
+    cursor.execute("""
+        SELECT
+            m.tipo,
+            COUNT(*) as total,
+            COUNT(f.uuid) as vinculados,
+            COUNT(DISTINCT f.uuid) as fornecedores
+        FROM movimentos m
+        LEFT JOIN produtos p ON p.uuid = m.produto_uuid
+        LEFT JOIN fornecedores f ON f.uuid = p.fornecedor_uuid
+        GROUP BY m.tipo
+    """)
+    movimentos_por_tipo = {row["tipo"]: dict(row) for row in cursor.fetchall()}
+    entradas = movimentos_por_tipo.get("entrada", {"total": 0, "vinculados": 0, "fornecedores": 0})
+
+    return {
+        "usuarios": {
+            "total": sum(usuarios_por_tipo.values()),
+            "agricultores": usuarios_por_tipo.get("agricultor", 0),
+            "admins": usuarios_por_tipo.get("admin", 0),
+        },
+        "produtos": {
+            "total": sum(produtos_por_status.values()),
+            "disponiveis": produtos_por_status.get("disponível", 0),
+            "a_vencer": produtos_por_status.get("a_vencer", 0),
+            "vencidos": produtos_por_status.get("vencido", 0),
+            "esgotados": produtos_por_status.get("esgotado", 0),
+        },
+        "fornecedores": {
+            "total": fornecedores["total"],
+            "ativos": fornecedores["ativos"],
+            "media_produtos": round(fornecedores["produtos_vinculados"] / max(fornecedores["total"], 1), 1),
+        },
+        "movimentos": {
+            "total": sum(tipo["total"] for tipo in movimentos_por_tipo.values()),
+            "entradas": entradas["total"],
+            "saidas": movimentos_por_tipo.get("saída", {"total": 0})["total"],
+            "media_entradas_por_fornecedor": round(entradas["vinculados"] / max(entradas["fornecedores"], 1), 1),
+        },
+    }
+
+
+class CacheEstatisticas:
+    def __init__(self, ttl: float = TTL_ESTATISTICAS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._valor = None
+        self._versoes = None
+        self._expira_em = 0.0
+        self._stats = {
+            "acertos": 0,
+            "faltas": 0,
+            "invalidacoes": 0,
+            "expiracoes": 0,
+            "ultimo_calculo_ms": None,
+        }
+
+    def obter(self, db) -> dict:
+        # Ler as versões são buscas pela chave primária; o cálculo só roda quando algo mudou
+        versoes = obter_versoes(db, COLECOES)
+        with self._lock:
+            if self._valor is not None:
+                if self._versoes != versoes:
+                    self._stats["invalidacoes"] += 1
+                elif time.monotonic() >= self._expira_em:
+                    self._stats["expiracoes"] += 1
+                else:
+                    self._stats["acertos"] += 1
+                    return self._valor
+            self._stats["faltas"] += 1
+
+        inicio = time.perf_counter()
+        valor = calcular_estatisticas(db)
+        duracao = round((time.perf_counter() - inicio) * 1000, 2)
+
+        with self._lock:
+            self._valor = valor
+            self._versoes = versoes
+            self._expira_em = time.monotonic() + self.ttl
+            self._stats["ultimo_calculo_ms"] = duracao
+        return valor
+
+    def limpar(self):
+        with self._lock:
+            self._valor = None
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            consultas = self._stats["acertos"] + self._stats["faltas"]
+            return {
+                **self._stats,
+                "taxa_acerto": round(self._stats["acertos"] / consultas, 3) if consultas else None,
+                "ttl": self.ttl,
+            }
+
+
+cache_estatisticas = CacheEstatisticas()
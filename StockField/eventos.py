@@ -0,0 +1,109 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+# Publicação de alertas para as páginas abertas (Server-Sent Events).
+# Cada conexão SSE assina os eventos do seu usuário; as escritas publicam
+# depois do commit, de qualquer thread (rotas, executor do banco, agendador).
+# É um barramento em memória: com vários workers, cada processo só avisa as
+# conexões que ele mesmo atende.
+
+TAMANHO_FILA = 100
+INTERVALO_PING = 25
+
+
+class CentralEventos:
+    def __init__(self):
+        # usuario_uuid -> {fila: loop da conexão}
+        self._assinantes = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def assinar(self, usuario_uuid: str) -> asyncio.Queue:
+        """Cria a fila de uma conexão; deve ser chamado dentro do loop de eventos."""
+        fila = asyncio.Queue(maxsize=TAMANHO_FILA)
+        with self._lock:
+            self._assinantes[usuario_uuid][fila] = asyncio.get_running_loop()
+        return fila
+
+    def cancelar(self, usuario_uuid: str, fila: asyncio.Queue):
+        with self._lock:
+            filas = self._assinantes.get(usuario_uuid)
+            if filas is not None:
+                filas.pop(fila, None)
+                if not filas:
+                    del self._assinantes[usuario_uuid]
+
+    def tem_assinantes(self, usuario_uuid: str) -> bool:
+        with self._lock:
+            return usuario_uuid in self._assinantes
+
+    def total_conexoes(self) -> int:
+        with self._lock:
+            return sum(len(filas) for filas in self._assinantes.values())
+
+    @staticmethod
+    def _entregar(fila: asyncio.Queue, evento):
+        if fila.full():
+            # Conexão lenta: descarta o evento mais antigo, o resumo seguinte corrige
+            fila.get_nowait()
+        fila.put_nowait(evento)
+
+    def publicar(self, usuario_uuid: str, tipo: str, dados):
+        with self._lock:
+            filas = list(self._assinantes.get(usuario_uuid, {}).items())
+        for fila, loop in filas:
+            try:
+                loop.call_soon_threadsafe(self._entregar, fila, (tipo, dados))
+            except RuntimeError:
+                # Loop já encerrado
+                self.cancelar(usuario_uuid, fila)
+
+
+central = CentralEventos()
+
+
+def formatar_evento(tipo: str, dados) -> str:
+    return f"event: {tipo}\ndata: {json.dumps(dados, ensure_ascii=False, default=str)}\n\n"
+
+
+def ler_resumo(db, usuario_uuid: str) -> dict:
+    linha = db.execute("""
+        SELECT estoque_baixo, estoque_esgotado, vencidos, a_vencer
+        FROM resumo_estoque WHERE usuario_uuid = ?
+    """, (usuario_uuid,)).fetchone()
+    if not linha:
+        return {"estoque_baixo": 0, "estoque_esgotado": 0, "vencidos": 0, "a_vencer": 0}
+    return dict(linha)
+
+
+def notificar_alertas(db, usuario_uuid: str, produtos_uuids=(), removidos=()):
+    """
+    Publica para o usuário os produtos alterados e o novo resumo de alertas.
+    Chamar depois do commit; sem conexões abertas do usuário não lê nada.
+    """
+    if not central.tem_assinantes(usuario_uuid):
+        return
+
+    produtos = [{"uuid": produto_uuid, "removido": True} for produto_uuid in removidos]
+    produtos_uuids = list(dict.fromkeys(produtos_uuids))
+    if produtos_uuids:
+        marcadores = ", ".join("?" * len(produtos_uuids))
+        cursor = db.execute(f"""
+            SELECT uuid, nome, quantidade, estoque_minimo, status, data_validade
+            FROM produtos WHERE usuario_uuid = ? AND uuid IN ({marcadores})
+        """, [usuario_uuid, *produtos_uuids])
+        produtos.extend(dict(row) for row in cursor.fetchall())
+
+    if produtos:
+        central.publicar(usuario_uuid, "produtos", produtos)
+    central.publicar(usuario_uuid, "resumo", ler_resumo(db, usuario_uuid))
+
+
+def notificar_verificacao_validade(db, resultado: dict):
+    """Publica as mudanças de status feitas pelo motor de vencimento, por usuário."""
+    por_usuario = defaultdict(list)
+    for produto in resultado["atualizados"]:
+        por_usuario[produto["usuario_uuid"]].append(produto["uuid"])
+    for usuario_uuid, produtos_uuids in por_usuario.items():
+        notificar_alertas(db, usuario_uuid, produtos_uuids)
@@ -0,0 +1,312 @@
+"""
+Gerador de dados sintéticos do StockField para testes de escala.
+
+Cria usuários (agricultores) com fornecedores, produtos, movimentações e
+eventos de auditoria direto no esquema do init_db, sem passar pelas rotas.
+Os números são por usuário; a mesma semente gera sempre os mesmos dados
+(as datas são relativas ao dia da geração).
+
+    python gerar_dados.py /tmp/escala.db
+    python gerar_dados.py /tmp/escala.db --usuarios 50 --produtos 2000 --movimentos 40000 --logs 10000
+    python gerar_dados.py /tmp/escala.db --semente 7 --substituir
+
+Todos os usuários gerados entram com a senha "sintetico" e CNPJ sint-000000,
+sint-000001, ...
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+import uuid
+from datetime import date, timedelta
+
+import models
+from auditoria import COMANDO_INSERIR
+from consumo import reconstruir_consumo
+from migracoes import ESCOPO_GLOBAL, SQL_RECONSTRUIR_CONTADORES, SQL_RECONSTRUIR_RESUMOS, SQL_RECONSTRUIR_ESTOQUE_DIARIO, SQL_RECONSTRUIR_BUSCA
+
+SENHA = "sintetico"
+TABELAS = ["usuarios", "fornecedores", "produtos", "movimentos", "razao_estoque", "logs"]
+
+# Só durante a carga: sem journal e sem fsync. Um erro no meio deixa o
+# arquivo inutilizável, o que é aceitável para um banco descartável.
+PRAGMAS_CARGA = [
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA locking_mode = EXCLUSIVE",
+    "PRAGMA cache_size = -262144",
+    "PRAGMA temp_store = MEMORY",
+]
+
+PRODUTOS_BASE = [
+    ("Semente de milho", "alimento"), ("Semente de feijão", "alimento"), ("Ração bovina", "alimento"),
+    ("Sal mineral", "alimento"), ("Adubo NPK", "outros"), ("Calcário", "outros"),
+    ("Herbicida", "defensivo"), ("Fungicida", "defensivo"), ("Inseticida", "defensivo"),
+    ("Arame liso", "outros"), ("Mangueira", "outros"), ("Vacina aftosa", "outros"),
+]
+
+
+def cnpj_usuario(indice: int) -> str:
+    return f"sint-{indice:06d}"
+
+
+class Gerador:
+    """Produz as linhas de cada usuário; toda a aleatoriedade vem de uma semente."""
+
+    def __init__(self, semente: int, fornecedores: int, produtos: int, movimentos: int, logs: int,
+                 concentracao: float, proporcao_saidas: float, horizonte: int, historico: int):
+        self.rnd = random.Random(semente)
+        self.fornecedores = fornecedores
+        self.produtos = produtos
+        self.movimentos = movimentos
+        self.logs = logs
+        self.proporcao_saidas = proporcao_saidas
+        self.horizonte = horizonte
+        self.historico = historico
+        self.hoje = date.today()
+        # Popularidade de Zipf: o produto de posição k recebe peso 1/k^s
+        self.pesos_acumulados = list(itertools.accumulate(1 / (k ** concentracao) for k in range(1, produtos + 1)))
+        self.datas = [(self.hoje - timedelta(days=d)).isoformat() for d in range(historico + 1)]
+
+    def _uuid(self) -> str:
+        return str(uuid.UUID(int=self.rnd.getrandbits(128), version=4))
+
+    def usuario(self, indice: int) -> dict:
+        rnd = self.rnd
+        usuario_uuid = self._uuid()
+        usuario = (usuario_uuid, cnpj_usuario(indice), f"Produtor Sintético {indice}",
+                   f"produtor{indice}@sintetico", hashlib.sha256(SENHA.encode()).hexdigest(), "agricultor")
+
+        fornecedores = [
+            (self._uuid(), f"Fornecedor {indice}-{i}", f"(84) 9{rnd.randrange(10000):04d}-{rnd.randrange(10000):04d}",
+             f"contato{i}@fornecedor{indice}.com", usuario_uuid)
+            for i in range(self.fornecedores)
+        ]
+
+        produtos = []
+        for i in range(self.produtos):
+            nome_base, categoria = rnd.choice(PRODUTOS_BASE)
+            # Validades espalhadas pelo horizonte, com uma parte já vencida e uma sem validade
+            if rnd.random() < 0.85:
+                validade = (self.hoje + timedelta(days=rnd.randint(-self.horizonte // 10, self.horizonte))).isoformat()
+            else:
+                validade = None
+            produtos.append({
+                "uuid": self._uuid(),
+                "nome": f"{nome_base} {i:05d}",
+                "categoria": categoria,
+                "fornecedor": rnd.choice(fornecedores),
+                "estoque_minimo": rnd.choice((0, 0, 5, 10, 20, 50)),
+                "data_validade": validade,
+                "quantidade": 0,
+            })
+        # A posição na lista de popularidade não segue a ordem dos nomes
+        populares = produtos[:]
+        rnd.shuffle(populares)
+
+        # Movimentações em ordem cronológica; saída só quando há saldo, então a
+        # quantidade final de cada produto é exatamente entradas - saídas
+        movimentos = []
+        escolhidos = rnd.choices(populares, cum_weights=self.pesos_acumulados, k=self.movimentos)
+        dias = sorted((rnd.randint(0, self.historico) for _ in range(self.movimentos)), reverse=True)
+        for produto, dia in zip(escolhidos, dias):
+            quantidade = rnd.randint(1, 50)
+            if produto["quantidade"] >= quantidade and rnd.random() < self.proporcao_saidas:
+                tipo = models.TipoMovimento.saida.value
+                produto["quantidade"] -= quantidade
+            else:
+                tipo = models.TipoMovimento.entrada.value
+                produto["quantidade"] += quantidade
+            movimentos.append((self._uuid(), produto["uuid"], tipo, quantidade, self.datas[dia],
+                               produto["fornecedor"][0], usuario_uuid))
+
+        linhas_produtos = [
+            (p["uuid"], p["nome"], f"{p['nome']} (dados sintéticos)", p["categoria"], p["quantidade"],
+             p["estoque_minimo"], round(rnd.uniform(2, 800), 2), p["data_validade"],
+             f"L{rnd.randrange(100000):05d}", p["fornecedor"][0],
+             models.status_apos_movimento(p["quantidade"], p["data_validade"]), usuario_uuid)
+            for p in produtos
+        ]
+
+        return {
+            "usuario": usuario,
+            "fornecedores": fornecedores,
+            "produtos": linhas_produtos,
+            "movimentos": movimentos,
+            # O que os gatilhos do razão gravariam: os produtos nascem com zero
+            "razao_estoque": [
+                (m[1], usuario_uuid, m[3] if m[2] == models.TipoMovimento.entrada.value else -m[3], f"{m[4]} 12:00:00")
+                for m in movimentos
+            ],
+            "logs": self._logs(usuario_uuid, produtos, fornecedores, movimentos),
+        }
+
+    def _logs(self, usuario_uuid: str, produtos: list, fornecedores: list, movimentos: list) -> list:
+        """Eventos de auditoria no formato do registrar_evento, das movimentações mais recentes."""
+        rnd = self.rnd
+        nomes = {p["uuid"]: p["nome"] for p in produtos}
+        nomes_fornecedores = {f[0]: f[1] for f in fornecedores}
+        logs = []
+        for m in movimentos[-self.logs:] if self.logs else []:
+            entrada = m[2] == models.TipoMovimento.entrada.value
+            dados = {
+                "produto": nomes[m[1]],
+                "variacao": m[3] if entrada else -m[3],
+                "fornecedor": nomes_fornecedores[m[5]],
+                "data": m[4],
+            }
+            logs.append((
+                self._uuid(), usuario_uuid, "Entrada de Estoque" if entrada else "Saída de Estoque",
+                "movimento", m[0], json.dumps(dados, ensure_ascii=False),
+                f"{m[4]} {rnd.randint(6, 18):02d}:{rnd.randint(0, 59):02d}",
+            ))
+        # Cadastros completam a cota quando há menos movimentações que logs
+        for p in produtos[:max(0, self.logs - len(logs))]:
+            logs.append((
+                self._uuid(), usuario_uuid, "Novo Produto Cadastrado", "produto", p["uuid"],
+                json.dumps({"produto": p["nome"], "quantidade": 0, "fornecedor": p["fornecedor"][1],
+                            "data_validade": p["data_validade"]}, ensure_ascii=False),
+                f"{self.datas[-1]} 08:00",
+            ))
+        return logs
+
+
+COMANDOS = {
+    "usuarios": "INSERT INTO usuarios (uuid, cnpj, nome, email, senha, tipo) VALUES (?, ?, ?, ?, ?, ?)",
+    "fornecedores": "INSERT INTO fornecedores (uuid, nome, telefone, email, usuario_uuid) VALUES (?, ?, ?, ?, ?)",
+    "produtos": """INSERT INTO produtos (uuid, nome, descricao, categoria, quantidade, estoque_minimo,
+        preco_unitario, data_validade, lote, fornecedor_uuid, status, usuario_uuid)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+    "movimentos": """INSERT INTO movimentos (uuid, produto_uuid, tipo, quantidade, data, fornecedor_uuid, usuario_uuid)
+        VALUES (?, ?, ?, ?, ?, ?, ?)""",
+    "razao_estoque": "INSERT INTO razao_estoque (produto_uuid, usuario_uuid, variacao, registrado_em) VALUES (?, ?, ?, ?)",
+    "logs": COMANDO_INSERIR,
+}
+
+
+def _remover_indices_e_gatilhos(conn: sqlite3.Connection) -> list:
+    """Remove índices secundários e gatilhos das tabelas carregadas; devolve o SQL para recriá-los."""
+    marcadores = ", ".join("?" * len(TABELAS))
+    objetos = conn.execute(f"""
+        SELECT type, name, sql FROM sqlite_master
+        WHERE type IN ('index', 'trigger') AND sql IS NOT NULL AND tbl_name IN ({marcadores})
+        ORDER BY type
+    """, TABELAS).fetchall()
+    for tipo, nome, _ in objetos:
+        conn.execute(f"DROP {tipo.upper()} {nome}")
+    return [sql for _, _, sql in objetos]
+
+
+def _incrementar_versoes(conn: sqlite3.Connection):
+    """Invalida caches e ETags, como os gatilhos de versão fariam a cada escrita."""
+    for tabela in ["usuarios", "fornecedores", "produtos", "movimentos"]:
+        dono = "uuid" if tabela == "usuarios" else "usuario_uuid"
+        conn.execute(f"""
+            INSERT INTO versoes_dados (escopo, colecao, versao)
+            SELECT DISTINCT {dono}, '{tabela}', 1 FROM {tabela} WHERE true
+            UNION ALL SELECT '{ESCOPO_GLOBAL}', '{tabela}', 1
+            ON CONFLICT (escopo, colecao) DO UPDATE SET versao = versao + 1
+        """)
+
+
+def gerar(caminho: str, usuarios: int, fornecedores: int, produtos: int, movimentos: int, logs: int,
+          semente: int = 42, concentracao: float = 1.1, proporcao_saidas: float = 0.45,
+          horizonte: int = 540, historico: int = 365, lote: int = 50000, progresso=print) -> dict:
+    """Gera os dados em `caminho` (criando o esquema) e devolve quantas linhas de cada tabela foram inseridas."""
+    models.DATABASE_URL = caminho
+    models.init_db()
+
+    gerador = Gerador(semente, fornecedores, produtos, movimentos, logs,
+                      concentracao, proporcao_saidas, horizonte, historico)
+    totais = dict.fromkeys(TABELAS, 0)
+    pendentes = {tabela: [] for tabela in TABELAS}
+
+    def descarregar(tabela):
+        conn.executemany(COMANDOS[tabela], pendentes[tabela])
+        totais[tabela] += len(pendentes[tabela])
+        pendentes[tabela] = []
+
+    conn = sqlite3.connect(caminho, isolation_level=None)
+    try:
+        for pragma in PRAGMAS_CARGA:
+            conn.execute(pragma)
+        conn.execute("BEGIN")
+        # Índices e gatilhos são recriados no fim: ordenar tudo de uma vez é
+        # bem mais rápido que manter cada índice linha a linha
+        recriar = _remover_indices_e_gatilhos(conn)
+
+        inicio = time.perf_counter()
+        for indice in range(usuarios):
+            linhas = gerador.usuario(indice)
+            pendentes["usuarios"].append(linhas["usuario"])
+            for tabela in TABELAS[1:]:
+                pendentes[tabela].extend(linhas[tabela])
+            for tabela in TABELAS:
+                if len(pendentes[tabela]) >= lote:
+                    descarregar(tabela)
+            if progresso and (indice + 1) % max(1, usuarios // 10) == 0:
+                progresso(f"  {indice + 1}/{usuarios} usuários, {totais['movimentos'] + len(pendentes['movimentos'])} "
+                          f"movimentações ({time.perf_counter() - inicio:.1f}s)")
+        for tabela in TABELAS:
+            descarregar(tabela)
+
+        if progresso:
+            progresso("Recriando índices e gatilhos e recalculando resumos...")
+        for sql in recriar:
+            conn.execute(sql)
+        for comando in [*SQL_RECONSTRUIR_CONTADORES, *SQL_RECONSTRUIR_RESUMOS, *SQL_RECONSTRUIR_ESTOQUE_DIARIO,
+                        *SQL_RECONSTRUIR_BUSCA]:
+            conn.execute(comando)
+        reconstruir_consumo(conn)
+        _incrementar_versoes(conn)
+        conn.execute("COMMIT")
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+    return totais
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("db", help="Arquivo do banco a gerar")
+    parser.add_argument("--usuarios", type=int, default=10)
+    parser.add_argument("--fornecedores", type=int, default=20, help="Por usuário")
+    parser.add_argument("--produtos", type=int, default=1000, help="Por usuário")
+    parser.add_argument("--movimentos", type=int, default=20000, help="Por usuário")
+    parser.add_argument("--logs", type=int, default=5000, help="Por usuário")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--concentracao", type=float, default=1.1,
+                        help="Expoente de Zipf da popularidade dos produtos (0 = uniforme)")
+    parser.add_argument("--proporcao-saidas", type=float, default=0.45,
+                        help="Chance de uma movimentação ser saída quando há saldo")
+    parser.add_argument("--horizonte", type=int, default=540, help="Validades até N dias à frente")
+    parser.add_argument("--historico", type=int, default=365, help="Movimentações dos últimos N dias")
+    parser.add_argument("--lote", type=int, default=50000, help="Linhas por executemany")
+    parser.add_argument("--substituir", action="store_true", help="Apaga o arquivo se ele já existir")
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        if not args.substituir:
+            sys.exit(f"{args.db} já existe; use --substituir para recriá-lo.")
+        for sufixo in ("", "-wal", "-shm"):
+            if os.path.exists(args.db + sufixo):
+                os.remove(args.db + sufixo)
+
+    inicio = time.perf_counter()
+    totais = gerar(args.db, args.usuarios, args.fornecedores, args.produtos, args.movimentos, args.logs,
+                   args.semente, args.concentracao, args.proporcao_saidas, args.horizonte,
+                   args.historico, args.lote)
+    duracao = time.perf_counter() - inicio
+    linhas = sum(totais.values())
+    print(f"{args.db} gerado em {duracao:.1f}s ({linhas / duracao:,.0f} linhas/s):")
+    for tabela, total in totais.items():
+        print(f"  {tabela}: {total:,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Comandos de manutenção do banco do StockField.
+
+    python gerenciar.py migrar
+    python gerenciar.py reconstruir-resumos
+"""
+import argparse
+import sqlite3
+
+import models
+
+
+def _conectar():
+    conn = sqlite3.connect(models.DATABASE_URL)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def migrar(args):
+    models.init_db()
+
+
+def reconstruir_resumos(args):
+    models.init_db()
+    with _conectar() as conn:
+        diferencas = models.reconstruir_resumos_estoque(conn)
+    if not diferencas:
+        print("Resumos reconstruídos: nenhuma divergência encontrada.")
+        return
+    print(f"Resumos reconstruídos: {len(diferencas)} divergência(s) corrigida(s).")
+    for d in diferencas:
+        print(f"  {d['usuario_uuid']} {d['campo']}: {d['gravado']} -> {d['recalculado']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="Caminho do banco (padrão: STOCKFIELD_DB ou ./stockfield.db)")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    comandos.add_parser("migrar", help="Aplica as migrações pendentes").set_defaults(func=migrar)
+    comandos.add_parser(
+        "reconstruir-resumos",
+        help="Recalcula os resumos de estoque e mostra as divergências"
+    ).set_defaults(func=reconstruir_resumos)
+
+    args = parser.parse_args()
+    if args.db:
+        models.DATABASE_URL = args.db
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import os
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from fastapi.responses import JSONResponse
+from fastapi.templating import Jinja2Templates
+from starlette.datastructures import MutableHeaders
+
+# Medição por requisição: comandos SQL e tempo gasto no banco, na
+# serialização e nos templates, devolvidos no cabeçalho Server-Timing.
+# A medição da requisição fica numa ContextVar, que chega às threads do
+# AnyIO e do executor do banco porque ambos copiam o contexto; fora de uma
+# requisição medida (ou com a instrumentação desligada) cada ponto de
+# medição custa só uma leitura da ContextVar.
+
+# STOCKFIELD_INSTRUMENTACAO=0 desliga o middleware
+INSTRUMENTACAO_ATIVA = os.environ.get("STOCKFIELD_INSTRUMENTACAO", "1") != "0"
+# Limiares (ms) do registro de requisições e consultas lentas
+LIMIAR_REQUISICAO_MS = float(os.environ.get("STOCKFIELD_LIMIAR_REQUISICAO_MS", "500"))
+LIMIAR_CONSULTA_MS = float(os.environ.get("STOCKFIELD_LIMIAR_CONSULTA_MS", "100"))
+
+FASES = ("db", "serializacao", "template")
+
+_medicao = ContextVar("stockfield_medicao", default=None)
+
+
+class Medicao:
+    __slots__ = ("inicio", "comandos", "tempos")
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.comandos = 0
+        self.tempos = dict.fromkeys(FASES, 0.0)
+
+    def server_timing(self) -> str:
+        total = (time.perf_counter() - self.inicio) * 1000
+        partes = [f'db;dur={self.tempos["db"]:.1f};desc="{self.comandos} comandos"']
+        partes += [f"{fase};dur={self.tempos[fase]:.1f}" for fase in FASES[1:] if self.tempos[fase]]
+        partes.append(f"total;dur={total:.1f}")
+        return ", ".join(partes)
+
+
+def medicao_atual():
+    return _medicao.get()
+
+
+@contextmanager
+def medir(fase: str):
+    """Soma a duração do bloco à fase da requisição atual (se houver)."""
+    medicao = _medicao.get()
+    if medicao is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        medicao.tempos[fase] += (time.perf_counter() - inicio) * 1000
+
+
+def forma_parametros(parametros) -> str:
+    """Tipos dos parâmetros, sem os valores (que podem ter dados pessoais)."""
+    if isinstance(parametros, dict):
+        return "{" + ", ".join(f"{chave}: {type(valor).__name__}" for chave, valor in parametros.items()) + "}"
+    if isinstance(parametros, (list, tuple)):
+        return "(" + ", ".join(type(valor).__name__ for valor in parametros) + ")"
+    return type(parametros).__name__
+
+
+def registrar_comando(medicao: Medicao, sql: str, parametros, duracao_ms: float, lote: bool = False):
+    medicao.comandos += 1
+    medicao.tempos["db"] += duracao_ms
+    if duracao_ms >= LIMIAR_CONSULTA_MS:
+        if not lote:
+            forma = forma_parametros(parametros)
+        elif isinstance(parametros, (list, tuple)) and parametros:
+            forma = f"{len(parametros)} x {forma_parametros(parametros[0])}"
+        else:
+            # Geradores já foram consumidos pelo executemany
+            forma = "lote"
+        texto = re.sub(r"\s+", " ", sql).strip()
+        print(f"Consulta lenta ({duracao_ms:.1f} ms): {texto} | parâmetros: {forma}")
+
+
+class RespostaJSON(JSONResponse):
+    """JSONResponse com a serialização medida."""
+
+    def render(self, content) -> bytes:
+        with medir("serializacao"):
+            return super().render(content)
+
+
+class TemplatesMedidos(Jinja2Templates):
+    """Jinja2Templates com a renderização medida."""
+
+    def TemplateResponse(self, *args, **kwargs):
+        with medir("template"):
+            return super().TemplateResponse(*args, **kwargs)
+
+
+class Instrumentacao:
+    """Middleware ASGI: abre a medição, devolve Server-Timing e registra requisições lentas."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        medicao = Medicao()
+        token = _medicao.set(medicao)
+        continua = False
+
+        async def enviar(message):
+            nonlocal continua
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers["Server-Timing"] = medicao.server_timing()
+                # Streams de eventos ficam abertos de propósito
+                continua = headers.get("content-type", "").startswith("text/event-stream")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            _medicao.reset(token)
+            total = (time.perf_counter() - medicao.inicio) * 1000
+            if total >= LIMIAR_REQUISICAO_MS and not continua:
+                tempos = ", ".join(f"{fase} {medicao.tempos[fase]:.1f} ms" for fase in FASES)
+                print(f"Requisição lenta ({total:.1f} ms): {scope['method']} {scope['path']} | "
+                      f"{medicao.comandos} comandos SQL, {tempos}")
@@ -1,38 +1,77 @@
 #pip install fastapi uvicorn pydantic
 #uvicorn main:app
 
-from fastapi import FastAPI, Request, Form, Depends, HTTPException
+from fastapi import FastAPI, Request, Response, Form, Depends, HTTPException, Query
 from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse, StreamingResponse
-from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware
-from typing import List
+from starlette.datastructures import Headers, MutableHeaders
+from contextlib import asynccontextmanager
+import asyncio
+from typing import List, Optional
 from datetime import date
 import uuid
 import sqlite3
 import hashlib
 import os
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.utils import ImageReader
+import re
+import unicodedata
+from urllib.parse import quote
+
+from models import Produto, Usuario, Fornecedor, Movimento, LoteMovimentos, init_db, get_db, TipoUsuario, TipoMovimento, StatusProduto, obter_logo, gerar_pdf_logs, ler_em_blocos, obter_pool, carregar_fornecedores_detalhados, paginar, iterar_paginas, obter_total, obter_versoes, TAMANHO_PAGINA, TAMANHO_PAGINA_MAXIMO, aplicar_variacao_estoque, quantidade_no_razao, executar_db, obter_executor_db, encerrar_banco, registrar_movimentos_lote, TAMANHO_LOTE_MAXIMO, buscar_produtos, Categoria, consulta_produtos, ORDENACOES_PRODUTOS
+from estatisticas import cache_estatisticas
+from agendador import iniciar_agendador, parar_agendador, listar_tarefas
+from auditoria import registrar_evento, carregar_dados
+from serializacao import serializar_linhas
+from instrumentacao import Instrumentacao, RespostaJSON, TemplatesMedidos, INSTRUMENTACAO_ATIVA
+from metricas import registro, MetricasRequisicoes, DURACAO_PDF, METRICAS_ATIVAS, METRICAS_ABERTAS
+from consumo import registrar_consumo, carregar_previsoes, ORDENACOES_PREVISAO
+from eventos import central, formatar_evento, ler_resumo, notificar_alertas, notificar_verificacao_validade, INTERVALO_PING
 
-from models import Produto, Usuario, Fornecedor, Movimento, init_db, get_db, TipoUsuario, TipoMovimento, StatusProduto, registrar_log, cortar_logo, gerar_pdf_logs
+ALERTA_DIAS = 7
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    agendador = iniciar_agendador(ALERTA_DIAS)
+    yield
+    parar_agendador(agendador)
+    encerrar_banco()
+
+class CabecalhosCORS:
+    """Middleware ASGI puro: só acrescenta os cabeçalhos CORS na resposta, sem outra volta pelo loop."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        origem = Headers(scope=scope).get("origin", "*")
+
+        async def enviar(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers["Access-Control-Allow-Credentials"] = "true"
+                headers["Access-Control-Allow-Origin"] = origem
+                headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
+                headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization"
+            await send(message)
+
+        await self.app(scope, receive, enviar)
+
+app = FastAPI(lifespan=lifespan, default_response_class=RespostaJSON)
 app.add_middleware(SessionMiddleware, secret_key="chave_super_secreta")
+app.add_middleware(CabecalhosCORS)
+if METRICAS_ATIVAS:
+    app.add_middleware(MetricasRequisicoes)
+if INSTRUMENTACAO_ATIVA:
+    # Por último, para ser o mais externo e medir a requisição inteira
+    app.add_middleware(Instrumentacao)
 init_db()
+obter_logo()
 app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
-
-@app.middleware("http")
-async def add_cors_headers(request: Request, call_next):
-    response = await call_next(request)
-    response.headers["Access-Control-Allow-Credentials"] = "true"
-    response.headers["Access-Control-Allow-Origin"] = request.headers.get("origin", "*")
-    response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
-    response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization"
-    return response
-
-ALERTA_DIAS = 7
+templates = TemplatesMedidos(directory="templates")
 
 def flash(request: Request, message: str, category: str = "info"):
     if "messages" not in request.session:
@@ -43,14 +82,68 @@ def get_flashed_messages(request: Request):
     messages = request.session.pop("messages") if "messages" in request.session else []
     return messages
 
+def buscar_pagina(db, response: Response, sql, params, ordem, colecao, escopo="*",
+                  descendente=False, pagina=None, limite=None, chaves=None, filtrada=False):
+    """
+    Executa uma listagem paginada e informa o próximo cursor e o total nos
+    cabeçalhos. Sem `limite` devolve uma página de TAMANHO_PAGINA linhas.
+    O total vem do contador da coleção, então uma listagem `filtrada` não
+    o envia (seria o total sem os filtros).
+    """
+    try:
+        linhas, proximo = paginar(db, sql, params, ordem, descendente, pagina, limite or TAMANHO_PAGINA, chaves)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not filtrada:
+        response.headers["X-Total-Estimado"] = str(obter_total(db, colecao, escopo))
+    if proximo:
+        response.headers["X-Proximo-Cursor"] = proximo
+    return linhas
+
+def validar_ordenacao_produtos(ordenar_por: str, ordem: str):
+    if ordenar_por not in ORDENACOES_PRODUTOS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Ordenação inválida: {ordenar_por}. Disponíveis: {', '.join(ORDENACOES_PRODUTOS)}"
+        )
+    if ordem not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="Ordem inválida: use asc ou desc")
+
+# As listagens são revalidadas a cada uso: o navegador reenvia a ETag em
+# If-None-Match e recebe 304 enquanto as coleções não mudarem
+CACHE_REVALIDAR = "private, no-cache"
+
+def calcular_etag(db, request: Request, escopo: str, colecoes: List[str], *variantes: str) -> str:
+    """
+    ETag forte a partir das versões das coleções lidas pela resposta (sem ler
+    as tabelas). `variantes` entram no hash quando a resposta depende de algo
+    além dos dados, como a data do dia.
+    """
+    versoes = obter_versoes(db, colecoes, escopo)
+    base = "|".join([escopo, request.url.path, request.url.query, *variantes,
+                     *(f"{colecao}:{versao}" for colecao, versao in versoes.items())])
+    return '"' + hashlib.sha256(base.encode()).hexdigest()[:32] + '"'
+
+def etag_confere(request: Request, etag: str) -> bool:
+    cabecalho = request.headers.get("if-none-match")
+    if not cabecalho:
+        return False
+    # If-None-Match usa comparação fraca: W/"x" confere com "x"
+    etags = [valor.strip().removeprefix("W/") for valor in cabecalho.split(",")]
+    return "*" in etags or etag in etags
+
+def marcar_etag(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_REVALIDAR
+
+def nao_modificado(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_REVALIDAR})
+
+def cabecalho_anexo(nome_arquivo: str) -> str:
+    """Content-Disposition para nomes com acento: versão ASCII de reserva e filename* em UTF-8."""
+    reserva = unicodedata.normalize("NFKD", nome_arquivo).encode("ascii", "ignore").decode()
+    return f"attachment; filename=\"{reserva}\"; filename*=UTF-8''{quote(nome_arquivo)}"
 
-@app.middleware("http")
-async def verificar_alertas_middleware(request: Request, call_next):
-    response = await call_next(request)
-    if request.url.path == "/login" and request.method == "POST":
-        pass
-    
-    return response
 
 #ROTAS
 @app.get("/", response_class=HTMLResponse)
@@ -88,6 +181,8 @@ def login_action(
         "tipo": user["tipo"]
     }
 
+    # Os resumos são mantidos pelos gatilhos e pela tarefa agendada de
+    # vencimentos, então o login só lê a linha do usuário
     from models import obter_resumo_estoque
     resumo_estoque = obter_resumo_estoque(db, user["uuid"])
     
@@ -106,9 +201,8 @@ def login_action(
         flash(request, mensagem_estoque, "warning")
     
 
-    from models import verificar_produtos_a_vencer, obter_resumo_alertas
+    from models import obter_resumo_alertas
     
-    resultado = verificar_produtos_a_vencer(db, ALERTA_DIAS)
     resumo = obter_resumo_alertas(db, user["uuid"])
     
     if resumo["total_alertas"] > 0:
@@ -233,20 +327,16 @@ def profile_admin(request: Request):
 
 
 @app.get("/api/alertas/vencimento")
-def obter_alertas_vencimento_api(
-    request: Request,
-    db: sqlite3.Connection = Depends(get_db)
-):
+async def obter_alertas_vencimento_api(request: Request):
     """API para obter alertas de vencimento"""
     if "user" not in request.session:
         raise HTTPException(status_code=401, detail="Não autorizado")
     
-    from models import obter_alertas_vencimento, verificar_produtos_a_vencer
-    
-    verificar_produtos_a_vencer(db, ALERTA_DIAS)
+    from models import obter_alertas_vencimento
     
+    # Os status são mantidos pela tarefa agendada de vencimentos
     usuario_uuid = request.session["user"]["uuid"]
-    alertas = obter_alertas_vencimento(db, usuario_uuid, ALERTA_DIAS)
+    alertas = await executar_db(obter_alertas_vencimento, usuario_uuid, ALERTA_DIAS)
     
     return {
         "alertas": alertas,
@@ -256,10 +346,7 @@ def obter_alertas_vencimento_api(
     }
 
 @app.get("/api/alertas/resumo")
-def obter_resumo_alertas_api(
-    request: Request,
-    db: sqlite3.Connection = Depends(get_db)
-):
+async def obter_resumo_alertas_api(request: Request):
     """API para obter resumo de alertas"""
     if "user" not in request.session:
         raise HTTPException(status_code=401, detail="Não autorizado")
@@ -267,7 +354,7 @@ def obter_resumo_alertas_api(
     from models import obter_resumo_alertas
     
     usuario_uuid = request.session["user"]["uuid"]
-    resumo = obter_resumo_alertas(db, usuario_uuid)
+    resumo = await executar_db(obter_resumo_alertas, usuario_uuid)
     
     return resumo
 
@@ -330,31 +417,38 @@ def pagina_movimentacoes(request: Request):
     })
 
 @app.get("/movimentos/", response_model=List[Movimento])
-def listar_movimentos(request: Request, db: sqlite3.Connection = Depends(get_db)):
+async def listar_movimentos(
+    request: Request,
+    response: Response,
+    pagina: Optional[str] = Query(None, alias="cursor"),
+    limite: Optional[int] = Query(None, ge=1, le=TAMANHO_PAGINA_MAXIMO)
+):
     if "user" not in request.session:
         flash(request, "Você precisa fazer login para acessar esta página.", "error")
         url = request.url_for("login")
         return RedirectResponse(url=url, status_code=303)
-    cursor = db.cursor()
     usuario_uuid = request.session["user"]["uuid"]  
-    cursor.execute("""
-        SELECT m.*, p.nome as produto_nome, f.nome as fornecedor_nome 
-        FROM movimentos m
-        LEFT JOIN produtos p ON m.produto_uuid = p.uuid
-        LEFT JOIN fornecedores f ON m.fornecedor_uuid = f.uuid
-        WHERE m.usuario_uuid = ?  
-        ORDER BY m.data DESC
-    """, (usuario_uuid,))
-    movimentos_data = cursor.fetchall()
-    
-    movimentos = []
-    for row in movimentos_data:
-        movimento_dict = dict(row)
-        movimento_dict["data"] = date.fromisoformat(movimento_dict["data"])
-        movimento = Movimento(**movimento_dict)
-        movimentos.append(movimento)
-    
-    return movimentos
+
+    def consultar(db):
+        etag = calcular_etag(db, request, usuario_uuid, ["movimentos", "produtos", "fornecedores"])
+        if etag_confere(request, etag):
+            return None, etag
+        movimentos_data = buscar_pagina(db, response, """
+            SELECT m.*, p.nome as produto_nome, f.nome as fornecedor_nome 
+            FROM movimentos m
+            LEFT JOIN produtos p ON m.produto_uuid = p.uuid
+            LEFT JOIN fornecedores f ON m.fornecedor_uuid = f.uuid
+            WHERE m.usuario_uuid = ? {pagina}
+        """, [usuario_uuid], ["m.data", "m.uuid"], "movimentos", usuario_uuid,
+            descendente=True, pagina=pagina, limite=limite)
+        # Linhas lidas do banco vão direto para JSON, sem instanciar Movimento
+        return serializar_linhas(Movimento, movimentos_data), etag
+    
+    conteudo, etag = await executar_db(consultar)
+    if conteudo is None:
+        return nao_modificado(etag)
+    marcar_etag(response, etag)
+    return Response(content=conteudo, media_type="application/json", headers=response.headers)
 
 @app.get("/produtos/{uuid}", response_model=Produto)
 def obter_produto_por_uuid(request:Request, uuid: str, db: sqlite3.Connection = Depends(get_db)):
@@ -375,139 +469,163 @@ def obter_produto_por_uuid(request:Request, uuid: str, db: sqlite3.Connection =
 
 #MAIS UMA MATEUSSSSSSSSSS
 @app.post("/movimentos/entrada", response_model=Movimento)
-def registrar_entrada(movimento: Movimento, request: Request, db: sqlite3.Connection = Depends(get_db)):
+async def registrar_entrada(movimento: Movimento, request: Request):
     if "user" not in request.session:
         flash(request, "Você precisa fazer login para acessar esta página.", "error")
         url = request.url_for("login")
         return RedirectResponse(url=url, status_code=303)
-    cursor = db.cursor()
-    usuario_uuid = str(request.session["user"]["uuid"])
-    movimento.usuario_uuid = usuario_uuid
 
-    cursor.execute("SELECT * FROM produtos WHERE uuid = ? AND usuario_uuid = ?", (movimento.produto_uuid, movimento.usuario_uuid))
-    produto = cursor.fetchone()
-    if not produto:
-        raise HTTPException(status_code=404, detail="Produto não encontrado ou não pertence ao usuário.")
-    
-    cursor.execute("SELECT * FROM fornecedores WHERE uuid = ?", (movimento.fornecedor_uuid,))
-    fornecedor = cursor.fetchone()
-    if not fornecedor:
-        raise HTTPException(status_code=404, detail="Fornecedor não encontrado.")
-    
-    movimento.uuid = str(uuid.uuid4())
-    movimento.tipo = TipoMovimento.entrada
-
-    cursor.execute(
-        "INSERT INTO movimentos VALUES (?, ?, ?, ?, ?, ?, ?)",
-        (
-            movimento.uuid,
-            movimento.produto_uuid,
-            movimento.tipo.value,
-            movimento.quantidade,
-            movimento.data.isoformat(),
-            movimento.fornecedor_uuid,
-            movimento.usuario_uuid  
+    def registrar(db):
+        cursor = db.cursor()
+        usuario_uuid = str(request.session["user"]["uuid"])
+        movimento.usuario_uuid = usuario_uuid
+
+        # A soma é feita pelo próprio banco; nenhuma leitura antes da escrita
+        produto = aplicar_variacao_estoque(db, movimento.produto_uuid, usuario_uuid, movimento.quantidade, ALERTA_DIAS)
+        if not produto:
+            raise HTTPException(status_code=404, detail="Produto não encontrado ou não pertence ao usuário.")
+    
+        cursor.execute("SELECT * FROM fornecedores WHERE uuid = ?", (movimento.fornecedor_uuid,))
+        fornecedor = cursor.fetchone()
+        if not fornecedor:
+            raise HTTPException(status_code=404, detail="Fornecedor não encontrado.")
+    
+        movimento.uuid = str(uuid.uuid4())
+        movimento.tipo = TipoMovimento.entrada
+
+        cursor.execute(
+            "INSERT INTO movimentos VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                movimento.uuid,
+                movimento.produto_uuid,
+                movimento.tipo.value,
+                movimento.quantidade,
+                movimento.data.isoformat(),
+                movimento.fornecedor_uuid,
+                movimento.usuario_uuid  
+            )
         )
-    )
 
-    nova_quantidade = produto["quantidade"] + movimento.quantidade
-    novo_status = "disponível" if nova_quantidade > 0 else "esgotado"
-
-    cursor.execute(
-        "UPDATE produtos SET quantidade = ?, status = ? WHERE uuid = ?",
-        (nova_quantidade, novo_status, movimento.produto_uuid)
-    )
-
-    from models import verificar_estoque_baixo
-    alertas_estoque = verificar_estoque_baixo(db, usuario_uuid)
-    
-    if alertas_estoque:
-        request.session["alertas_estoque"] = {
-            "total": len(alertas_estoque),
-            "data_verificacao": date.today().isoformat()
-        }
-    
-    db.commit()
+        # Lido do resumo mantido pelos gatilhos (o UPDATE acima já o atualizou)
+        from models import obter_resumo_estoque
+        resumo_estoque = obter_resumo_estoque(db, usuario_uuid)
+    
+        if resumo_estoque["total_alertas"] > 0:
+            request.session["alertas_estoque"] = {
+                "total": resumo_estoque["total_alertas"],
+                "data_verificacao": date.today().isoformat()
+            }
+
+        # Registrar log da entrada (mesma transação da movimentação)
+        registrar_evento(
+            db, usuario_uuid, "Entrada de Estoque", "movimento", movimento.uuid,
+            produto=produto["nome"],
+            variacao=movimento.quantidade,
+            fornecedor=fornecedor["nome"],
+            data=movimento.data.isoformat()
+        )
+        db.commit()
+        notificar_alertas(db, usuario_uuid, [movimento.produto_uuid])
 
-    # Registrar log da entrada
-    detalhes = (
-    f"Movimento UUID: {movimento.uuid} | "
-    f"Produto: {produto['nome']} | "
-    f"Quantidade: +{movimento.quantidade} unidades | "
-    f"Fornecedor: {fornecedor['nome']} | "
-    f"Data: {movimento.data.isoformat()}"
-)
-    registrar_log(db, usuario_uuid, "Entrada de Estoque", detalhes)
+        return movimento
 
-    return movimento
+    return await executar_db(registrar)
 
 #MATEUSSSSSSSSSSSSSSSSSSSS
 @app.post("/movimentos/saida", response_model=Movimento)
-def registrar_saida(movimento: Movimento, request: Request, db: sqlite3.Connection = Depends(get_db)):
+async def registrar_saida(movimento: Movimento, request: Request):
     if "user" not in request.session:
         flash(request, "Você precisa fazer login para acessar esta página.", "error")
         url = request.url_for("login")
         return RedirectResponse(url=url, status_code=303)
-    cursor = db.cursor()
-    usuario_uuid = str(request.session["user"]["uuid"])
-    cursor.execute("SELECT * FROM produtos WHERE uuid = ? AND usuario_uuid = ?", (movimento.produto_uuid, usuario_uuid))
-    produto = cursor.fetchone()
-    if not produto:
-        raise HTTPException(status_code=404, detail="Produto não encontrado ou não pertence ao usuário.")
-    
-    if produto["quantidade"] < movimento.quantidade:
-        raise HTTPException(status_code=400, detail="Estoque insuficiente")
-    
-    cursor.execute("SELECT * FROM fornecedores WHERE uuid = ?", (movimento.fornecedor_uuid,))
-    fornecedor = cursor.fetchone()
-    if not fornecedor:
-        raise HTTPException(status_code=404, detail="Fornecedor não encontrado")
+
+    def registrar(db):
+        cursor = db.cursor()
+        usuario_uuid = str(request.session["user"]["uuid"])
+        # Checagem de saldo e baixa num único UPDATE condicional
+        produto = aplicar_variacao_estoque(db, movimento.produto_uuid, usuario_uuid, -movimento.quantidade, ALERTA_DIAS)
+        if not produto:
+            cursor.execute("SELECT 1 FROM produtos WHERE uuid = ? AND usuario_uuid = ?", (movimento.produto_uuid, usuario_uuid))
+            if not cursor.fetchone():
+                raise HTTPException(status_code=404, detail="Produto não encontrado ou não pertence ao usuário.")
+            raise HTTPException(status_code=400, detail="Estoque insuficiente")
+    
+        cursor.execute("SELECT * FROM fornecedores WHERE uuid = ?", (movimento.fornecedor_uuid,))
+        fornecedor = cursor.fetchone()
+        if not fornecedor:
+            raise HTTPException(status_code=404, detail="Fornecedor não encontrado")
    
-    movimento.uuid = str(uuid.uuid4())
-    movimento.tipo = TipoMovimento.saida
-    movimento.usuario_uuid = usuario_uuid
-    
-    cursor.execute(
-        "INSERT INTO movimentos VALUES (?, ?, ?, ?, ?, ?, ?)",
-        (
-            movimento.uuid,
-            movimento.produto_uuid,
-            movimento.tipo.value,
-            movimento.quantidade,
-            movimento.data.isoformat(),
-            movimento.fornecedor_uuid,
-            movimento.usuario_uuid 
+        movimento.uuid = str(uuid.uuid4())
+        movimento.tipo = TipoMovimento.saida
+        movimento.usuario_uuid = usuario_uuid
+    
+        cursor.execute(
+            "INSERT INTO movimentos VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                movimento.uuid,
+                movimento.produto_uuid,
+                movimento.tipo.value,
+                movimento.quantidade,
+                movimento.data.isoformat(),
+                movimento.fornecedor_uuid,
+                movimento.usuario_uuid 
+            )
         )
-    )
-    
-    nova_quantidade = produto["quantidade"] - movimento.quantidade
-    novo_status = "disponível" if nova_quantidade > 0 else "esgotado"
-    
-    cursor.execute(
-        "UPDATE produtos SET quantidade = ?, status = ? WHERE uuid = ?",
-        (nova_quantidade, novo_status, movimento.produto_uuid)
-    )
+        registrar_consumo(db, movimento.produto_uuid, movimento.quantidade, movimento.data)
+
+        # Lido do resumo mantido pelos gatilhos (o UPDATE acima já o atualizou)
+        from models import obter_resumo_estoque
+        resumo_estoque = obter_resumo_estoque(db, usuario_uuid)
+    
+        if resumo_estoque["total_alertas"] > 0:
+            request.session["alertas_estoque"] = {
+                "total": resumo_estoque["total_alertas"],
+                "data_verificacao": date.today().isoformat()
+            }
+
+        registrar_evento(
+            db, usuario_uuid, "Saída de Estoque", "movimento", movimento.uuid,
+            produto=produto["nome"],
+            variacao=-movimento.quantidade,
+            fornecedor=fornecedor["nome"],
+            data=movimento.data.isoformat()
+        )
+        db.commit()
+        notificar_alertas(db, usuario_uuid, [movimento.produto_uuid])
 
-    from models import verificar_estoque_baixo
-    alertas_estoque = verificar_estoque_baixo(db, usuario_uuid)
-    
-    if alertas_estoque:
+        return movimento
+
+    return await executar_db(registrar)
+
+@app.post("/movimentos/lote")
+async def registrar_lote(lote: LoteMovimentos, request: Request):
+    """Registra várias entradas e saídas de uma vez, com o resultado de cada linha"""
+    if "user" not in request.session:
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    if not lote.movimentos:
+        raise HTTPException(status_code=400, detail="O lote não contém movimentos")
+    if len(lote.movimentos) > TAMANHO_LOTE_MAXIMO:
+        raise HTTPException(status_code=400, detail=f"O lote aceita no máximo {TAMANHO_LOTE_MAXIMO} movimentos")
+
+    usuario_uuid = str(request.session["user"]["uuid"])
+
+    def registrar(db):
+        from models import obter_resumo_estoque
+        resultado = registrar_movimentos_lote(db, lote.movimentos, usuario_uuid, ALERTA_DIAS)
+        notificar_alertas(db, usuario_uuid, [
+            linha["movimento"].produto_uuid for linha in resultado["resultados"] if linha["status"] == "ok"
+        ])
+        return resultado, obter_resumo_estoque(db, usuario_uuid)
+
+    resultado, resumo_estoque = await executar_db(registrar)
+
+    if resumo_estoque["total_alertas"] > 0:
         request.session["alertas_estoque"] = {
-            "total": len(alertas_estoque),
+            "total": resumo_estoque["total_alertas"],
             "data_verificacao": date.today().isoformat()
         }
-    
-    db.commit()
 
-    detalhes = (
-        f"Movimento UUID: {movimento.uuid} | "
-        f"Produto: {produto['nome']} | "
-        f"Quantidade: -{movimento.quantidade} unidades | "
-        f"Data: {movimento.data.isoformat()}"
-    )
-    registrar_log(db, usuario_uuid, "Saída de Estoque", detalhes)
-
-    return movimento
+    return resultado
 
 
 # ROTAS DA API - CORREÇÃO DAS ROTAS CRÍTICAS
@@ -524,66 +642,69 @@ def cadastrar_usuario(usuario: Usuario, db: sqlite3.Connection = Depends(get_db)
 
 
 @app.post("/produtos/", response_model=Produto)
-def cadastrar_produto(request: Request, produto: Produto, db: sqlite3.Connection = Depends(get_db)):
+async def cadastrar_produto(request: Request, produto: Produto):
     if "user" not in request.session:
         flash(request, "Você precisa fazer login para acessar esta página.", "error")
         url = request.url_for("login")
         return RedirectResponse(url=url, status_code=303)
-    cursor = db.cursor()
-    produto.uuid = str(uuid.uuid4())
-    usuario_uuid = request.session["user"]["uuid"]
-    produto.usuario_uuid = usuario_uuid
-    
-    dias_para_vencer = None
-    if produto.data_validade:
-        hoje = date.today()
-        dias_restantes = (produto.data_validade - hoje).days
-        
-        if dias_restantes < 0:
-            produto.status = StatusProduto.vencido
-            dias_para_vencer = dias_restantes
-        elif dias_restantes <= ALERTA_DIAS:
-            produto.status = StatusProduto.a_vencer
-            dias_para_vencer = dias_restantes
-        else:
-            dias_para_vencer = dias_restantes
 
-    cursor.execute("SELECT * FROM fornecedores WHERE uuid = ?", (produto.fornecedor_uuid,))
-    fornecedor = cursor.fetchone()
+    def cadastrar(db):
+        cursor = db.cursor()
+        produto.uuid = str(uuid.uuid4())
+        usuario_uuid = request.session["user"]["uuid"]
+        produto.usuario_uuid = usuario_uuid
     
-    cursor.execute(
-        "INSERT INTO produtos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",  
-        (
-            produto.uuid,                    
-            produto.nome,                    
-            produto.descricao,               
-            produto.categoria,               
-            produto.numero_anvisa,           
-            produto.cuidados_armazenamento,  
-            produto.tipo_toxico,             
-            produto.quantidade,              
-            produto.estoque_minimo,          
-            produto.preco_unitario,          
-            produto.data_validade.isoformat() if produto.data_validade else None, 
-            produto.lote,                    
-            produto.fornecedor_uuid,         
-            produto.localizacao,             
-            produto.status.value,            
-            usuario_uuid,                    
-            dias_para_vencer,                 
+        dias_para_vencer = None
+        if produto.data_validade:
+            hoje = date.today()
+            dias_restantes = (produto.data_validade - hoje).days
+        
+            if dias_restantes < 0:
+                produto.status = StatusProduto.vencido
+                dias_para_vencer = dias_restantes
+            elif dias_restantes <= ALERTA_DIAS:
+                produto.status = StatusProduto.a_vencer
+                dias_para_vencer = dias_restantes
+            else:
+                dias_para_vencer = dias_restantes
+
+        cursor.execute("SELECT * FROM fornecedores WHERE uuid = ?", (produto.fornecedor_uuid,))
+        fornecedor = cursor.fetchone()
+    
+        cursor.execute(
+            "INSERT INTO produtos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",  
+            (
+                produto.uuid,                    
+                produto.nome,                    
+                produto.descricao,               
+                produto.categoria,               
+                produto.numero_anvisa,           
+                produto.cuidados_armazenamento,  
+                produto.tipo_toxico,             
+                produto.quantidade,              
+                produto.estoque_minimo,          
+                produto.preco_unitario,          
+                produto.data_validade.isoformat() if produto.data_validade else None, 
+                produto.lote,                    
+                produto.fornecedor_uuid,         
+                produto.localizacao,             
+                produto.status.value,            
+                usuario_uuid,                    
+                dias_para_vencer,                 
+            )
         )
-    )
-    db.commit()
-    
-    detalhes = (
-        f"UUID: {produto.uuid} | "
-        f"Produto: {produto.nome}| "
-        f"Quantidade: {produto.quantidade} unidades | "
-        f"Fornecedor: {fornecedor['nome']} | "
-        f"Data de validade: {produto.data_validade.isoformat()}"
-    )
-    registrar_log(db, usuario_uuid, "Novo Produto Cadastrado", detalhes)
-    return produto
+        registrar_evento(
+            db, usuario_uuid, "Novo Produto Cadastrado", "produto", produto.uuid,
+            produto=produto.nome,
+            quantidade=produto.quantidade,
+            fornecedor=fornecedor["nome"] if fornecedor else None,
+            data_validade=produto.data_validade.isoformat() if produto.data_validade else None
+        )
+        db.commit()
+        notificar_alertas(db, usuario_uuid, [produto.uuid])
+        return produto
+
+    return await executar_db(cadastrar)
 
 
 @app.get("/produtos_admin", response_class=HTMLResponse)
@@ -618,13 +739,8 @@ def cadastrar_fornecedor(request:Request, fornecedor: Fornecedor, db: sqlite3.Co
         "INSERT INTO fornecedores VALUES (?, ?, ?, ?, ?)",
         (fornecedor.uuid, fornecedor.nome, fornecedor.telefone, fornecedor.email, usuario_uuid)
     )
+    registrar_evento(db, usuario_uuid, "Novo Fornecedor Cadastrado", "fornecedor", fornecedor.uuid, nome=fornecedor.nome)
     db.commit()
-
-    detalhes = (
-        f"UUID: {fornecedor.uuid} | "
-        f"Nome: {fornecedor.nome} | "
-    )
-    registrar_log(db, usuario_uuid, "Novo Fornecedor Cadastrado", detalhes)
     return fornecedor
 
 @app.get("/fornecedores_admin", response_class=HTMLResponse)
@@ -648,29 +764,50 @@ def pagina_fornecedores_admin(request: Request):
 
 
 @app.get("/produtos/", response_model=List[Produto])
-def listar_produtos(request: Request, db: sqlite3.Connection = Depends(get_db)):
+async def listar_produtos(
+    request: Request,
+    response: Response,
+    pagina: Optional[str] = Query(None, alias="cursor"),
+    limite: Optional[int] = Query(None, ge=1, le=TAMANHO_PAGINA_MAXIMO),
+    categoria: Optional[Categoria] = None,
+    status: Optional[StatusProduto] = None,
+    fornecedor_uuid: Optional[str] = None,
+    vence_ate: Optional[date] = None,
+    estoque_baixo: bool = False,
+    ordenar_por: str = "nome",
+    ordem: str = "asc"
+):
     if "user" not in request.session:
         flash(request, "Você precisa fazer login para acessar esta página.", "error")
         url = request.url_for("login")
         return RedirectResponse(url=url, status_code=303)
-    cursor = db.cursor()
+    validar_ordenacao_produtos(ordenar_por, ordem)
     usuario_uuid = request.session["user"]["uuid"] 
-    
-    cursor.execute("""
-        SELECT p.*, f.nome as fornecedor_nome 
-        FROM produtos p
-        LEFT JOIN fornecedores f ON p.fornecedor_uuid = f.uuid
-        WHERE p.usuario_uuid = ?
-        ORDER BY p.nome
-    """, (usuario_uuid,))
-    
-    produtos = []
-    for row in cursor.fetchall():
-        produto_dict = dict(row)
-        if produto_dict["data_validade"]:
-            produto_dict["data_validade"] = date.fromisoformat(produto_dict["data_validade"])
-        produtos.append(Produto(**produto_dict))
-    return produtos
+    filtros = {
+        "categoria": categoria.value if categoria else None,
+        "status": status.value if status else None,
+        "fornecedor_uuid": fornecedor_uuid,
+        "vence_ate": vence_ate,
+        "estoque_baixo": estoque_baixo,
+    }
+    sql, params, colunas_ordem, chaves = consulta_produtos(
+        "p.*, f.nome as fornecedor_nome", {"usuario_uuid": usuario_uuid, **filtros}, ordenar_por)
+    
+    def consultar(db):
+        etag = calcular_etag(db, request, usuario_uuid, ["produtos", "fornecedores"])
+        if etag_confere(request, etag):
+            return None, etag
+        linhas = buscar_pagina(db, response, sql, params, colunas_ordem, "produtos", usuario_uuid,
+                               descendente=ordem == "desc", pagina=pagina, limite=limite, chaves=chaves,
+                               filtrada=any(filtros.values()))
+        # Linhas lidas do banco vão direto para JSON, sem instanciar Produto
+        return serializar_linhas(Produto, linhas), etag
+    
+    conteudo, etag = await executar_db(consultar)
+    if conteudo is None:
+        return nao_modificado(etag)
+    marcar_etag(response, etag)
+    return Response(content=conteudo, media_type="application/json", headers=response.headers)
 
 @app.delete("/produtos/{uuid}", response_model=dict)
 def deletar_produto(request:Request, uuid: str, db: sqlite3.Connection = Depends(get_db)):
@@ -685,75 +822,26 @@ def deletar_produto(request:Request, uuid: str, db: sqlite3.Connection = Depends
     if produto is None:
         raise HTTPException(status_code=404, detail="Produto não encontrado")
     cursor.execute("DELETE FROM produtos WHERE uuid = ?", (uuid,))
-    db.commit()
     # Registrar log
-    detalhes = (
-        f"UUID: {produto["uuid"]} | "
-        f"Nome: {produto["nome"]} | "
-    )
-    registrar_log(db, usuario_uuid, "Produto Deletado", detalhes)
+    registrar_evento(db, usuario_uuid, "Produto Deletado", "produto", produto["uuid"], nome=produto["nome"])
+    db.commit()
+    notificar_alertas(db, produto["usuario_uuid"], removidos=[produto["uuid"]])
     return {"message": "Produto deletado com sucesso"}
 
 
 @app.get("/fornecedores/", response_model=List[Fornecedor])
-def listar_fornecedores(request: Request, db: sqlite3.Connection = Depends(get_db)):
+def listar_fornecedores(request: Request, response: Response, db: sqlite3.Connection = Depends(get_db)):
     if "user" not in request.session:
         flash(request, "Você precisa fazer login para acessar esta página.", "error")
         url = request.url_for("login")
         return RedirectResponse(url=url, status_code=303)
-    cursor = db.cursor()
     usuario_uuid = request.session["user"]["uuid"] 
     
-    # Query aprimorada para incluir estatísticas detalhadas
-    cursor.execute("""
-        SELECT 
-            f.*,
-            COUNT(DISTINCT p.uuid) as produtos_count,
-            COUNT(DISTINCT m.uuid) as entradas_count,
-            COUNT(DISTINCT CASE WHEN m.tipo = 'entrada' THEN m.uuid END) as total_entradas,
-            COUNT(DISTINCT CASE WHEN m.tipo = 'saida' THEN m.uuid END) as total_saidas,
-            COALESCE(SUM(CASE WHEN m.tipo = 'entrada' THEN m.quantidade ELSE 0 END), 0) as quantidade_total_entradas,
-            COALESCE(SUM(CASE WHEN m.tipo = 'saida' THEN m.quantidade ELSE 0 END), 0) as quantidade_total_saidas
-        FROM fornecedores f
-        LEFT JOIN produtos p ON f.uuid = p.fornecedor_uuid AND p.usuario_uuid = f.usuario_uuid
-        LEFT JOIN movimentos m ON f.uuid = m.fornecedor_uuid AND m.usuario_uuid = f.usuario_uuid
-        WHERE f.usuario_uuid = ?
-        GROUP BY f.uuid
-        ORDER BY f.nome
-    """, (usuario_uuid,))
-    
-    fornecedores_com_stats = []
-    for row in cursor.fetchall():
-        fornecedor_dict = dict(row)
-        
-        # Obter lista de produtos deste fornecedor
-        cursor.execute("""
-            SELECT uuid, nome, quantidade, status, data_validade, lote
-            FROM produtos 
-            WHERE fornecedor_uuid = ? AND usuario_uuid = ?
-            ORDER BY nome
-        """, (fornecedor_dict["uuid"], usuario_uuid))
-        produtos = cursor.fetchall()
-        
-        # Obter lista de movimentos deste fornecedor
-        cursor.execute("""
-            SELECT m.uuid, m.tipo, m.quantidade, m.data, p.nome as produto_nome
-            FROM movimentos m
-            LEFT JOIN produtos p ON m.produto_uuid = p.uuid
-            WHERE m.fornecedor_uuid = ? AND m.usuario_uuid = ?
-            ORDER BY m.data DESC
-            LIMIT 10
-        """, (fornecedor_dict["uuid"], usuario_uuid))
-        movimentos = cursor.fetchall()
-        
-        # Adicionar dados detalhados
-        fornecedor_dict["produtos_detalhados"] = [dict(produto) for produto in produtos]
-        fornecedor_dict["movimentos_detalhados"] = [dict(movimento) for movimento in movimentos]
-        fornecedor_dict["quantidade_produtos"] = len(produtos)
-        
-        fornecedores_com_stats.append(fornecedor_dict)
-    
-    return fornecedores_com_stats
+    etag = calcular_etag(db, request, usuario_uuid, ["fornecedores", "produtos", "movimentos"])
+    if etag_confere(request, etag):
+        return nao_modificado(etag)
+    marcar_etag(response, etag)
+    return carregar_fornecedores_detalhados(db, usuario_uuid)
 
 
 @app.get("/fornecedores", response_class=HTMLResponse)
@@ -826,13 +914,9 @@ def deletar_fornecedor(request:Request, uuid: str, db: sqlite3.Connection = Depe
         raise HTTPException(status_code=400, detail="Não é possível excluir fornecedor com produtos vinculados")
     
     cursor.execute("DELETE FROM fornecedores WHERE uuid = ?", (uuid,))
-    db.commit()
     # Registrar log
-    detalhes = (
-        f"UUID: {fornecedor["uuid"]} | "
-        f"Nome: {fornecedor["nome"]} | "
-    )
-    registrar_log(db, usuario_uuid, "Fornecedor Deletado", detalhes)
+    registrar_evento(db, usuario_uuid, "Fornecedor Deletado", "fornecedor", fornecedor["uuid"], nome=fornecedor["nome"])
+    db.commit()
     return {"message": "Fornecedor deletado com sucesso"}
 
 
@@ -901,24 +985,35 @@ def atualizar_produto(uuid: str, produto: Produto, request: Request, db: sqlite3
         )
     )
     db.commit()
+    notificar_alertas(db, produto_existente["usuario_uuid"], [uuid])
     
     produto.uuid = uuid
     return produto
 
 @app.post("/api/alertas/verificar")
-def forcar_verificacao_alertas(
-    request: Request,
-    db: sqlite3.Connection = Depends(get_db)
-):
-    """Força verificação de alertas de vencimento"""
+async def forcar_verificacao_alertas(request: Request):
+    """Força verificação de alertas de vencimento (reconciliação completa)"""
     if "user" not in request.session:
         raise HTTPException(status_code=401, detail="Não autorizado")
     
     from models import verificar_produtos_a_vencer, obter_resumo_alertas
     
-    resultado = verificar_produtos_a_vencer(db, ALERTA_DIAS)
     usuario_uuid = request.session["user"]["uuid"]
-    resumo = obter_resumo_alertas(db, usuario_uuid)
+
+    def verificar(db):
+        resultado = verificar_produtos_a_vencer(db, ALERTA_DIAS, completa=True)
+        notificar_verificacao_validade(db, resultado)
+        return resultado, obter_resumo_alertas(db, usuario_uuid)
+
+    resultado, resumo = await executar_db(verificar)
+    # A verificação cobre todos os usuários; devolve só os produtos deste
+    alertas = [alerta for alerta in resultado["alertas"] if alerta["usuario_uuid"] == usuario_uuid]
+    resultado = {
+        **resultado,
+        "alertas": alertas,
+        "atualizados": [produto for produto in resultado["atualizados"] if produto["usuario_uuid"] == usuario_uuid],
+        "total_alertas": len(alertas),
+    }
     
     return {
         "verificacao": resultado,
@@ -944,12 +1039,42 @@ def obter_produto_edicao(request:Request, uuid: str, db: sqlite3.Connection = De
     return Produto(**produto_dict)
 
 
+@app.get("/api/alertas/stream")
+async def stream_alertas(request: Request):
+    """Server-Sent Events com as mudanças de alertas e produtos do usuário"""
+    if "user" not in request.session:
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    
+    usuario_uuid = request.session["user"]["uuid"]
+    fila = central.assinar(usuario_uuid)
+    try:
+        resumo = await executar_db(ler_resumo, usuario_uuid)
+    except Exception:
+        central.cancelar(usuario_uuid, fila)
+        raise
+
+    async def eventos():
+        try:
+            yield "retry: 5000\n" + formatar_evento("resumo", resumo)
+            while True:
+                try:
+                    tipo, dados = await asyncio.wait_for(fila.get(), timeout=INTERVALO_PING)
+                except asyncio.TimeoutError:
+                    # Mantém a conexão viva em proxies que encerram conexões ociosas
+                    yield ": ping\n\n"
+                    continue
+                yield formatar_evento(tipo, dados)
+        finally:
+            central.cancelar(usuario_uuid, fila)
+
+    return StreamingResponse(eventos(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
 # ROTA PARA ALERTAS DE ESTOQUE BAIXO - NOVAS ROTAS MATEUSSSSSSSSSS
 @app.get("/api/alertas/estoque")
-def obter_alertas_estoque_api(
-    request: Request,
-    db: sqlite3.Connection = Depends(get_db)
-):
+async def obter_alertas_estoque_api(request: Request):
     """API para obter alertas de estoque baixo"""
     if "user" not in request.session:
         raise HTTPException(status_code=401, detail="Não autorizado")
@@ -957,7 +1082,7 @@ def obter_alertas_estoque_api(
     from models import verificar_estoque_baixo
     
     usuario_uuid = request.session["user"]["uuid"]
-    alertas = verificar_estoque_baixo(db, usuario_uuid)
+    alertas = await executar_db(verificar_estoque_baixo, usuario_uuid)
     
     return {
         "alertas": alertas,
@@ -965,12 +1090,44 @@ def obter_alertas_estoque_api(
         "data_consulta": date.today().isoformat()
     }
 
-# ROTA PARA RESUMO DE ESTOQUE
-@app.get("/api/estoque/resumo")
-def obter_resumo_estoque_api(
+@app.get("/api/previsoes/esgotamento")
+async def obter_previsoes_esgotamento(
     request: Request,
-    db: sqlite3.Connection = Depends(get_db)
+    ordenar_por: str = "dias_para_esgotar",
+    ordem: str = "asc",
+    limite: int = Query(TAMANHO_PAGINA, ge=1, le=TAMANHO_PAGINA_MAXIMO)
 ):
+    """Consumo diário previsto e dias até o esgotamento dos produtos do usuário"""
+    if "user" not in request.session:
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    if ordenar_por not in ORDENACOES_PREVISAO:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Ordenação inválida: {ordenar_por}. Disponíveis: {', '.join(ORDENACOES_PREVISAO)}"
+        )
+    if ordem not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="Ordem inválida: use asc ou desc")
+    
+    usuario_uuid = request.session["user"]["uuid"]
+    hoje = date.today()
+    previsoes = await executar_db(carregar_previsoes, usuario_uuid, hoje)
+    
+    # Produtos sem consumo (sem previsão) ficam sempre no fim
+    com_valor = [previsao for previsao in previsoes if previsao[ordenar_por] is not None]
+    sem_valor = [previsao for previsao in previsoes if previsao[ordenar_por] is None]
+    com_valor.sort(key=lambda previsao: (previsao[ordenar_por], previsao["nome"]), reverse=ordem == "desc")
+    
+    return {
+        "previsoes": (com_valor + sem_valor)[:limite],
+        "total": len(previsoes),
+        "ordenar_por": ordenar_por,
+        "ordem": ordem,
+        "data_consulta": hoje.isoformat()
+    }
+
+# ROTA PARA RESUMO DE ESTOQUE
+@app.get("/api/estoque/resumo")
+async def obter_resumo_estoque_api(request: Request):
     """API para obter resumo de estoque"""
     if "user" not in request.session:
         raise HTTPException(status_code=401, detail="Não autorizado")
@@ -978,10 +1135,118 @@ def obter_resumo_estoque_api(
     from models import obter_resumo_estoque
     
     usuario_uuid = request.session["user"]["uuid"]
-    resumo = obter_resumo_estoque(db, usuario_uuid)
+    resumo = await executar_db(obter_resumo_estoque, usuario_uuid)
     
     return resumo
 
+# PAINEL: produtos, alertas e resumos numa única consulta
+@app.get("/api/painel")
+async def obter_painel(
+    request: Request,
+    response: Response,
+    campos: Optional[str] = None,
+    pagina: Optional[str] = Query(None, alias="cursor"),
+    limite: Optional[int] = Query(None, ge=1, le=TAMANHO_PAGINA_MAXIMO)
+):
+    """
+    Devolve só as partes pedidas em `campos` (separadas por vírgula):
+    produtos, alertas_vencimento, alertas_estoque, resumo_alertas, resumo_estoque.
+    Sem `campos`, devolve todas. Os produtos vêm paginados como em /produtos/.
+    """
+    if "user" not in request.session:
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    
+    from models import montar_painel, CAMPOS_PAINEL
+    
+    selecionados = [campo.strip() for campo in campos.split(",") if campo.strip()] if campos else CAMPOS_PAINEL
+    invalidos = [campo for campo in selecionados if campo not in CAMPOS_PAINEL]
+    if invalidos:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Campos inválidos: {', '.join(invalidos)}. Disponíveis: {', '.join(CAMPOS_PAINEL)}"
+        )
+    
+    usuario_uuid = request.session["user"]["uuid"]
+
+    def consultar(db):
+        # Os dias restantes dos alertas mudam com a data, mesmo sem escrita
+        etag = calcular_etag(db, request, usuario_uuid, ["produtos", "fornecedores", "movimentos"],
+                             date.today().isoformat())
+        if etag_confere(request, etag):
+            return None, None, etag
+        try:
+            painel, proximo = montar_painel(db, usuario_uuid, selecionados, ALERTA_DIAS, pagina, limite)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return painel, proximo, etag
+
+    painel, proximo, etag = await executar_db(consultar)
+    if painel is None:
+        return nao_modificado(etag)
+    marcar_etag(response, etag)
+    if proximo:
+        response.headers["X-Proximo-Cursor"] = proximo
+    return painel
+
+@app.get("/api/estoque/historico")
+async def obter_estoque_historico_usuario(request: Request, data: Optional[date] = None, categoria: Optional[str] = None):
+    """Saldo de cada produto no fim de `data` (hoje, se omitida), pelos saldos diários"""
+    if "user" not in request.session:
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    
+    from models import carregar_estoque_na_data
+    
+    usuario_uuid = request.session["user"]["uuid"]
+    dia = (data or date.today()).isoformat()
+    produtos = await executar_db(carregar_estoque_na_data, usuario_uuid, dia, None, categoria)
+    return {
+        "data": dia,
+        "total_produtos": len(produtos),
+        "quantidade_total": sum(produto["quantidade"] for produto in produtos),
+        "produtos": produtos
+    }
+
+@app.get("/api/estoque/historico/categorias")
+async def obter_estoque_historico_categorias(request: Request, data: Optional[date] = None):
+    """Totais por categoria do saldo no fim de `data` (hoje, se omitida)"""
+    if "user" not in request.session:
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    
+    from models import carregar_estoque_na_data_por_categoria
+    
+    usuario_uuid = request.session["user"]["uuid"]
+    dia = (data or date.today()).isoformat()
+    return {
+        "data": dia,
+        "categorias": await executar_db(carregar_estoque_na_data_por_categoria, usuario_uuid, dia)
+    }
+
+@app.get("/api/estoque/historico/produtos/{uuid}")
+async def obter_estoque_historico_produto(uuid: str, request: Request, data: Optional[date] = None):
+    """Saldo de um produto no fim de `data` (hoje, se omitida)"""
+    if "user" not in request.session:
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    
+    from models import carregar_estoque_na_data
+    
+    usuario_uuid = request.session["user"]["uuid"]
+    dia = (data or date.today()).isoformat()
+
+    def consultar(db):
+        cursor = db.cursor()
+        cursor.execute("SELECT uuid, nome, categoria FROM produtos WHERE uuid = ? AND usuario_uuid = ?", (uuid, usuario_uuid))
+        produto = cursor.fetchone()
+        if not produto:
+            raise HTTPException(status_code=404, detail="Produto não encontrado ou não pertence ao usuário.")
+        saldos = carregar_estoque_na_data(db, usuario_uuid, dia, uuid)
+        if saldos:
+            return saldos[0]
+        # Sem movimentação até a data
+        return {"produto_uuid": produto["uuid"], "nome": produto["nome"], "categoria": produto["categoria"],
+                "quantidade": 0, "ultima_alteracao": None}
+
+    return {"data": dia, **await executar_db(consultar)}
+
 # PÁGINA DE ESTOQUE CRÍTICO
 @app.get("/estoque-critico", response_class=HTMLResponse)
 def pagina_estoque_critico(request: Request):
@@ -1029,29 +1294,13 @@ def obter_estatisticas_usuarios(
     if user.get("tipo") != "admin":
         raise HTTPException(status_code=403, detail="Acesso restrito a administradores")
     
-    cursor = db.cursor()
-    
-    # Total de usuários
-    cursor.execute("SELECT COUNT(*) as total FROM usuarios")
-    total_usuarios = cursor.fetchone()["total"]
-    
-    # Total de agricultores
-    cursor.execute("SELECT COUNT(*) as total FROM usuarios WHERE tipo = 'agricultor'")
-    total_agricultores = cursor.fetchone()["total"]
-    
-    # Total de administradores
-    cursor.execute("SELECT COUNT(*) as total FROM usuarios WHERE tipo = 'admin'")
-    total_admins = cursor.fetchone()["total"]
-    
-    # Total de produtos
-    cursor.execute("SELECT COUNT(*) as total FROM produtos")
-    total_produtos = cursor.fetchone()["total"]
+    estatisticas = cache_estatisticas.obter(db)
     
     return {
-        "total_usuarios": total_usuarios,
-        "total_agricultores": total_agricultores,
-        "total_admins": total_admins,
-        "total_produtos": total_produtos
+        "total_usuarios": estatisticas["usuarios"]["total"],
+        "total_agricultores": estatisticas["usuarios"]["agricultores"],
+        "total_admins": estatisticas["usuarios"]["admins"],
+        "total_produtos": estatisticas["produtos"]["total"]
     }
 
 @app.post("/api/admin/usuarios")
@@ -1441,6 +1690,9 @@ def deletar_usuario_admin(
 @app.get("/api/admin/fornecedores")
 def listar_todos_fornecedores_admin(
     request: Request,
+    response: Response,
+    pagina: Optional[str] = Query(None, alias="cursor"),
+    limite: Optional[int] = Query(None, ge=1, le=TAMANHO_PAGINA_MAXIMO),
     db: sqlite3.Connection = Depends(get_db)
 ):
     """Lista todos os fornecedores do sistema (apenas para administradores)"""
@@ -1451,26 +1703,32 @@ def listar_todos_fornecedores_admin(
     if user.get("tipo") != "admin":
         raise HTTPException(status_code=403, detail="Acesso restrito a administradores")
     
-    cursor = db.cursor()
-    cursor.execute("""
+    fornecedores = buscar_pagina(db, response, """
         SELECT 
             f.*,
             u.nome as usuario_nome,
-            COUNT(p.uuid) as produtos_count
+            (SELECT COUNT(*) FROM produtos p WHERE p.fornecedor_uuid = f.uuid) as produtos_count
         FROM fornecedores f
         LEFT JOIN usuarios u ON f.usuario_uuid = u.uuid
-        LEFT JOIN produtos p ON f.uuid = p.fornecedor_uuid
-        GROUP BY f.uuid
-        ORDER BY f.nome
-    """)
-    
-    fornecedores = cursor.fetchall()
+        WHERE 1 = 1 {pagina}
+    """, [], ["f.nome", "f.uuid"], "fornecedores", pagina=pagina, limite=limite)
     
     return [dict(fornecedor) for fornecedor in fornecedores]
 
 @app.get("/api/admin/produtos")
 def listar_todos_produtos_admin(
     request: Request,
+    response: Response,
+    pagina: Optional[str] = Query(None, alias="cursor"),
+    limite: Optional[int] = Query(None, ge=1, le=TAMANHO_PAGINA_MAXIMO),
+    usuario_uuid: Optional[str] = None,
+    categoria: Optional[Categoria] = None,
+    status: Optional[StatusProduto] = None,
+    fornecedor_uuid: Optional[str] = None,
+    vence_ate: Optional[date] = None,
+    estoque_baixo: bool = False,
+    ordenar_por: str = "nome",
+    ordem: str = "asc",
     db: sqlite3.Connection = Depends(get_db)
 ):
     """Lista todos os produtos do sistema (apenas para administradores)"""
@@ -1480,20 +1738,26 @@ def listar_todos_produtos_admin(
     user = request.session["user"]
     if user.get("tipo") != "admin":
         raise HTTPException(status_code=403, detail="Acesso restrito a administradores")
-    
-    cursor = db.cursor()
-    cursor.execute("""
-        SELECT p.*, u.nome as usuario_nome, f.nome as fornecedor_nome 
-        FROM produtos p
-        LEFT JOIN usuarios u ON p.usuario_uuid = u.uuid
-        LEFT JOIN fornecedores f ON p.fornecedor_uuid = f.uuid
-        ORDER BY p.nome
-    """)
-    produtos = cursor.fetchall()
+    validar_ordenacao_produtos(ordenar_por, ordem)
+    
+    filtros = {
+        "usuario_uuid": usuario_uuid,
+        "categoria": categoria.value if categoria else None,
+        "status": status.value if status else None,
+        "fornecedor_uuid": fornecedor_uuid,
+        "vence_ate": vence_ate,
+        "estoque_baixo": estoque_baixo,
+    }
+    sql, params, colunas_ordem, chaves = consulta_produtos(
+        "p.*, u.nome as usuario_nome, f.nome as fornecedor_nome", filtros, ordenar_por)
+    produtos = buscar_pagina(db, response, sql, params, colunas_ordem, "produtos",
+                             descendente=ordem == "desc", pagina=pagina, limite=limite, chaves=chaves,
+                             filtrada=any(filtros.values()))
     
     produtos_formatados = []
     for produto in produtos:
         produto_dict = dict(produto)
+        produto_dict.pop("validade_ordenavel", None)
         if produto_dict["data_validade"]:
             produto_dict["data_validade"] = date.fromisoformat(produto_dict["data_validade"])
         produtos_formatados.append(produto_dict)
@@ -1514,29 +1778,13 @@ def obter_estatisticas_produtos_admin(
     if user.get("tipo") != "admin":
         raise HTTPException(status_code=403, detail="Acesso restrito a administradores")
     
-    cursor = db.cursor()
-    
-    # Total de produtos
-    cursor.execute("SELECT COUNT(*) as total FROM produtos")
-    total_produtos = cursor.fetchone()["total"]
-    
-    # Produtos a vencer (próximos 7 dias)
-    cursor.execute("SELECT COUNT(*) as total FROM produtos WHERE status = 'a_vencer'")
-    produtos_a_vencer = cursor.fetchone()["total"]
-    
-    # Produtos vencidos
-    cursor.execute("SELECT COUNT(*) as total FROM produtos WHERE status = 'vencido'")
-    produtos_vencidos = cursor.fetchone()["total"]
-    
-    # Produtos esgotados
-    cursor.execute("SELECT COUNT(*) as total FROM produtos WHERE status = 'esgotado'")
-    produtos_esgotados = cursor.fetchone()["total"]
+    produtos = cache_estatisticas.obter(db)["produtos"]
     
     return {
-        "total_produtos": total_produtos,
-        "produtos_a_vencer": produtos_a_vencer,
-        "produtos_vencidos": produtos_vencidos,
-        "produtos_esgotados": produtos_esgotados
+        "total_produtos": produtos["total"],
+        "produtos_a_vencer": produtos["a_vencer"],
+        "produtos_vencidos": produtos["vencidos"],
+        "produtos_esgotados": produtos["esgotados"]
     }
 
 @app.delete("/api/admin/produtos/{uuid}")
@@ -1562,11 +1810,11 @@ def deletar_produto_admin(
     
 
     cursor.execute("DELETE FROM produtos WHERE uuid = ?", (uuid,))
-    db.commit()
     
     usuario_uuid = request.session["user"]["uuid"]
-    detalhes = f"Produto excluído: {produto['nome']} (UUID: {uuid})"
-    registrar_log(db, usuario_uuid, "Exclusão de Produto", detalhes)
+    registrar_evento(db, usuario_uuid, "Exclusão de Produto", "produto", uuid, nome=produto["nome"])
+    db.commit()
+    notificar_alertas(db, produto["usuario_uuid"], removidos=[uuid])
     
     return {"message": "Produto excluído com sucesso"}
 
@@ -1605,6 +1853,56 @@ def obter_produto_admin(
 
 
 
+@app.get("/api/logs")
+async def buscar_logs(
+    request: Request,
+    response: Response,
+    acao: Optional[str] = None,
+    entidade: Optional[str] = None,
+    entidade_uuid: Optional[str] = None,
+    campo: Optional[str] = None,
+    valor: Optional[str] = None,
+    pagina: Optional[str] = Query(None, alias="cursor"),
+    limite: Optional[int] = Query(None, ge=1, le=TAMANHO_PAGINA_MAXIMO)
+):
+    """Busca nos logs do usuário pelos campos estruturados (ex.: campo=produto&valor=Glifosato)"""
+    if "user" not in request.session:
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    
+    usuario_uuid = request.session["user"]["uuid"]
+    filtros = ["logs.usuario_uuid = ?"]
+    params = [usuario_uuid]
+    if acao:
+        filtros.append("logs.acao = ?")
+        params.append(acao)
+    if entidade:
+        filtros.append("logs.entidade = ?")
+        params.append(entidade)
+    if entidade_uuid:
+        filtros.append("logs.entidade_uuid = ?")
+        params.append(entidade_uuid)
+    if campo:
+        if not re.fullmatch(r"[A-Za-z_]+", campo) or valor is None:
+            raise HTTPException(status_code=400, detail="Informe um campo válido e o valor procurado")
+        if re.fullmatch(r"-?\d+", valor):
+            # Só dígitos: o campo pode ser número (quantidade) ou texto (lote, CNPJ)
+            filtros.append("json_extract(logs.dados, ?) IN (?, ?)")
+            params.extend([f"$.{campo}", valor, int(valor)])
+        else:
+            filtros.append("json_extract(logs.dados, ?) = ?")
+            params.extend([f"$.{campo}", valor])
+
+    def consultar(db):
+        linhas = buscar_pagina(db, response, f"""
+            SELECT logs.uuid, logs.data, logs.acao, logs.entidade, logs.entidade_uuid, logs.dados
+            FROM logs
+            WHERE {" AND ".join(filtros)} {{pagina}}
+        """, params, ["logs.data", "logs.uuid"], "logs", usuario_uuid,
+            descendente=True, pagina=pagina, limite=limite, filtrada=len(filtros) > 1)
+        return [{**dict(row), "dados": carregar_dados(row["dados"])} for row in linhas]
+
+    return await executar_db(consultar)
+
 @app.get("/relatorio/logs/pdf")
 def relatorio_logs_pdf(request: Request, db: sqlite3.Connection = Depends(get_db)):
     if "user" not in request.session:
@@ -1613,25 +1911,21 @@ def relatorio_logs_pdf(request: Request, db: sqlite3.Connection = Depends(get_db
     usuario_uuid = request.session["user"]["uuid"]
     usuario_nome = request.session["user"]["nome"].replace(" ", "_")
 
-
-    cursor = db.cursor()
-
-    cursor.execute("""
-        SELECT logs.data, logs.acao, logs.detalhes, usuarios.nome AS usuario_nome
+    logs = iterar_paginas(db, """
+        SELECT logs.uuid, logs.data, logs.acao, logs.entidade_uuid, logs.dados, usuarios.nome AS usuario_nome
         FROM logs
         JOIN usuarios ON logs.usuario_uuid = usuarios.uuid
-        WHERE logs.usuario_uuid = ?
-        ORDER BY logs.data DESC
-    """, (usuario_uuid,))
-    logs = cursor.fetchall()
+        WHERE logs.usuario_uuid = ? {pagina}
+    """, [usuario_uuid], ["logs.data", "logs.uuid"], descendente=True)
 
-    buffer_pdf = gerar_pdf_logs(logs, usuario_nome)
+    with DURACAO_PDF.cronometrar("usuario"):
+        arquivo_pdf = gerar_pdf_logs(logs, usuario_nome)
 
     return StreamingResponse(
-        buffer_pdf,
+        ler_em_blocos(arquivo_pdf),
         media_type="application/pdf",
         headers={
-            "Content-Disposition": f'attachment; filename="Relatorio_{usuario_nome}.pdf"'
+            "Content-Disposition": cabecalho_anexo(f"Relatorio_{usuario_nome}.pdf")
         }
     )
 
@@ -1645,14 +1939,12 @@ def relatorio_logs_pdf_admin(usuario_uuid: str, request: Request, db: sqlite3.Co
         raise HTTPException(status_code=403, detail="Apenas administradores podem acessar este relatório.")
 
     cursor = db.cursor()
-    cursor.execute("""
-        SELECT logs.data, logs.acao, logs.detalhes, usuarios.nome AS usuario_nome
+    logs = iterar_paginas(db, """
+        SELECT logs.uuid, logs.data, logs.acao, logs.entidade_uuid, logs.dados, usuarios.nome AS usuario_nome
         FROM logs
         JOIN usuarios ON logs.usuario_uuid = usuarios.uuid
-        WHERE logs.usuario_uuid = ?
-        ORDER BY logs.data DESC
-    """, (usuario_uuid,))
-    logs = cursor.fetchall()
+        WHERE logs.usuario_uuid = ? {pagina}
+    """, [usuario_uuid], ["logs.data", "logs.uuid"], descendente=True)
 
     cursor.execute("SELECT nome FROM usuarios WHERE uuid = ?", (usuario_uuid,))
     row = cursor.fetchone()
@@ -1662,13 +1954,14 @@ def relatorio_logs_pdf_admin(usuario_uuid: str, request: Request, db: sqlite3.Co
 
     usuario_nome = row["nome"].replace(" ", "_")
 
-    buffer_pdf = gerar_pdf_logs(logs, usuario_nome)
+    with DURACAO_PDF.cronometrar("admin"):
+        arquivo_pdf = gerar_pdf_logs(logs, usuario_nome)
 
     return StreamingResponse(
-        buffer_pdf,
+        ler_em_blocos(arquivo_pdf),
         media_type="application/pdf",
         headers={
-            "Content-Disposition": f"attachment; filename=Relatorio_{usuario_nome}.pdf"
+            "Content-Disposition": cabecalho_anexo(f"Relatorio_{usuario_nome}.pdf")
         }
     )
 
@@ -1682,27 +1975,100 @@ def debug_estatisticas(request:Request, db: sqlite3.Connection = Depends(get_db)
     user = request.session["user"]
     if user.get("tipo") != "admin":
         raise HTTPException(status_code=403, detail="Acesso restrito a administradores")
-    cursor = db.cursor()
+    estatisticas = cache_estatisticas.obter(db)
     
-    cursor.execute("SELECT COUNT(*) as total FROM usuarios")
-    total_usuarios = cursor.fetchone()["total"]
+    return {
+        "total_usuarios": estatisticas["usuarios"]["total"],
+        "total_agricultores": estatisticas["usuarios"]["agricultores"],
+        "total_admins": estatisticas["usuarios"]["admins"],
+        "total_produtos": estatisticas["produtos"]["total"],
+        "cache": cache_estatisticas.estatisticas(),
+        "debug": "API funcionando"
+    }
+
+@app.get("/api/admin/banco/pool")
+def estatisticas_pool(request: Request):
+    """Estatísticas do pool de conexões e do executor do banco (apenas para administradores)"""
+    if "user" not in request.session:
+        raise HTTPException(status_code=401, detail="Não autorizado")
     
-    cursor.execute("SELECT COUNT(*) as total FROM usuarios WHERE tipo = 'agricultor'")
-    total_agricultores = cursor.fetchone()["total"]
+    user = request.session["user"]
+    if user.get("tipo") != "admin":
+        raise HTTPException(status_code=403, detail="Acesso restrito a administradores")
     
-    cursor.execute("SELECT COUNT(*) as total FROM usuarios WHERE tipo = 'admin'")
-    total_admins = cursor.fetchone()["total"]
+    estatisticas = obter_pool().estatisticas()
+    estatisticas["executor"] = obter_executor_db().estatisticas()
+    estatisticas["conexoes_sse"] = central.total_conexoes()
+    estatisticas["cache_estatisticas"] = cache_estatisticas.estatisticas()
+    return estatisticas
+
+@registro.coletor
+def metricas_banco(db):
+    pool = obter_pool().estatisticas()
+    executor = obter_executor_db().estatisticas()
+    cache = cache_estatisticas.estatisticas()
+    return [
+        ("stockfield_pool_conexoes", "gauge", "Conexões do pool por estado",
+            [({"estado": "em_uso"}, pool["em_uso"]), ({"estado": "livre"}, pool["livres"])]),
+        ("stockfield_pool_tamanho", "gauge", "Máximo de conexões do pool", [({}, pool["tamanho"])]),
+        ("stockfield_pool_retiradas_total", "counter", "Conexões retiradas do pool", [({}, pool["retiradas"])]),
+        ("stockfield_pool_esperas_total", "counter", "Retiradas que esperaram uma conexão livre", [({}, pool["esperas"])]),
+        ("stockfield_pool_espera_segundos_total", "counter", "Tempo total de espera por conexões",
+            [({}, round(pool["tempo_espera_ms"] / 1000, 6))]),
+        ("stockfield_pool_repeticoes_bloqueio_total", "counter", "Comandos repetidos por banco bloqueado",
+            [({}, pool["repeticoes_bloqueio"])]),
+        ("stockfield_comandos_sql_total", "counter", "Comandos SQL executados", [({}, pool["comandos"])]),
+        ("stockfield_executor_tarefas", "gauge", "Tarefas do executor do banco por estado",
+            [({"estado": "pendente"}, executor["pendentes"] - executor["em_execucao"]),
+             ({"estado": "em_execucao"}, executor["em_execucao"])]),
+        ("stockfield_executor_tarefas_total", "counter", "Tarefas enviadas ao executor do banco", [({}, executor["tarefas"])]),
+        ("stockfield_executor_fila_segundos_total", "counter", "Tempo total das tarefas na fila do executor",
+            [({}, round(executor["tempo_fila_ms"] / 1000, 6))]),
+        ("stockfield_conexoes_sse", "gauge", "Conexões abertas no stream de alertas", [({}, central.total_conexoes())]),
+        ("stockfield_cache_estatisticas_total", "counter", "Consultas ao cache de estatísticas por resultado",
+            [({"resultado": chave}, cache[chave]) for chave in ("acertos", "faltas", "invalidacoes", "expiracoes")]),
+    ]
+
+@registro.coletor
+def metricas_alertas(db):
+    # Somas da tabela resumo_estoque, mantida pelos gatilhos: uma linha por usuário
+    cursor = db.cursor()
+    cursor.execute("""
+        SELECT
+            COALESCE(SUM(vencidos), 0) as vencido,
+            COALESCE(SUM(a_vencer), 0) as a_vencer,
+            COALESCE(SUM(estoque_baixo), 0) as estoque_baixo,
+            COALESCE(SUM(estoque_esgotado), 0) as estoque_esgotado
+        FROM resumo_estoque
+    """)
+    totais = dict(cursor.fetchone())
+    return [
+        ("stockfield_alertas", "gauge", "Produtos em alerta por severidade",
+            [({"severidade": severidade}, total) for severidade, total in totais.items()]),
+    ]
+
+@app.get("/metrics")
+async def metricas(request: Request):
+    """Métricas no formato texto do Prometheus"""
+    # Sem endereço do cliente (socket unix, alguns servidores ASGI) não é conexão local
+    local = request.client is not None and request.client.host in ("127.0.0.1", "::1", "localhost")
+    if not METRICAS_ABERTAS and not local:
+        raise HTTPException(status_code=403, detail="Métricas disponíveis apenas para conexões locais")
+
+    texto = await executar_db(registro.exportar)
+    return Response(content=texto, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/admin/tarefas")
+def listar_tarefas_agendadas(request: Request, db: sqlite3.Connection = Depends(get_db)):
+    """Concessão e resultado da última execução de cada tarefa agendada (apenas para administradores)"""
+    if "user" not in request.session:
+        raise HTTPException(status_code=401, detail="Não autorizado")
     
-    cursor.execute("SELECT COUNT(*) as total FROM produtos")
-    total_produtos = cursor.fetchone()["total"]
+    user = request.session["user"]
+    if user.get("tipo") != "admin":
+        raise HTTPException(status_code=403, detail="Acesso restrito a administradores")
     
-    return {
-        "total_usuarios": total_usuarios,
-        "total_agricultores": total_agricultores,
-        "total_admins": total_admins,
-        "total_produtos": total_produtos,
-        "debug": "API funcionando"
-    }
+    return listar_tarefas(db)
 
 @app.get("/api/admin/estatisticas")
 def obter_estatisticas_admin(
@@ -1717,56 +2083,16 @@ def obter_estatisticas_admin(
     if user.get("tipo") != "admin":
         raise HTTPException(status_code=403, detail="Acesso restrito a administradores")
     
-    cursor = db.cursor()
-    
-    cursor.execute("SELECT COUNT(*) as total FROM fornecedores")
-    total_fornecedores = cursor.fetchone()["total"]
-    
-    cursor.execute("SELECT COUNT(*) as total FROM produtos")
-    total_produtos = cursor.fetchone()["total"]
-    
-    cursor.execute("SELECT COUNT(*) as total FROM movimentos WHERE tipo = 'entrada'")
-    total_entradas = cursor.fetchone()["total"]
-    cursor.execute("""
-        SELECT COUNT(DISTINCT f.uuid) as total 
-        FROM fornecedores f
-        INNER JOIN produtos p ON f.uuid = p.fornecedor_uuid
-    """)
-    fornecedores_ativos = cursor.fetchone()["total"]
-    
-    cursor.execute("""
-        SELECT 
-            COUNT(DISTINCT f.uuid) as fornecedores_com_produtos,
-            COUNT(p.uuid) as total_produtos_vinculados
-        FROM fornecedores f
-        LEFT JOIN produtos p ON f.uuid = p.fornecedor_uuid
-    """)
-    stats_produtos = cursor.fetchone()
-    cursor.execute("""
-        SELECT 
-            COUNT(DISTINCT f.uuid) as fornecedores_com_movimentos,
-            COUNT(m.uuid) as total_movimentos_vinculados
-        FROM fornecedores f
-        LEFT JOIN produtos p ON f.uuid = p.fornecedor_uuid
-        LEFT JOIN movimentos m ON p.uuid = m.produto_uuid
-        WHERE m.tipo = 'entrada'
-    """)
-    stats_movimentos = cursor.fetchone()
+    estatisticas = cache_estatisticas.obter(db)
     
     return {
-        "total_fornecedores": total_fornecedores,
-        "total_produtos": total_produtos,
-        "total_entradas": total_entradas,
-        "fornecedores_ativos": fornecedores_ativos,
+        "total_fornecedores": estatisticas["fornecedores"]["total"],
+        "total_produtos": estatisticas["produtos"]["total"],
+        "total_entradas": estatisticas["movimentos"]["entradas"],
+        "fornecedores_ativos": estatisticas["fornecedores"]["ativos"],
         "estatisticas_adicionais": {
-            "media_produtos_por_fornecedor": round(
-                stats_produtos["total_produtos_vinculados"] / max(stats_produtos["fornecedores_com_produtos"], 1), 
-                1
-            ) if stats_produtos else 0,
-            "media_movimentos_por_fornecedor": round(
-                stats_movimentos["total_movimentos_vinculados"] / max(stats_movimentos["fornecedores_com_movimentos"], 1), 
-                1
-            ) if stats_movimentos else 0
+            "media_produtos_por_fornecedor": estatisticas["fornecedores"]["media_produtos"],
+            "media_movimentos_por_fornecedor": estatisticas["movimentos"]["media_entradas_por_fornecedor"]
         }
     }
 
@@ -1809,7 +2135,7 @@ def listar_fornecedores_detalhados_admin(
     return [dict(fornecedor) for fornecedor in fornecedores]
 
 @app.get("/api/produtos/dropdown")
-def listar_produtos_dropdown(request: Request, db: sqlite3.Connection = Depends(get_db)):
+def listar_produtos_dropdown(request: Request, response: Response, db: sqlite3.Connection = Depends(get_db)):
     """API específica para dropdown de produtos na movimentação"""
     if "user" not in request.session:
         raise HTTPException(status_code=401, detail="Não autorizado")
@@ -1817,6 +2143,11 @@ def listar_produtos_dropdown(request: Request, db: sqlite3.Connection = Depends(
     cursor = db.cursor()
     usuario_uuid = request.session["user"]["uuid"]
     
+    etag = calcular_etag(db, request, usuario_uuid, ["produtos", "fornecedores"])
+    if etag_confere(request, etag):
+        return nao_modificado(etag)
+    marcar_etag(response, etag)
+    
     cursor.execute("""
         SELECT p.uuid, p.nome, p.quantidade, f.nome as fornecedor_nome
         FROM produtos p
@@ -1827,3 +2158,40 @@ def listar_produtos_dropdown(request: Request, db: sqlite3.Connection = Depends(
     
     produtos = cursor.fetchall()
     return [dict(produto) for produto in produtos]
+
+@app.get("/api/produtos/busca", response_model=List[Produto])
+async def buscar_produtos_texto(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    limite: int = Query(20, ge=1, le=100)
+):
+    """Busca textual nos produtos do usuário (nome, descrição, lote, localização, registro e fornecedor)"""
+    if "user" not in request.session:
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    usuario_uuid = request.session["user"]["uuid"]
+
+    def consultar(db):
+        return serializar_linhas(Produto, buscar_produtos(db, usuario_uuid, q, limite))
+
+    conteudo = await executar_db(consultar)
+    return Response(content=conteudo, media_type="application/json")
+
+@app.get("/api/produtos/{uuid}/estoque")
+def obter_estoque_historico(uuid: str, request: Request, data: Optional[date] = None, db: sqlite3.Connection = Depends(get_db)):
+    """Quantidade do produto reconstruída pelo razão de estoque, agora ou no fim de `data`"""
+    if "user" not in request.session:
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    
+    cursor = db.cursor()
+    cursor.execute("SELECT quantidade FROM produtos WHERE uuid = ? AND usuario_uuid = ?", (uuid, request.session["user"]["uuid"]))
+    produto = cursor.fetchone()
+    if not produto:
+        raise HTTPException(status_code=404, detail="Produto não encontrado ou não pertence ao usuário.")
+    
+    estoque = quantidade_no_razao(db, uuid, f"{data.isoformat()} 23:59:59" if data else None)
+    return {
+        "produto_uuid": uuid,
+        "data": data.isoformat() if data else None,
+        "quantidade_atual": produto["quantidade"],
+        **estoque
+    }
@@ -0,0 +1,221 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from starlette.datastructures import Headers
+
+# Métricas do processo no formato texto do Prometheus (GET /metrics).
+# Cada thread escreve só nos seus próprios valores (sem lock na escrita);
+# a coleta soma os valores de todas as threads. O middleware roda no loop
+# de eventos, uma thread só, então as métricas das rotas nunca disputam nada.
+
+# STOCKFIELD_METRICAS=0 desliga o middleware de métricas das rotas
+METRICAS_ATIVAS = os.environ.get("STOCKFIELD_METRICAS", "1") != "0"
+# Por padrão /metrics só responde a conexões locais (o Prometheus da máquina).
+# Atrás de um proxy reverso na mesma máquina toda requisição chega de
+# 127.0.0.1, então essa checagem não protege nada: bloqueie /metrics no proxy.
+METRICAS_ABERTAS = os.environ.get("STOCKFIELD_METRICAS_ABERTAS", "0") == "1"
+
+LIMITES_DURACAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LIMITES_PDF = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+LIMITES_BYTES = (64, 128, 256, 512, 1024, 2048, 4096)
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def formatar_rotulos(nomes, valores, extra: str = "") -> str:
+    pares = [f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+class _PorThread:
+    """Um dicionário de valores por thread, somados na coleta."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._todos = []
+        self._lock = threading.Lock()
+
+    def valores(self) -> dict:
+        try:
+            return self._local.valores
+        except AttributeError:
+            valores = self._local.valores = {}
+            with self._lock:
+                self._todos.append(valores)
+            return valores
+
+    def copias(self) -> list:
+        with self._lock:
+            todos = list(self._todos)
+        return [dict(valores) for valores in todos]
+
+
+class Contador(_PorThread):
+    tipo = "counter"
+
+    def __init__(self, nome: str, ajuda: str, rotulos=()):
+        super().__init__()
+        self.nome, self.ajuda, self.rotulos = nome, ajuda, tuple(rotulos)
+
+    def inc(self, *valores_rotulos, quantidade=1):
+        valores = self.valores()
+        valores[valores_rotulos] = valores.get(valores_rotulos, 0) + quantidade
+
+    def amostras(self):
+        totais = {}
+        for valores in self.copias():
+            for chave, valor in valores.items():
+                totais[chave] = totais.get(chave, 0) + valor
+        for chave in sorted(totais):
+            yield f"{self.nome}{formatar_rotulos(self.rotulos, chave)} {totais[chave]}"
+
+
+class Histograma(_PorThread):
+    tipo = "histogram"
+
+    def __init__(self, nome: str, ajuda: str, rotulos=(), limites=LIMITES_DURACAO):
+        super().__init__()
+        self.nome, self.ajuda, self.rotulos = nome, ajuda, tuple(rotulos)
+        self.limites = tuple(limites)
+
+    def observar(self, valor: float, *valores_rotulos):
+        valores = self.valores()
+        serie = valores.get(valores_rotulos)
+        if serie is None:
+            # Contagem por faixa (a última é +Inf) e soma
+            serie = valores[valores_rotulos] = [[0] * (len(self.limites) + 1), 0.0]
+        serie[0][bisect.bisect_left(self.limites, valor)] += 1
+        serie[1] += valor
+
+    @contextmanager
+    def cronometrar(self, *valores_rotulos):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, *valores_rotulos)
+
+    def amostras(self):
+        totais = {}
+        for valores in self.copias():
+            for chave, (faixas, soma) in valores.items():
+                total = totais.setdefault(chave, [[0] * (len(self.limites) + 1), 0.0])
+                total[0] = [a + b for a, b in zip(total[0], faixas)]
+                total[1] += soma
+        for chave in sorted(totais):
+            faixas, soma = totais[chave]
+            acumulado = 0
+            for limite, quantidade in zip((*self.limites, "+Inf"), faixas):
+                acumulado += quantidade
+                rotulos = formatar_rotulos(self.rotulos, chave, f'le="{limite}"')
+                yield f"{self.nome}_bucket{rotulos} {acumulado}"
+            yield f"{self.nome}_sum{formatar_rotulos(self.rotulos, chave)} {round(soma, 6)}"
+            yield f"{self.nome}_count{formatar_rotulos(self.rotulos, chave)} {acumulado}"
+
+
+class Registro:
+    def __init__(self):
+        self.metricas = []
+        self.coletores = []
+
+    def contador(self, *args, **kwargs) -> Contador:
+        metrica = Contador(*args, **kwargs)
+        self.metricas.append(metrica)
+        return metrica
+
+    def histograma(self, *args, **kwargs) -> Histograma:
+        metrica = Histograma(*args, **kwargs)
+        self.metricas.append(metrica)
+        return metrica
+
+    def coletor(self, funcao):
+        """
+        Registra uma função chamada a cada coleta que devolve
+        (nome, tipo, ajuda, [(rotulos, valor), ...]) para valores lidos na hora.
+        """
+        self.coletores.append(funcao)
+        return funcao
+
+    def exportar(self, db=None) -> str:
+        linhas = []
+        for metrica in self.metricas:
+            linhas.append(f"# HELP {metrica.nome} {metrica.ajuda}")
+            linhas.append(f"# TYPE {metrica.nome} {metrica.tipo}")
+            linhas.extend(metrica.amostras())
+        for coletor in self.coletores:
+            try:
+                familias = coletor(db)
+            except Exception as e:
+                print(f"Erro ao coletar métricas em {coletor.__name__}: {e}")
+                continue
+            for nome, tipo, ajuda, amostras in familias:
+                linhas.append(f"# HELP {nome} {ajuda}")
+                linhas.append(f"# TYPE {nome} {tipo}")
+                for rotulos, valor in amostras:
+                    linhas.append(f"{nome}{formatar_rotulos(rotulos.keys(), rotulos.values())} {valor}")
+        return "\n".join(linhas) + "\n"
+
+
+registro = Registro()
+
+REQUISICOES = registro.contador(
+    "stockfield_requisicoes_total", "Requisições HTTP atendidas", ("metodo", "rota", "status"))
+DURACAO_REQUISICOES = registro.histograma(
+    "stockfield_requisicao_duracao_segundos", "Duração das requisições HTTP", ("metodo", "rota"))
+TAMANHO_SESSAO = registro.histograma(
+    "stockfield_sessao_bytes", "Tamanho do cookie de sessão recebido", limites=LIMITES_BYTES)
+DURACAO_PDF = registro.histograma(
+    "stockfield_pdf_duracao_segundos", "Duração da geração dos relatórios PDF", ("relatorio",), LIMITES_PDF)
+VENCIMENTO_EXECUCOES = registro.contador(
+    "stockfield_vencimento_execucoes_total", "Execuções do motor de vencimento", ("modo",))
+VENCIMENTO_LINHAS_LIDAS = registro.contador(
+    "stockfield_vencimento_linhas_lidas_total", "Produtos lidos pelo motor de vencimento")
+VENCIMENTO_LINHAS_ATUALIZADAS = registro.contador(
+    "stockfield_vencimento_linhas_atualizadas_total", "Produtos com status alterado pelo motor de vencimento")
+
+
+def _tamanho_sessao(scope) -> int:
+    for parte in Headers(scope=scope).get("cookie", "").split(";"):
+        nome, _, valor = parte.strip().partition("=")
+        if nome == "session":
+            return len(valor)
+    return 0
+
+
+class MetricasRequisicoes:
+    """Middleware ASGI: conta requisições e mede a duração por rota (o molde da rota, não o caminho)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        status = 500
+        sessao = _tamanho_sessao(scope)
+        if sessao:
+            TAMANHO_SESSAO.observar(sessao)
+
+        async def enviar(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            # O FastAPI grava a rota encontrada no próprio scope
+            rota = getattr(scope.get("route"), "path", "desconhecida")
+            REQUISICOES.inc(scope["method"], rota, status)
+            DURACAO_REQUISICOES.observar(time.perf_counter() - inicio, scope["method"], rota)
@@ -0,0 +1,604 @@
+import sqlite3
+
+from auditoria import migrar_detalhes
+from consumo import reconstruir_consumo
+
+# Escopo das linhas de contadores que somam todos os usuários
+ESCOPO_GLOBAL = "*"
+
+
+def _contadores_colecao(tabela: str) -> list:
+    """Gatilhos que mantêm contadores[usuario, tabela] e o total global em dia."""
+    comandos = []
+    for evento, linha, delta in (("INSERT", "NEW", 1), ("DELETE", "OLD", -1)):
+        comandos.append(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_contadores_{tabela}_{evento.lower()}
+        AFTER {evento} ON {tabela}
+        BEGIN
+            INSERT INTO contadores (escopo, colecao, total) VALUES ({linha}.usuario_uuid, '{tabela}', {delta})
+            ON CONFLICT (escopo, colecao) DO UPDATE SET total = total + ({delta});
+            INSERT INTO contadores (escopo, colecao, total) VALUES ('{ESCOPO_GLOBAL}', '{tabela}', {delta})
+            ON CONFLICT (escopo, colecao) DO UPDATE SET total = total + ({delta});
+        END""")
+    comandos.append(_recontar_colecao(tabela))
+    return comandos
+
+
+def _recontar_colecao(tabela: str) -> str:
+    return f"""
+        INSERT OR REPLACE INTO contadores (escopo, colecao, total)
+        SELECT usuario_uuid, '{tabela}', COUNT(*) FROM {tabela} GROUP BY usuario_uuid
+        UNION ALL
+        SELECT '{ESCOPO_GLOBAL}', '{tabela}', COUNT(*) FROM {tabela}"""
+
+
+def _incrementar_versao(escopo: str, tabela: str, condicao: str = None) -> str:
+    if condicao:
+        valores = f"SELECT {escopo}, '{tabela}', 1 WHERE {condicao}"
+    else:
+        valores = f"VALUES ({escopo}, '{tabela}', 1)"
+    return f"""
+            INSERT INTO versoes_dados (escopo, colecao, versao) {valores}
+            ON CONFLICT (escopo, colecao) DO UPDATE SET versao = versao + 1;"""
+
+
+def _versoes_colecao(tabela: str, dono: str = "usuario_uuid") -> list:
+    """Gatilhos que incrementam a versão da coleção do usuário (e a global) a cada escrita."""
+    corpos = {
+        "INSERT": _incrementar_versao(f"NEW.{dono}", tabela),
+        "DELETE": _incrementar_versao(f"OLD.{dono}", tabela),
+        "UPDATE": _incrementar_versao(f"OLD.{dono}", tabela)
+        + _incrementar_versao(f"NEW.{dono}", tabela, f"NEW.{dono} IS NOT OLD.{dono}"),
+    }
+    return [f"""
+        CREATE TRIGGER IF NOT EXISTS trg_versoes_{tabela}_{evento.lower()}
+        AFTER {evento} ON {tabela}
+        BEGIN{corpo}{_incrementar_versao(f"'{ESCOPO_GLOBAL}'", tabela)}
+        END""" for evento, corpo in corpos.items()]
+
+
+# Contribuição de um produto (NEW ou OLD) para cada contador do resumo
+def _contribuicoes_resumo(linha: str) -> dict:
+    return {
+        "estoque_baixo": f"({linha}.estoque_minimo > 0 AND {linha}.quantidade <= {linha}.estoque_minimo AND {linha}.status != 'vencido')",
+        "estoque_esgotado": f"({linha}.quantidade = 0 AND {linha}.status != 'vencido')",
+        "total_monitorados": f"({linha}.estoque_minimo > 0)",
+        "vencidos": f"({linha}.status = 'vencido')",
+        "a_vencer": f"({linha}.status = 'a_vencer')",
+    }
+
+
+def _somar_resumo(linha: str, sinal: str) -> str:
+    contribuicoes = _contribuicoes_resumo(linha)
+    colunas = ", ".join(contribuicoes)
+    valores = ", ".join(f"{sinal}{expr}" for expr in contribuicoes.values())
+    atualizacoes = ", ".join(f"{col} = {col} + excluded.{col}" for col in contribuicoes)
+    return f"""
+            INSERT INTO resumo_estoque (usuario_uuid, {colunas}) VALUES ({linha}.usuario_uuid, {valores})
+            ON CONFLICT (usuario_uuid) DO UPDATE SET {atualizacoes};"""
+
+
+# Os dois ponteiros usam índices parciais com exatamente estes filtros
+def _ponteiros_resumo(usuario: str) -> str:
+    return f"""
+            mais_critico_uuid = (
+                SELECT uuid FROM produtos
+                WHERE usuario_uuid = {usuario}
+                AND estoque_minimo > 0 AND quantidade <= estoque_minimo AND status != 'vencido'
+                ORDER BY quantidade ASC LIMIT 1
+            ),
+            proximo_vencimento_uuid = (
+                SELECT uuid FROM produtos
+                WHERE usuario_uuid = {usuario}
+                AND data_validade IS NOT NULL AND data_validade != '' AND status != 'vencido'
+                ORDER BY data_validade ASC LIMIT 1
+            )"""
+
+
+def _atualizar_ponteiros(linha: str) -> str:
+    return f"""
+            UPDATE resumo_estoque SET {_ponteiros_resumo(linha + ".usuario_uuid")}
+            WHERE usuario_uuid = {linha}.usuario_uuid;"""
+
+
+# Recalcula todo o resumo a partir de produtos
+SQL_RECONSTRUIR_RESUMOS = [
+    "DELETE FROM resumo_estoque",
+    f"""INSERT INTO resumo_estoque (usuario_uuid, {", ".join(_contribuicoes_resumo("p"))})
+        SELECT p.usuario_uuid, {", ".join(f"SUM({expr})" for expr in _contribuicoes_resumo("p").values())}
+        FROM produtos p
+        GROUP BY p.usuario_uuid""",
+    f"UPDATE resumo_estoque SET {_ponteiros_resumo('resumo_estoque.usuario_uuid')}",
+]
+
+
+# Recalcula os contadores (usado depois de cargas feitas com os gatilhos desligados)
+COLECOES_CONTADAS = ["produtos", "movimentos", "fornecedores", "logs"]
+SQL_RECONSTRUIR_CONTADORES = [
+    "DELETE FROM contadores",
+    *(_recontar_colecao(tabela) for tabela in COLECOES_CONTADAS),
+]
+
+
+# Razão de estoque: cada mudança de quantidade de um produto vira um
+# lançamento com a variação, gravado pelo gatilho na mesma transação da
+# escrita. Cadastro e exclusão também entram (de/para zero), então a soma
+# dos lançamentos de um produto é sempre a sua quantidade.
+def _razao_produtos() -> list:
+    eventos = {
+        "INSERT": ("NEW", "NEW.quantidade", "NEW.quantidade != 0"),
+        "UPDATE OF quantidade": ("NEW", "NEW.quantidade - OLD.quantidade", "NEW.quantidade != OLD.quantidade"),
+        "DELETE": ("OLD", "-OLD.quantidade", "OLD.quantidade != 0"),
+    }
+    return [f"""
+        CREATE TRIGGER IF NOT EXISTS trg_razao_produtos_{evento.split()[0].lower()}
+        AFTER {evento} ON produtos
+        WHEN {condicao}
+        BEGIN
+            INSERT INTO razao_estoque (produto_uuid, usuario_uuid, variacao)
+            VALUES ({linha}.uuid, {linha}.usuario_uuid, {variacao});
+        END""" for evento, (linha, variacao, condicao) in eventos.items()]
+
+
+# Saldo de fechamento de cada produto nos dias em que ele mudou, pela data
+# das movimentações (a data de negócio, não a da gravação). Parte da
+# quantidade atual e desconta as movimentações posteriores a cada dia. O
+# cadastro do produto (pelo log) e o dia de hoje também ganham uma linha,
+# para produtos sem movimentação aparecerem desde que existem.
+VARIACAO_MOVIMENTO = "CASE WHEN {0}.tipo = 'entrada' THEN {0}.quantidade ELSE -{0}.quantidade END"
+
+SQL_RECONSTRUIR_ESTOQUE_DIARIO = [
+    "DELETE FROM estoque_diario",
+    f"""INSERT INTO estoque_diario (produto_uuid, dia, quantidade)
+    SELECT d.produto_uuid, d.dia, p.quantidade - COALESCE(SUM(d.variacao) OVER (
+        PARTITION BY d.produto_uuid ORDER BY d.dia DESC
+        ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+    ), 0)
+    FROM (
+        SELECT produto_uuid, dia, SUM(variacao) as variacao
+        FROM (
+            SELECT m.produto_uuid, date(m.data) as dia, {VARIACAO_MOVIMENTO.format("m")} as variacao
+            FROM movimentos m
+            UNION ALL
+            SELECT uuid, date('now', 'localtime'), 0 FROM produtos
+            UNION ALL
+            SELECT entidade_uuid, date(data), 0 FROM logs
+            WHERE entidade = 'produto' AND acao = 'Novo Produto Cadastrado'
+        )
+        WHERE dia IS NOT NULL
+        GROUP BY produto_uuid, dia
+    ) d
+    JOIN produtos p ON p.uuid = d.produto_uuid""",
+]
+
+# Cada lançamento do razão soma no dia em que foi gravado (e nos dias
+# seguintes já registrados); o primeiro do dia parte do último saldo
+_ESTOQUE_DIARIO_RAZAO = """CREATE TRIGGER IF NOT EXISTS trg_estoque_diario_razao
+        AFTER INSERT ON razao_estoque
+        BEGIN
+            INSERT INTO estoque_diario (produto_uuid, dia, quantidade)
+            VALUES (
+                NEW.produto_uuid,
+                date(NEW.registrado_em),
+                COALESCE((
+                    SELECT quantidade FROM estoque_diario
+                    WHERE produto_uuid = NEW.produto_uuid AND dia < date(NEW.registrado_em)
+                    ORDER BY dia DESC LIMIT 1
+                ), 0) + NEW.variacao
+            )
+            ON CONFLICT (produto_uuid, dia) DO UPDATE SET quantidade = quantidade + NEW.variacao;
+            UPDATE estoque_diario SET quantidade = quantidade + NEW.variacao
+            WHERE produto_uuid = NEW.produto_uuid AND dia > date(NEW.registrado_em);
+        END"""
+
+# Uma movimentação com data diferente de hoje leva a variação que o razão
+# lançou hoje para a data dela: os saldos entre as duas datas mudam. Supõe
+# o produto já atualizado (as rotas mudam a quantidade antes de gravar a
+# movimentação). Um dia anterior a todas as linhas do produto parte da
+# primeira linha antes de hoje ou, sem ela, da quantidade atual, descontadas
+# as movimentações posteriores, como na reconstrução.
+_MOVIMENTOS_APOS = """SELECT COALESCE(SUM({variacao}), 0) FROM movimentos m
+                WHERE m.produto_uuid = NEW.produto_uuid AND date(m.data) > date(NEW.data){{}}""".format(
+    variacao=VARIACAO_MOVIMENTO.format("m"))
+
+_ESTOQUE_DIARIO_MOVIMENTO = f"""CREATE TRIGGER IF NOT EXISTS trg_estoque_diario_movimento
+        AFTER INSERT ON movimentos
+        WHEN date(NEW.data) IS NOT NULL AND date(NEW.data) != date('now', 'localtime')
+        BEGIN
+            INSERT INTO estoque_diario (produto_uuid, dia, quantidade)
+            SELECT NEW.produto_uuid, date(NEW.data), COALESCE((
+                SELECT quantidade FROM estoque_diario
+                WHERE produto_uuid = NEW.produto_uuid AND dia < date(NEW.data)
+                ORDER BY dia DESC LIMIT 1
+            ), (
+                SELECT e.quantidade - ({_MOVIMENTOS_APOS.format(" AND date(m.data) <= e.dia")})
+                FROM estoque_diario e
+                WHERE e.produto_uuid = NEW.produto_uuid AND e.dia < date('now', 'localtime')
+                ORDER BY e.dia LIMIT 1
+            ), (
+                SELECT p.quantidade - ({_MOVIMENTOS_APOS.format("")}) - CASE
+                    WHEN date(NEW.data) < date('now', 'localtime') THEN {VARIACAO_MOVIMENTO.format("NEW")}
+                    ELSE 0
+                END
+                FROM produtos p WHERE p.uuid = NEW.produto_uuid
+            ), 0)
+            WHERE true
+            ON CONFLICT (produto_uuid, dia) DO NOTHING;
+            UPDATE estoque_diario
+            SET quantidade = quantidade + CASE
+                WHEN date(NEW.data) < date('now', 'localtime') THEN {VARIACAO_MOVIMENTO.format("NEW")}
+                ELSE -({VARIACAO_MOVIMENTO.format("NEW")})
+            END
+            WHERE produto_uuid = NEW.produto_uuid
+            AND dia >= min(date(NEW.data), date('now', 'localtime'))
+            AND dia < max(date(NEW.data), date('now', 'localtime'));
+        END"""
+
+
+# Busca textual de produtos (FTS5). O rowid de produtos pode mudar num
+# VACUUM (a chave é o uuid), então cada produto ganha um id estável em
+# busca_produtos, que é o rowid da linha em produtos_busca. A coluna usuario
+# entra no índice para a busca já filtrar o dono dentro do próprio FTS.
+COLUNAS_BUSCA = ["nome", "descricao", "lote", "localizacao", "numero_anvisa"]
+_ID_BUSCA = "(SELECT id FROM busca_produtos WHERE produto_uuid = {}.uuid)"
+
+
+def _busca_produtos() -> list:
+    valores = ", ".join(f"NEW.{coluna}" for coluna in COLUNAS_BUSCA)
+    fornecedor = "(SELECT nome FROM fornecedores WHERE uuid = NEW.fornecedor_uuid)"
+    alterado = " OR ".join(
+        f"NEW.{coluna} IS NOT OLD.{coluna}" for coluna in [*COLUNAS_BUSCA, "fornecedor_uuid", "usuario_uuid"]
+    )
+    atribuicoes = ", ".join(f"{coluna} = NEW.{coluna}" for coluna in COLUNAS_BUSCA)
+    produtos_do_fornecedor = """(
+                SELECT b.id FROM produtos p JOIN busca_produtos b ON b.produto_uuid = p.uuid
+                WHERE p.fornecedor_uuid = OLD.uuid
+            )"""
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS trg_busca_produtos_insert
+        AFTER INSERT ON produtos
+        BEGIN
+            INSERT INTO busca_produtos (produto_uuid) VALUES (NEW.uuid);
+            INSERT INTO produtos_busca (rowid, {", ".join(COLUNAS_BUSCA)}, fornecedor, usuario)
+            VALUES ({_ID_BUSCA.format("NEW")}, {valores}, {fornecedor}, NEW.usuario_uuid);
+        END""",
+        # Só quando um campo pesquisável mudou: as movimentações não tocam no índice
+        f"""CREATE TRIGGER IF NOT EXISTS trg_busca_produtos_update
+        AFTER UPDATE ON produtos
+        WHEN {alterado}
+        BEGIN
+            UPDATE produtos_busca SET {atribuicoes}, fornecedor = {fornecedor}, usuario = NEW.usuario_uuid
+            WHERE rowid = {_ID_BUSCA.format("OLD")};
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_busca_produtos_delete
+        AFTER DELETE ON produtos
+        BEGIN
+            DELETE FROM produtos_busca WHERE rowid = {_ID_BUSCA.format("OLD")};
+            DELETE FROM busca_produtos WHERE produto_uuid = OLD.uuid;
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_busca_fornecedores_update
+        AFTER UPDATE OF nome ON fornecedores
+        WHEN NEW.nome IS NOT OLD.nome
+        BEGIN
+            UPDATE produtos_busca SET fornecedor = NEW.nome WHERE rowid IN {produtos_do_fornecedor};
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_busca_fornecedores_delete
+        AFTER DELETE ON fornecedores
+        BEGIN
+            UPDATE produtos_busca SET fornecedor = NULL WHERE rowid IN {produtos_do_fornecedor};
+        END""",
+    ]
+
+
+SQL_RECONSTRUIR_BUSCA = [
+    "DELETE FROM produtos_busca",
+    "DELETE FROM busca_produtos",
+    "INSERT INTO busca_produtos (produto_uuid) SELECT uuid FROM produtos",
+    f"""INSERT INTO produtos_busca (rowid, {", ".join(COLUNAS_BUSCA)}, fornecedor, usuario)
+    SELECT b.id, {", ".join(f"p.{coluna}" for coluna in COLUNAS_BUSCA)}, f.nome, p.usuario_uuid
+    FROM produtos p
+    JOIN busca_produtos b ON b.produto_uuid = p.uuid
+    LEFT JOIN fornecedores f ON f.uuid = p.fornecedor_uuid""",
+    # Junta os segmentos do índice depois da carga
+    "INSERT INTO produtos_busca (produtos_busca) VALUES ('optimize')",
+]
+
+
+# Validade como texto ordenável nas listagens de produtos: sem validade
+# (NULL ou texto vazio) fica depois de qualquer data. As consultas usam a
+# expressão idêntica para o SQLite escolher os índices da migração 12.
+VALIDADE_ORDENAVEL = "COALESCE(NULLIF(data_validade, ''), '9999-12-31')"
+
+
+# Migrações do esquema, aplicadas em ordem na inicialização.
+# A versão atual fica gravada no próprio banco (PRAGMA user_version), então
+# um stockfield.db existente é atualizado no lugar, aplicando só o que falta.
+# Cada passo é um comando SQL ou uma função que recebe o cursor.
+# Nunca altere uma migração já publicada: crie uma nova no fim da lista.
+MIGRACOES = [
+    (1, "Índices das consultas principais", [
+        # Listagem de produtos e dropdown (filtro por usuário, ordem por nome)
+        "CREATE INDEX IF NOT EXISTS idx_produtos_usuario_nome ON produtos (usuario_uuid, nome)",
+        # Resumo de alertas e próximos vencimentos do usuário
+        "CREATE INDEX IF NOT EXISTS idx_produtos_usuario_validade ON produtos (usuario_uuid, data_validade)",
+        # Estoque baixo ordenado pela quantidade
+        "CREATE INDEX IF NOT EXISTS idx_produtos_usuario_quantidade ON produtos (usuario_uuid, quantidade)",
+        # Alertas globais e estatísticas do admin por status
+        "CREATE INDEX IF NOT EXISTS idx_produtos_status_validade ON produtos (status, data_validade)",
+        # Calendário de transições do motor de vencimento
+        "CREATE INDEX IF NOT EXISTS idx_produtos_data_validade ON produtos (data_validade)",
+        "CREATE INDEX IF NOT EXISTS idx_produtos_fornecedor ON produtos (fornecedor_uuid)",
+        # Histórico de movimentações do usuário, mais recentes primeiro
+        "CREATE INDEX IF NOT EXISTS idx_movimentos_usuario_data ON movimentos (usuario_uuid, data DESC)",
+        # Últimas movimentações de cada fornecedor
+        "CREATE INDEX IF NOT EXISTS idx_movimentos_fornecedor_data ON movimentos (fornecedor_uuid, usuario_uuid, data DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_movimentos_produto ON movimentos (produto_uuid)",
+        "CREATE INDEX IF NOT EXISTS idx_fornecedores_usuario_nome ON fornecedores (usuario_uuid, nome)",
+        # Relatório de logs do usuário
+        "CREATE INDEX IF NOT EXISTS idx_logs_usuario_data ON logs (usuario_uuid, data DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_usuarios_tipo ON usuarios (tipo)",
+        "ANALYZE",
+    ]),
+    (2, "Ordem estável para paginação e contadores por coleção", [
+        # Chaves completas (com uuid como desempate) para a paginação por cursor
+        "DROP INDEX IF EXISTS idx_produtos_usuario_nome",
+        "CREATE INDEX IF NOT EXISTS idx_produtos_usuario_nome_uuid ON produtos (usuario_uuid, nome, uuid)",
+        "CREATE INDEX IF NOT EXISTS idx_produtos_nome_uuid ON produtos (nome, uuid)",
+        "DROP INDEX IF EXISTS idx_movimentos_usuario_data",
+        "CREATE INDEX IF NOT EXISTS idx_movimentos_usuario_data_uuid ON movimentos (usuario_uuid, data DESC, uuid DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_fornecedores_nome_uuid ON fornecedores (nome, uuid)",
+        "DROP INDEX IF EXISTS idx_logs_usuario_data",
+        "CREATE INDEX IF NOT EXISTS idx_logs_usuario_data_uuid ON logs (usuario_uuid, data DESC, uuid DESC)",
+        # Totais por usuário e globais, mantidos pelos gatilhos abaixo
+        """CREATE TABLE IF NOT EXISTS contadores (
+            escopo TEXT NOT NULL,
+            colecao TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (escopo, colecao)
+        ) WITHOUT ROWID""",
+        *_contadores_colecao("produtos"),
+        *_contadores_colecao("movimentos"),
+        *_contadores_colecao("fornecedores"),
+        *_contadores_colecao("logs"),
+    ]),
+    (3, "Resumo de estoque e validade por usuário", [
+        """CREATE TABLE IF NOT EXISTS resumo_estoque (
+            usuario_uuid TEXT PRIMARY KEY,
+            estoque_baixo INTEGER NOT NULL DEFAULT 0,
+            estoque_esgotado INTEGER NOT NULL DEFAULT 0,
+            total_monitorados INTEGER NOT NULL DEFAULT 0,
+            vencidos INTEGER NOT NULL DEFAULT 0,
+            a_vencer INTEGER NOT NULL DEFAULT 0,
+            mais_critico_uuid TEXT,
+            proximo_vencimento_uuid TEXT
+        )""",
+        """CREATE INDEX IF NOT EXISTS idx_produtos_criticos ON produtos (usuario_uuid, quantidade)
+            WHERE estoque_minimo > 0 AND quantidade <= estoque_minimo AND status != 'vencido'""",
+        """CREATE INDEX IF NOT EXISTS idx_produtos_proximos_vencimentos ON produtos (usuario_uuid, data_validade)
+            WHERE data_validade IS NOT NULL AND data_validade != '' AND status != 'vencido'""",
+        # Mantido na mesma transação de cada escrita em produtos
+        f"""CREATE TRIGGER IF NOT EXISTS trg_resumo_produtos_insert
+        AFTER INSERT ON produtos
+        BEGIN{_somar_resumo("NEW", "")}{_atualizar_ponteiros("NEW")}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_resumo_produtos_delete
+        AFTER DELETE ON produtos
+        BEGIN{_somar_resumo("OLD", "-")}{_atualizar_ponteiros("OLD")}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_resumo_produtos_update
+        AFTER UPDATE OF quantidade, estoque_minimo, status, data_validade, usuario_uuid ON produtos
+        WHEN OLD.quantidade IS NOT NEW.quantidade
+            OR OLD.estoque_minimo IS NOT NEW.estoque_minimo
+            OR OLD.status IS NOT NEW.status
+            OR OLD.data_validade IS NOT NEW.data_validade
+            OR OLD.usuario_uuid IS NOT NEW.usuario_uuid
+        BEGIN{_somar_resumo("OLD", "-")}{_somar_resumo("NEW", "")}{_atualizar_ponteiros("OLD")}{_atualizar_ponteiros("NEW")}
+        END""",
+        *SQL_RECONSTRUIR_RESUMOS,
+    ]),
+    (4, "Concessões e últimos resultados das tarefas agendadas", [
+        # Uma linha por tarefa: quem detém a concessão e até quando,
+        # mais o resultado da última execução
+        """CREATE TABLE IF NOT EXISTS tarefas_agendadas (
+            nome TEXT PRIMARY KEY,
+            dono TEXT,
+            concessao_ate REAL NOT NULL DEFAULT 0,
+            ultima_execucao TEXT,
+            ultima_duracao_ms REAL,
+            ultimo_resultado TEXT,
+            ultimo_erro TEXT
+        )""",
+    ]),
+    (5, "Eventos de auditoria estruturados", [
+        "ALTER TABLE logs ADD COLUMN entidade TEXT",
+        "ALTER TABLE logs ADD COLUMN entidade_uuid TEXT",
+        "ALTER TABLE logs ADD COLUMN dados TEXT",
+        # Converte o texto 'Chave: valor | ...' dos eventos já gravados
+        migrar_detalhes,
+        # Histórico de uma entidade e busca por ação
+        "CREATE INDEX IF NOT EXISTS idx_logs_entidade ON logs (entidade_uuid)",
+        "CREATE INDEX IF NOT EXISTS idx_logs_usuario_acao_data_uuid ON logs (usuario_uuid, acao, data DESC, uuid DESC)",
+    ]),
+    (6, "Versões das coleções por usuário (ETags)", [
+        # Incrementadas na mesma transação de qualquer escrita, inclusive as
+        # feitas pelo motor de vencimento e pelos lotes
+        """CREATE TABLE IF NOT EXISTS versoes_dados (
+            escopo TEXT NOT NULL,
+            colecao TEXT NOT NULL,
+            versao INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (escopo, colecao)
+        ) WITHOUT ROWID""",
+        *_versoes_colecao("produtos"),
+        *_versoes_colecao("movimentos"),
+        *_versoes_colecao("fornecedores"),
+    ]),
+    (7, "Versões da coleção de usuários (cache das estatísticas)", [
+        # O escopo de cada usuário é o próprio uuid
+        *_versoes_colecao("usuarios", dono="uuid"),
+    ]),
+    (8, "Razão de estoque e fotos periódicas por produto", [
+        """CREATE TABLE IF NOT EXISTS razao_estoque (
+            id INTEGER PRIMARY KEY,
+            produto_uuid TEXT NOT NULL,
+            usuario_uuid TEXT NOT NULL,
+            variacao INTEGER NOT NULL,
+            registrado_em TEXT NOT NULL DEFAULT (datetime('now', 'localtime'))
+        )""",
+        # Lançamentos de um produto em ordem, para somar a partir de uma foto
+        "CREATE INDEX IF NOT EXISTS idx_razao_estoque_produto ON razao_estoque (produto_uuid, id)",
+        # Só inclusões: corrigir um saldo é lançar outra variação
+        """CREATE TRIGGER IF NOT EXISTS trg_razao_estoque_update BEFORE UPDATE ON razao_estoque
+        BEGIN
+            SELECT RAISE(ABORT, 'razao_estoque aceita apenas inclusões');
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_razao_estoque_delete BEFORE DELETE ON razao_estoque
+        BEGIN
+            SELECT RAISE(ABORT, 'razao_estoque aceita apenas inclusões');
+        END""",
+        # Quantidade de um produto até um lançamento do razão (inclusive)
+        """CREATE TABLE IF NOT EXISTS fotos_estoque (
+            produto_uuid TEXT NOT NULL,
+            razao_id INTEGER NOT NULL,
+            quantidade INTEGER NOT NULL,
+            registrado_em TEXT NOT NULL,
+            PRIMARY KEY (produto_uuid, razao_id)
+        ) WITHOUT ROWID""",
+        # Até onde cada leitor periódico do razão já processou
+        """CREATE TABLE IF NOT EXISTS posicoes_razao (
+            leitor TEXT PRIMARY KEY,
+            razao_id INTEGER NOT NULL DEFAULT 0
+        )""",
+        *_razao_produtos(),
+        # A quantidade atual de cada produto abre o razão
+        """INSERT INTO razao_estoque (produto_uuid, usuario_uuid, variacao)
+        SELECT uuid, usuario_uuid, quantidade FROM produtos WHERE quantidade != 0""",
+    ]),
+    (9, "Saldos diários por produto (estoque em uma data)", [
+        # Uma linha por produto e dia com movimentação: o saldo no fim do dia.
+        # O saldo numa data é o da última linha até ela
+        """CREATE TABLE IF NOT EXISTS estoque_diario (
+            produto_uuid TEXT NOT NULL,
+            dia TEXT NOT NULL,
+            quantidade INTEGER NOT NULL,
+            PRIMARY KEY (produto_uuid, dia)
+        ) WITHOUT ROWID""",
+        # Cada lançamento soma no dia dele; o primeiro do dia parte do último saldo
+        """CREATE TRIGGER IF NOT EXISTS trg_estoque_diario_razao
+        AFTER INSERT ON razao_estoque
+        BEGIN
+            INSERT INTO estoque_diario (produto_uuid, dia, quantidade)
+            VALUES (
+                NEW.produto_uuid,
+                date(NEW.registrado_em),
+                COALESCE((
+                    SELECT quantidade FROM estoque_diario
+                    WHERE produto_uuid = NEW.produto_uuid AND dia < date(NEW.registrado_em)
+                    ORDER BY dia DESC LIMIT 1
+                ), 0) + NEW.variacao
+            )
+            ON CONFLICT (produto_uuid, dia) DO UPDATE SET quantidade = quantidade + NEW.variacao;
+        END""",
+        *SQL_RECONSTRUIR_ESTOQUE_DIARIO,
+    ]),
+    (10, "Consumo previsto por produto (média ponderada das saídas)", [
+        """CREATE TABLE IF NOT EXISTS consumo_produtos (
+            produto_uuid TEXT PRIMARY KEY,
+            saidas_ponderadas REAL NOT NULL,
+            primeira_saida TEXT NOT NULL,
+            ultima_saida TEXT NOT NULL
+        )""",
+        """CREATE TRIGGER IF NOT EXISTS trg_consumo_produtos_delete
+        AFTER DELETE ON produtos
+        BEGIN
+            DELETE FROM consumo_produtos WHERE produto_uuid = OLD.uuid;
+        END""",
+        reconstruir_consumo,
+    ]),
+    (11, "Busca textual de produtos (FTS5)", [
+        """CREATE TABLE IF NOT EXISTS busca_produtos (
+            id INTEGER PRIMARY KEY,
+            produto_uuid TEXT NOT NULL UNIQUE
+        )""",
+        # Sem acentos e com índice de prefixos curtos (busca enquanto se digita)
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS produtos_busca USING fts5(
+            {", ".join(COLUNAS_BUSCA)}, fornecedor, usuario,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3 4'
+        )""",
+        *_busca_produtos(),
+        *SQL_RECONSTRUIR_BUSCA,
+    ]),
+    (12, "Filtros e ordenações das listagens de produtos", [
+        # Por usuário e no painel do administrador (todos os usuários);
+        # cada ordenação termina em uuid para a paginação por cursor
+        f"CREATE INDEX IF NOT EXISTS idx_produtos_usuario_validade_uuid ON produtos (usuario_uuid, {VALIDADE_ORDENAVEL}, uuid)",
+        f"CREATE INDEX IF NOT EXISTS idx_produtos_validade_uuid ON produtos ({VALIDADE_ORDENAVEL}, uuid)",
+        "DROP INDEX IF EXISTS idx_produtos_usuario_quantidade",
+        "CREATE INDEX IF NOT EXISTS idx_produtos_usuario_quantidade_uuid ON produtos (usuario_uuid, quantidade, uuid)",
+        "CREATE INDEX IF NOT EXISTS idx_produtos_quantidade_uuid ON produtos (quantidade, uuid)",
+        # Filtros por igualdade já na ordem do nome
+        "CREATE INDEX IF NOT EXISTS idx_produtos_usuario_categoria_nome ON produtos (usuario_uuid, categoria, nome, uuid)",
+        "CREATE INDEX IF NOT EXISTS idx_produtos_usuario_status_nome ON produtos (usuario_uuid, status, nome, uuid)",
+        "CREATE INDEX IF NOT EXISTS idx_produtos_categoria_nome ON produtos (categoria, nome, uuid)",
+        "CREATE INDEX IF NOT EXISTS idx_produtos_fornecedor_nome ON produtos (fornecedor_uuid, nome, uuid)",
+        "DROP INDEX IF EXISTS idx_produtos_fornecedor",
+        "ANALYZE",
+    ]),
+    (13, "Marca diária do motor de vencimento no esquema versionado", [
+        # Último dia já processado pelo motor de vencimento, por janela de
+        # alerta (criada antes pelo init_db; bancos antigos já a têm)
+        """CREATE TABLE IF NOT EXISTS verificacoes_validade (
+            dias_alerta INTEGER PRIMARY KEY,
+            ultima_data TEXT NOT NULL
+        )""",
+    ]),
+    (14, "Saldos diários pela data das movimentações", [
+        "DROP TRIGGER IF EXISTS trg_estoque_diario_razao",
+        _ESTOQUE_DIARIO_RAZAO,
+        _ESTOQUE_DIARIO_MOVIMENTO,
+        *SQL_RECONSTRUIR_ESTOQUE_DIARIO,
+    ]),
+]
+
+
+def versao_atual(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def aplicar_migracoes(conn: sqlite3.Connection) -> int:
+    """
+    Aplica as migrações pendentes, cada uma em sua própria transação.
+    Retorna a versão final do esquema.
+    """
+    versao = versao_atual(conn)
+    ultima = MIGRACOES[-1][0] if MIGRACOES else 0
+    if versao > ultima:
+        raise RuntimeError(
+            f"Banco na versão {versao}, mais nova que a suportada por esta aplicação ({ultima})"
+        )
+
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        for numero, descricao, passos in MIGRACOES:
+            if numero <= versao:
+                continue
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                for passo in passos:
+                    if callable(passo):
+                        passo(cursor)
+                    else:
+                        cursor.execute(passo)
+                cursor.execute(f"PRAGMA user_version = {numero}")
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+            print(f"Migração {numero} aplicada: {descricao}")
+            versao = numero
+    finally:
+        conn.isolation_level = isolation_level
+
+    return versao
@@ -2,20 +2,35 @@ from typing import List, Optional, Literal
 from datetime import date, datetime, timedelta
 from enum import Enum
 import sqlite3, uuid
+import re
+import base64
+import json
+import threading
+import itertools
+import tempfile
+from functools import lru_cache
 import hashlib
 from pydantic import BaseModel
 import os
 from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle
+from reportlab.platypus import BaseDocTemplate, PageTemplate, Frame, NextPageTemplate, Paragraph, Spacer, Image, Table, TableStyle
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import cm
 from PIL import Image as PILImage
-from reportlab.lib.utils import ImageReader
 from io import BytesIO
+from xml.sax.saxutils import escape
 from reportlab.lib import colors
 
-DATABASE_URL = "./stockfield.db"
+from migracoes import aplicar_migracoes, ESCOPO_GLOBAL, SQL_RECONSTRUIR_RESUMOS, COLUNAS_BUSCA, VALIDADE_ORDENAVEL
+from conexoes import PoolConexoes, ExecutorBanco
+from auditoria import BufferAuditoria, carregar_dados, campos_evento
+from serializacao import compilar_serializador
+from consumo import registrar_consumo, prever_esgotamento
+from metricas import VENCIMENTO_EXECUCOES, VENCIMENTO_LINHAS_LIDAS, VENCIMENTO_LINHAS_ATUALIZADAS
+
+DATABASE_URL = os.environ.get("STOCKFIELD_DB", "./stockfield.db")
+# Lançamentos do razão acumulados por produto antes de uma nova foto do estoque
+LANCAMENTOS_POR_FOTO = int(os.environ.get("STOCKFIELD_LANCAMENTOS_POR_FOTO", "50"))
 
 class TipoUsuario(str, Enum):
     agricultor = "agricultor"
@@ -80,14 +95,177 @@ class Movimento(BaseModel):
     produto_nome: Optional[str] = None
     fornecedor_nome: Optional[str] = None
 
+class LoteMovimentos(BaseModel):
+    movimentos: List[Movimento]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def obter_pool() -> PoolConexoes:
+    """Pool de conexões do banco atual (recriado se DATABASE_URL mudar)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.caminho != DATABASE_URL:
+            if _pool is not None:
+                _pool.fechar()
+            _pool = PoolConexoes(DATABASE_URL)
+        return _pool
 
 def get_db():
-    conn = sqlite3.connect(DATABASE_URL, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
+    pool = obter_pool()
+    conn = pool.obter()
     try:
         yield conn
     finally:
-        conn.close()
+        pool.devolver(conn)
+
+_executor = None
+
+def obter_executor_db() -> ExecutorBanco:
+    global _executor
+    with _pool_lock:
+        if _executor is None:
+            _executor = ExecutorBanco(obter_pool)
+        return _executor
+
+async def executar_db(funcao, *args, **kwargs):
+    """Equivalente async do get_db: roda funcao(db, ...) no executor do banco."""
+    return await obter_executor_db().executar(funcao, *args, **kwargs)
+
+def encerrar_banco():
+    """Finaliza o executor e fecha as conexões livres do pool."""
+    global _executor, _pool
+    with _pool_lock:
+        executor, pool = _executor, _pool
+        _executor = _pool = None
+    if executor is not None:
+        executor.fechar()
+    if pool is not None:
+        pool.fechar()
+
+# Paginação por cursor (keyset): o cursor guarda os valores da ordenação
+# do último item entregue, então cada página é uma busca no índice
+TAMANHO_PAGINA = int(os.environ.get("STOCKFIELD_TAMANHO_PAGINA", "100"))
+TAMANHO_PAGINA_MAXIMO = 1000
+
+def codificar_cursor(valores) -> str:
+    dados = json.dumps(list(valores), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(dados).decode().rstrip("=")
+
+def decodificar_cursor(cursor: str, quantidade: int) -> list:
+    try:
+        dados = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        valores = json.loads(dados)
+    except (ValueError, TypeError):
+        raise ValueError("Cursor inválido")
+    if not isinstance(valores, list) or len(valores) != quantidade:
+        raise ValueError("Cursor inválido")
+    return valores
+
+def paginar(db: sqlite3.Connection, sql: str, params: list, ordem: List[str],
+            descendente: bool = False, cursor: str = None, limite: int = None,
+            chaves: List[str] = None):
+    """
+    Executa `sql` ordenado pelas colunas de `ordem` (a última deve ser única).
+    O SQL deve conter o marcador {pagina} dentro do WHERE. Sem cursor e sem
+    limite devolve todas as linhas. Retorna (linhas, proximo_cursor).
+    Quando `ordem` tem expressões, `chaves` nomeia as colunas da consulta com
+    os valores delas (por padrão, o nome de cada coluna sem a tabela).
+    """
+    params = list(params)
+    condicao = ""
+    if cursor:
+        valores = decodificar_cursor(cursor, len(ordem))
+        comparacao = "<" if descendente else ">"
+        marcadores = ", ".join("?" * len(ordem))
+        condicao = f"AND ({', '.join(ordem)}) {comparacao} ({marcadores})"
+        params.extend(valores)
+        if limite is None:
+            limite = TAMANHO_PAGINA
+
+    direcao = " DESC" if descendente else ""
+    consulta = sql.format(pagina=condicao)
+    consulta += " ORDER BY " + ", ".join(coluna + direcao for coluna in ordem)
+    if limite is not None:
+        consulta += " LIMIT ?"
+        params.append(limite + 1)
+
+    linhas = db.execute(consulta, params).fetchall()
+    proximo = None
+    if limite is not None and len(linhas) > limite:
+        linhas = linhas[:limite]
+        ultima = linhas[-1]
+        chaves = chaves or [coluna.split(".")[-1] for coluna in ordem]
+        proximo = codificar_cursor(ultima[chave] for chave in chaves)
+    return linhas, proximo
+
+def iterar_paginas(db: sqlite3.Connection, sql: str, params: list, ordem: List[str],
+                   descendente: bool = False, tamanho: int = 500):
+    """Percorre uma consulta página a página sem carregar o resultado inteiro."""
+    cursor = None
+    while True:
+        linhas, cursor = paginar(db, sql, params, ordem, descendente, cursor, tamanho)
+        yield from linhas
+        if cursor is None:
+            break
+
+# Ordenações aceitas nas listagens de produtos: colunas de `ordem` do paginar
+ORDENACOES_PRODUTOS = {
+    "nome": ["p.nome", "p.uuid"],
+    "validade": [VALIDADE_ORDENAVEL, "p.uuid"],
+    "quantidade": ["p.quantidade", "p.uuid"],
+}
+
+def consulta_produtos(colunas: str, filtros: dict, ordenar_por: str = "nome"):
+    """
+    Monta a listagem de produtos para o paginar a partir dos filtros não
+    nulos (usuario_uuid, categoria, status, fornecedor_uuid, vence_ate,
+    estoque_baixo). Retorna (sql, params, ordem, chaves).
+    """
+    condicoes, params = [], []
+    for campo in ("usuario_uuid", "categoria", "status", "fornecedor_uuid"):
+        if filtros.get(campo) is not None:
+            condicoes.append(f"p.{campo} = ?")
+            params.append(filtros[campo])
+    if filtros.get("vence_ate") is not None:
+        condicoes.append(f"{VALIDADE_ORDENAVEL} <= ?")
+        params.append(filtros["vence_ate"].isoformat())
+    if filtros.get("estoque_baixo"):
+        # Mesmas condições do índice parcial idx_produtos_criticos
+        condicoes.append("p.estoque_minimo > 0 AND p.quantidade <= p.estoque_minimo AND p.status != 'vencido'")
+
+    ordem = ORDENACOES_PRODUTOS[ordenar_por]
+    if ordenar_por == "validade":
+        colunas += f", {VALIDADE_ORDENAVEL} as validade_ordenavel"
+        chaves = ["validade_ordenavel", "uuid"]
+    else:
+        chaves = None
+    sql = f"""
+        SELECT {colunas}
+        FROM produtos p
+        LEFT JOIN usuarios u ON p.usuario_uuid = u.uuid
+        LEFT JOIN fornecedores f ON p.fornecedor_uuid = f.uuid
+        WHERE {" AND ".join(condicoes) or "1 = 1"} {{pagina}}
+    """
+    return sql, params, ordem, chaves
+
+def obter_total(db: sqlite3.Connection, colecao: str, escopo: str = ESCOPO_GLOBAL) -> int:
+    """Total de linhas de uma coleção, lido dos contadores mantidos pelos gatilhos."""
+    linha = db.execute(
+        "SELECT total FROM contadores WHERE escopo = ? AND colecao = ?", (escopo, colecao)
+    ).fetchone()
+    return linha[0] if linha else 0
+
+def obter_versoes(db: sqlite3.Connection, colecoes: List[str], escopo: str = ESCOPO_GLOBAL) -> dict:
+    """Versão atual de cada coleção (incrementada pelos gatilhos a cada escrita)."""
+    marcadores = ", ".join("?" * len(colecoes))
+    cursor = db.execute(
+        f"SELECT colecao, versao FROM versoes_dados WHERE escopo = ? AND colecao IN ({marcadores})",
+        [escopo, *colecoes]
+    )
+    versoes = dict(cursor.fetchall())
+    return {colecao: versoes.get(colecao, 0) for colecao in colecoes}
 
 def init_db():
     with sqlite3.connect(DATABASE_URL) as conn:
@@ -172,85 +350,179 @@ def init_db():
             FOREIGN KEY (usuario_uuid) REFERENCES usuarios (uuid)
         )
         """)
-        
+
         conn.commit()
 
+        aplicar_migracoes(conn)
+
+
+# Status que um produto com validade deve ter na data de referência.
+# Produtos fora da janela só voltam a "disponível" se estavam marcados
+# por vencimento (um produto esgotado continua esgotado).
+STATUS_VALIDADE_SQL = """
+    CASE
+        WHEN data_validade < :hoje THEN 'vencido'
+        WHEN data_validade <= :limite THEN 'a_vencer'
+        WHEN status IN ('a_vencer', 'vencido') THEN 'disponível'
+        ELSE status
+    END
+"""
+
+def status_apos_movimento(quantidade: int, data_validade: Optional[str], dias_alerta: int = 7) -> str:
+    """
+    Status de um produto depois de uma movimentação. Vencido e a vencer têm
+    prioridade sobre a quantidade: o motor de vencimento só revisita um
+    produto quando a validade cruza um limite, então uma movimentação não
+    pode apagar esse status.
+    """
+    if data_validade:
+        try:
+            dias_restantes = (date.fromisoformat(data_validade) - date.today()).days
+        except ValueError:
+            dias_restantes = None
+        if dias_restantes is not None and dias_restantes < 0:
+            return StatusProduto.vencido.value
+        if dias_restantes is not None and dias_restantes <= dias_alerta:
+            return StatusProduto.a_vencer.value
+    return StatusProduto.disponivel.value if quantidade > 0 else StatusProduto.esgotado.value
+
+def aplicar_variacao_estoque(db: sqlite3.Connection, produto_uuid: str, usuario_uuid: str,
+                             variacao: int, dias_alerta: int = 7) -> Optional[dict]:
+    """
+    Soma `variacao` à quantidade do produto num UPDATE condicional: a checagem
+    de saldo e a escrita são o mesmo comando, então duas saídas simultâneas não
+    passam as duas pela checagem nem uma sobrescreve a outra. O UPDATE abre a
+    transação já com a trava de escrita e o gatilho grava o lançamento no razão.
+    Retorna o produto atualizado, ou None se ele não existe (para o usuário)
+    ou o saldo não cobre a saída.
+    """
+    cursor = db.cursor()
+    cursor.execute("""
+        UPDATE produtos SET quantidade = quantidade + :variacao
+        WHERE uuid = :produto AND usuario_uuid = :usuario AND quantidade + :variacao >= 0
+    """, {"variacao": variacao, "produto": produto_uuid, "usuario": usuario_uuid})
+    if cursor.rowcount == 0:
+        return None
+
+    cursor.execute("SELECT * FROM produtos WHERE uuid = ?", (produto_uuid,))
+    produto = dict(cursor.fetchone())
+    novo_status = status_apos_movimento(produto["quantidade"], produto["data_validade"], dias_alerta)
+    if novo_status != produto["status"]:
+        cursor.execute("UPDATE produtos SET status = ? WHERE uuid = ?", (novo_status, produto_uuid))
+        produto["status"] = novo_status
+    return produto
 
-def verificar_produtos_a_vencer(db: sqlite3.Connection, dias_alerta: int = 7):
+def verificar_produtos_a_vencer(db: sqlite3.Connection, dias_alerta: int = 7, completa: bool = False):
     """
-    Verifica produtos que estão próximos do vencimento (hoje + X dias)
-    Retorna lista de produtos com status atualizado
+    Atualiza o status dos produtos cuja validade cruzou um limite
+    (entrada na janela de alerta ou vencimento) desde a última verificação.
+
+    Os limites de cada produto são deslocamentos fixos de data_validade, então
+    o índice idx_produtos_data_validade funciona como um calendário de
+    transições: para os dias entre a última verificação e hoje só precisamos
+    ler duas faixas de datas. A primeira execução (ou uma mudança de relógio
+    para trás) faz a reconciliação completa, assim como `completa=True`
+    (verificação forçada), que roda mesmo se o dia já foi processado. As
+    mudanças são aplicadas num único UPDATE e o dia processado fica
+    registrado em verificacoes_validade.
+    Retorna os produtos que mudaram de status nesta execução.
     """
     cursor = db.cursor()
     hoje = date.today()
     data_limite = hoje + timedelta(days=dias_alerta)
-    
-    cursor.execute("""
-        SELECT * FROM produtos 
-        WHERE data_validade IS NOT NULL 
+
+    cursor.execute(
+        "SELECT ultima_data FROM verificacoes_validade WHERE dias_alerta = ?",
+        (dias_alerta,)
+    )
+    marca = cursor.fetchone()
+    ultima_data = date.fromisoformat(marca[0]) if marca else None
+
+    if ultima_data == hoje and not completa:
+        VENCIMENTO_EXECUCOES.inc("ignorada")
+        return {
+            "alertas": [],
+            "atualizados": [],
+            "total_alertas": 0,
+            "data_verificacao": hoje.isoformat()
+        }
+
+    params = {
+        "hoje": hoje.isoformat(),
+        "limite": data_limite.isoformat(),
+    }
+    if completa or ultima_data is None or ultima_data > hoje:
+        modo = "completa"
+        faixa = "(data_validade <= :limite OR status IN ('a_vencer', 'vencido'))"
+    else:
+        modo = "incremental"
+        # Entraram na janela: validade em (ultima + dias, hoje + dias]
+        # Venceram: validade em [ultima, hoje)
+        faixa = """(
+            (data_validade > :inicio_janela AND data_validade <= :limite)
+            OR (data_validade >= :inicio_vencidos AND data_validade < :hoje)
+        )"""
+        params["inicio_janela"] = (ultima_data + timedelta(days=dias_alerta)).isoformat()
+        params["inicio_vencidos"] = ultima_data.isoformat()
+
+    filtro = f"""
+        WHERE data_validade IS NOT NULL
         AND data_validade != ''
-    """)
-    
-    produtos = cursor.fetchall()
+        AND date(data_validade) IS NOT NULL
+        AND {faixa}
+        AND status != {STATUS_VALIDADE_SQL}
+    """
+
+    cursor.execute(f"""
+        SELECT uuid, nome, usuario_uuid, status, data_validade, {STATUS_VALIDADE_SQL} AS status_novo
+        FROM produtos
+        {filtro}
+    """, params)
+    mudancas = cursor.fetchall()
+
+    atualizadas = 0
+    if mudancas:
+        cursor.execute(f"UPDATE produtos SET status = {STATUS_VALIDADE_SQL} {filtro}", params)
+        atualizadas = cursor.rowcount
+
+    cursor.execute("""
+        INSERT INTO verificacoes_validade (dias_alerta, ultima_data) VALUES (?, ?)
+        ON CONFLICT(dias_alerta) DO UPDATE SET ultima_data = excluded.ultima_data
+    """, (dias_alerta, hoje.isoformat()))
+    db.commit()
+    VENCIMENTO_EXECUCOES.inc(modo)
+    VENCIMENTO_LINHAS_LIDAS.inc(quantidade=len(mudancas))
+    VENCIMENTO_LINHAS_ATUALIZADAS.inc(quantidade=atualizadas)
+
     produtos_atualizados = []
     alertas = []
-    
-    for produto in produtos:
-        produto_dict = dict(produto)
-        data_validade_str = produto_dict["data_validade"]
-        
-        if data_validade_str:
-            try:
-                data_validade = date.fromisoformat(data_validade_str)
-                dias_restantes = (data_validade - hoje).days
-                
-                novo_status = produto_dict["status"]
-                if dias_restantes < 0:
-                    # Produto vencido
-                    novo_status = StatusProduto.vencido.value
-                    alertas.append({
-                        "produto": produto_dict["nome"],
-                        "uuid": produto_dict["uuid"],
-                        "data_validade": data_validade,
-                        "status": "vencido",
-                        "dias_restantes": dias_restantes,
-                        "severidade": "alta"
-                    })
-                elif dias_restantes <= dias_alerta:
-                    # Produto a vencer
-                    novo_status = StatusProduto.a_vencer.value
-                    alertas.append({
-                        "produto": produto_dict["nome"],
-                        "uuid": produto_dict["uuid"],
-                        "data_validade": data_validade,
-                        "status": "a_vencer",
-                        "dias_restantes": dias_restantes,
-                        "severidade": "media" if dias_restantes > 3 else "alta"
-                    })
-                else:
-                    # Produto ainda tem tempo
-                    if produto_dict["status"] in [StatusProduto.a_vencer.value, StatusProduto.vencido.value]:
-                        novo_status = StatusProduto.disponivel.value
-                
-                if novo_status != produto_dict["status"]:
-                    cursor.execute(
-                        "UPDATE produtos SET status = ? WHERE uuid = ?",
-                        (novo_status, produto_dict["uuid"])
-                    )
-                    produtos_atualizados.append({
-                        "uuid": produto_dict["uuid"],
-                        "nome": produto_dict["nome"],
-                        "status_anterior": produto_dict["status"],
-                        "status_novo": novo_status,
-                        "dias_restantes": dias_restantes
-                    })
-                    
-            except ValueError:
-                continue
-    
-    if produtos_atualizados:
-        db.commit()
-    
+    for produto in mudancas:
+        data_validade = date.fromisoformat(produto["data_validade"])
+        dias_restantes = (data_validade - hoje).days
+        produtos_atualizados.append({
+            "uuid": produto["uuid"],
+            "nome": produto["nome"],
+            "usuario_uuid": produto["usuario_uuid"],
+            "status_anterior": produto["status"],
+            "status_novo": produto["status_novo"],
+            "dias_restantes": dias_restantes
+        })
+        if produto["status_novo"] == StatusProduto.vencido.value:
+            severidade = "alta"
+        elif produto["status_novo"] == StatusProduto.a_vencer.value:
+            severidade = "media" if dias_restantes > 3 else "alta"
+        else:
+            continue
+        alertas.append({
+            "produto": produto["nome"],
+            "uuid": produto["uuid"],
+            "usuario_uuid": produto["usuario_uuid"],
+            "data_validade": data_validade,
+            "status": produto["status_novo"],
+            "dias_restantes": dias_restantes,
+            "severidade": severidade
+        })
+
     return {
         "alertas": alertas,
         "atualizados": produtos_atualizados,
@@ -258,6 +530,8 @@ def verificar_produtos_a_vencer(db: sqlite3.Connection, dias_alerta: int = 7):
         "data_verificacao": hoje.isoformat()
     }
 
+COLUNAS_ALERTA_VENCIMENTO = ["uuid", "nome", "data_validade", "status", "quantidade", "lote"]
+
 def obter_alertas_vencimento(db: sqlite3.Connection, usuario_uuid: str = None, dias_alerta: int = 7):
     """
     Obtém alertas de vencimento para um usuário específico
@@ -266,12 +540,12 @@ def obter_alertas_vencimento(db: sqlite3.Connection, usuario_uuid: str = None, d
     hoje = date.today()
     
     query = """
-        SELECT uuid, nome, data_validade, status, quantidade, lote 
+        SELECT {} 
         FROM produtos 
         WHERE data_validade IS NOT NULL 
         AND data_validade != ''
         AND (status = ? OR status = ?)
-    """
+    """.format(", ".join(COLUNAS_ALERTA_VENCIMENTO))
     params = [StatusProduto.a_vencer.value, StatusProduto.vencido.value]
     
     if usuario_uuid:
@@ -283,63 +557,41 @@ def obter_alertas_vencimento(db: sqlite3.Connection, usuario_uuid: str = None, d
     cursor.execute(query, params)
     produtos = cursor.fetchall()
     
-    alertas = []
-    for produto in produtos:
-        produto_dict = dict(produto)
-        data_validade = date.fromisoformat(produto_dict["data_validade"])
-        dias_restantes = (data_validade - hoje).days
-        
-        alertas.append({
-            **produto_dict,
-            "dias_restantes": dias_restantes,
-            "severidade": "vencido" if dias_restantes < 0 else "a_vencer"
-        })
-    
-    return alertas
+    return [alerta_vencimento(dict(produto), hoje) for produto in produtos]
+
+def alerta_vencimento(produto_dict: dict, hoje: date) -> dict:
+    dias_restantes = (date.fromisoformat(produto_dict["data_validade"]) - hoje).days
+    return {
+        **produto_dict,
+        "dias_restantes": dias_restantes,
+        "severidade": "vencido" if dias_restantes < 0 else "a_vencer"
+    }
 
 def obter_resumo_alertas(db: sqlite3.Connection, usuario_uuid: str):
     """
     Retorna resumo de alertas para o painel do usuário
+    (lido de resumo_estoque, mantido pelos gatilhos de produtos)
     """
     cursor = db.cursor()
     hoje = date.today()
 
     cursor.execute("""
-        SELECT COUNT(*) as count 
-        FROM produtos 
-        WHERE usuario_uuid = ? 
-        AND status = ?
-    """, (usuario_uuid, StatusProduto.vencido.value))
-    vencidos = cursor.fetchone()["count"]
-    
-    # Produtos a vencer (próximos 7 dias)
-    cursor.execute("""
-        SELECT COUNT(*) as count 
-        FROM produtos 
-        WHERE usuario_uuid = ? 
-        AND status = ?
-    """, (usuario_uuid, StatusProduto.a_vencer.value))
-    a_vencer = cursor.fetchone()["count"]
-    
+        SELECT r.vencidos, r.a_vencer, p.nome, p.data_validade
+        FROM resumo_estoque r
+        LEFT JOIN produtos p ON p.uuid = r.proximo_vencimento_uuid
+        WHERE r.usuario_uuid = ?
+    """, (usuario_uuid,))
+    resumo = cursor.fetchone()
+
+    vencidos = resumo["vencidos"] if resumo else 0
+    a_vencer = resumo["a_vencer"] if resumo else 0
 
-    cursor.execute("""
-        SELECT nome, data_validade 
-        FROM produtos 
-        WHERE usuario_uuid = ? 
-        AND data_validade IS NOT NULL 
-        AND data_validade != ''
-        AND status != ?
-        ORDER BY data_validade ASC 
-        LIMIT 1
-    """, (usuario_uuid, StatusProduto.vencido.value))
-    proximo = cursor.fetchone()
-    
     proximo_info = None
-    if proximo:
-        data_validade = date.fromisoformat(proximo["data_validade"])
+    if resumo and resumo["nome"] is not None:
+        data_validade = date.fromisoformat(resumo["data_validade"])
         dias = (data_validade - hoje).days
         proximo_info = {
-            "nome": proximo["nome"],
+            "nome": resumo["nome"],
             "data_validade": data_validade.isoformat(),
             "dias_restantes": dias
         }
@@ -359,9 +611,10 @@ def verificar_estoque_baixo(db: sqlite3.Connection, usuario_uuid: str = None):
     cursor = db.cursor()
     
     query = """
-        SELECT p.*, f.nome as fornecedor_nome 
+        SELECT p.*, f.nome as fornecedor_nome, c.saidas_ponderadas, c.primeira_saida, c.ultima_saida
         FROM produtos p
         LEFT JOIN fornecedores f ON p.fornecedor_uuid = f.uuid
+        LEFT JOIN consumo_produtos c ON c.produto_uuid = p.uuid
         WHERE p.estoque_minimo > 0 
         AND p.quantidade <= p.estoque_minimo
         AND p.status != 'vencido'
@@ -377,117 +630,604 @@ def verificar_estoque_baixo(db: sqlite3.Connection, usuario_uuid: str = None):
     cursor.execute(query, params)
     produtos = cursor.fetchall()
     
-    alertas = []
-    for produto in produtos:
-        produto_dict = dict(produto)
-        alertas.append({
-            **produto_dict,
-            "estoque_atual": produto_dict["quantidade"],
-            "estoque_minimo": produto_dict["estoque_minimo"],
-            "diferenca": produto_dict["estoque_minimo"] - produto_dict["quantidade"],
-            "severidade": "critico" if produto_dict["quantidade"] == 0 else "baixo"
-        })
-    
-    return alertas
+    hoje = date.today()
+    return [alerta_estoque(dict(produto), hoje) for produto in produtos]
+
+def alerta_estoque(produto_dict: dict, hoje: date = None) -> dict:
+    # Previsão de esgotamento pelas colunas de consumo_produtos, quando vieram na consulta
+    previsao = prever_esgotamento(
+        produto_dict.pop("saidas_ponderadas", None),
+        produto_dict.pop("primeira_saida", None),
+        produto_dict.pop("ultima_saida", None),
+        produto_dict["quantidade"],
+        hoje or date.today()
+    )
+    return {
+        **produto_dict,
+        **previsao,
+        "estoque_atual": produto_dict["quantidade"],
+        "estoque_minimo": produto_dict["estoque_minimo"],
+        "diferenca": produto_dict["estoque_minimo"] - produto_dict["quantidade"],
+        "severidade": "critico" if produto_dict["quantidade"] == 0 else "baixo"
+    }
 
 def obter_resumo_estoque(db: sqlite3.Connection, usuario_uuid: str):
     """
     Retorna resumo de estoque para o painel do usuário
+    (lido de resumo_estoque, mantido pelos gatilhos de produtos)
     """
     cursor = db.cursor()
     
-    # Produtos com estoque crítico (abaixo do mínimo)
     cursor.execute("""
-        SELECT COUNT(*) as count 
-        FROM produtos 
-        WHERE usuario_uuid = ? 
-        AND estoque_minimo > 0 
-        AND quantidade <= estoque_minimo
-        AND status != 'vencido'
-    """, (usuario_uuid,))
-    estoque_baixo = cursor.fetchone()["count"]
-    
-    # Produtos esgotados (quantidade = 0)
-    cursor.execute("""
-        SELECT COUNT(*) as count 
-        FROM produtos 
-        WHERE usuario_uuid = ? 
-        AND quantidade = 0
-        AND status != 'vencido'
+        SELECT r.estoque_baixo, r.estoque_esgotado, r.total_monitorados,
+               p.nome, p.quantidade, p.estoque_minimo
+        FROM resumo_estoque r
+        LEFT JOIN produtos p ON p.uuid = r.mais_critico_uuid
+        WHERE r.usuario_uuid = ?
     """, (usuario_uuid,))
-    estoque_esgotado = cursor.fetchone()["count"]
-    
-    # Produto com estoque mais baixo
-    cursor.execute("""
-        SELECT nome, quantidade, estoque_minimo 
-        FROM produtos 
-        WHERE usuario_uuid = ? 
-        AND estoque_minimo > 0 
-        AND quantidade <= estoque_minimo
-        AND status != 'vencido'
-        ORDER BY quantidade ASC 
-        LIMIT 1
-    """, (usuario_uuid,))
-    mais_critico = cursor.fetchone()
+    resumo = cursor.fetchone()
+
+    estoque_baixo = resumo["estoque_baixo"] if resumo else 0
     
     mais_critico_info = None
-    if mais_critico:
+    if resumo and resumo["nome"] is not None:
         mais_critico_info = {
-            "nome": mais_critico["nome"],
-            "quantidade": mais_critico["quantidade"],
-            "estoque_minimo": mais_critico["estoque_minimo"],
-            "necessario": mais_critico["estoque_minimo"] - mais_critico["quantidade"]
+            "nome": resumo["nome"],
+            "quantidade": resumo["quantidade"],
+            "estoque_minimo": resumo["estoque_minimo"],
+            "necessario": resumo["estoque_minimo"] - resumo["quantidade"]
         }
     
-    # Total de produtos monitorados (com estoque mínimo definido)
-    cursor.execute("""
-        SELECT COUNT(*) as count 
-        FROM produtos 
-        WHERE usuario_uuid = ? 
-        AND estoque_minimo > 0
-    """, (usuario_uuid,))
-    total_monitorados = cursor.fetchone()["count"]
-    
     return {
         "estoque_baixo": estoque_baixo,
-        "estoque_esgotado": estoque_esgotado,
-        "total_monitorados": total_monitorados,
+        "estoque_esgotado": resumo["estoque_esgotado"] if resumo else 0,
+        "total_monitorados": resumo["total_monitorados"] if resumo else 0,
         "produto_mais_critico": mais_critico_info,
         "total_alertas": estoque_baixo
     }
 
-def registrar_log(db, usuario_uuid: str, acao: str, detalhes: str = None):
+# Partes que o painel pode devolver (GET /api/painel?campos=...)
+CAMPOS_PAINEL = ["produtos", "alertas_vencimento", "alertas_estoque", "resumo_alertas", "resumo_estoque"]
+
+def montar_painel(db: sqlite3.Connection, usuario_uuid: str, campos: List[str], dias_alerta: int = 7,
+                  pagina: str = None, limite: int = None):
+    """
+    Monta as partes pedidas do painel do usuário numa única leitura e
+    devolve (painel, proximo_cursor). Os produtos vêm em páginas de `limite`
+    (TAMANHO_PAGINA por padrão), na ordem do índice usuario_uuid, nome, uuid;
+    os alertas saem de consultas só pelos produtos em alerta e os resumos de
+    resumo_estoque. Tudo é lido na mesma transação, então contagens e listas
+    batem entre si.
+    """
+    hoje = date.today()
+    painel = {}
+    proximo = None
+    db.execute("BEGIN")
+    try:
+        if "produtos" in campos:
+            linhas, proximo = paginar(db, """
+                SELECT p.*, f.nome as fornecedor_nome
+                FROM produtos p
+                LEFT JOIN fornecedores f ON p.fornecedor_uuid = f.uuid
+                WHERE p.usuario_uuid = ? {pagina}
+            """, [usuario_uuid], ["p.nome", "p.uuid"], cursor=pagina, limite=limite or TAMANHO_PAGINA)
+            painel["produtos"] = compilar_serializador(Produto, tuple(linhas[0].keys()))(linhas) if linhas else []
+        if "alertas_vencimento" in campos:
+            linhas = db.execute(f"""
+                SELECT {", ".join(COLUNAS_ALERTA_VENCIMENTO)}
+                FROM produtos
+                WHERE usuario_uuid = ? AND status IN (?, ?)
+                AND data_validade IS NOT NULL AND data_validade != ''
+                ORDER BY data_validade, nome, uuid
+            """, (usuario_uuid, StatusProduto.a_vencer.value, StatusProduto.vencido.value)).fetchall()
+            alertas = [alerta_vencimento(dict(linha), hoje) for linha in linhas]
+            painel["alertas_vencimento"] = {"alertas": alertas, "total": len(alertas), "dias_alerta": dias_alerta}
+        if "alertas_estoque" in campos:
+            linhas = db.execute("""
+                SELECT p.*, f.nome as fornecedor_nome,
+                       c.saidas_ponderadas, c.primeira_saida, c.ultima_saida
+                FROM produtos p
+                LEFT JOIN fornecedores f ON p.fornecedor_uuid = f.uuid
+                LEFT JOIN consumo_produtos c ON c.produto_uuid = p.uuid
+                WHERE p.usuario_uuid = ? AND p.estoque_minimo > 0
+                AND p.quantidade <= p.estoque_minimo AND p.status != ?
+                ORDER BY p.quantidade, p.nome, p.uuid
+            """, (usuario_uuid, StatusProduto.vencido.value)).fetchall()
+            alertas = [alerta_estoque(dict(linha), hoje) for linha in linhas]
+            painel["alertas_estoque"] = {"alertas": alertas, "total": len(alertas)}
+
+        if "resumo_alertas" in campos:
+            painel["resumo_alertas"] = obter_resumo_alertas(db, usuario_uuid)
+        if "resumo_estoque" in campos:
+            painel["resumo_estoque"] = obter_resumo_estoque(db, usuario_uuid)
+    finally:
+        db.rollback()
+
+    painel["data_consulta"] = hoje.isoformat()
+    return painel, proximo
+
+def reconstruir_resumos_estoque(db: sqlite3.Connection):
+    """
+    Recalcula resumo_estoque do zero e retorna as diferenças em relação aos
+    valores que estavam gravados (lista vazia quando os gatilhos estavam em dia).
+    """
+    colunas = ["estoque_baixo", "estoque_esgotado", "total_monitorados", "vencidos",
+               "a_vencer", "mais_critico_uuid", "proximo_vencimento_uuid"]
+    cursor = db.cursor()
+    cursor.execute("SELECT * FROM resumo_estoque")
+    anteriores = {row["usuario_uuid"]: dict(row) for row in cursor.fetchall()}
+
+    for comando in SQL_RECONSTRUIR_RESUMOS:
+        cursor.execute(comando)
+    cursor.execute("SELECT * FROM resumo_estoque")
+    atuais = {row["usuario_uuid"]: dict(row) for row in cursor.fetchall()}
+    db.commit()
+
+    vazio = {coluna: 0 for coluna in colunas[:5]}
+    diferencas = []
+    for usuario_uuid in sorted(set(anteriores) | set(atuais)):
+        antes = anteriores.get(usuario_uuid, vazio)
+        depois = atuais.get(usuario_uuid, vazio)
+        for coluna in colunas:
+            if coluna.endswith("_uuid"):
+                # Empates na ordenação podem trocar o ponteiro sem mudar o resultado
+                divergente = (antes.get(coluna) is None) != (depois.get(coluna) is None)
+            else:
+                divergente = antes.get(coluna) != depois.get(coluna)
+            if divergente:
+                diferencas.append({
+                    "usuario_uuid": usuario_uuid,
+                    "campo": coluna,
+                    "gravado": antes.get(coluna),
+                    "recalculado": depois.get(coluna)
+                })
+    return diferencas
+
+def fotografar_estoque(db: sqlite3.Connection, minimo: int = LANCAMENTOS_POR_FOTO):
+    """
+    Grava uma foto (quantidade até o último lançamento) dos produtos com pelo
+    menos `minimo` lançamentos no razão desde a foto anterior. Assim,
+    reconstruir um saldo nunca soma mais que algumas dezenas de lançamentos.
+
+    Só os produtos lançados depois da última execução são lidos. Com a trava
+    de escrita, a foto de um produto cobre todos os seus lançamentos e tem
+    que bater com produtos.quantidade; as divergências são retornadas.
+    """
     cursor = db.cursor()
-    log_id = str(uuid.uuid4())
-    data = datetime.now().strftime("%Y-%m-%d %H:%M")
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute("SELECT razao_id FROM posicoes_razao WHERE leitor = 'fotos'")
+    marca = cursor.fetchone()
+    desde = marca[0] if marca else 0
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM razao_estoque")
+    ate = cursor.fetchone()[0]
+    if ate <= desde:
+        db.rollback()
+        return {"fotos": 0, "produtos_lidos": 0, "divergencias": []}
 
     cursor.execute("""
-        INSERT INTO logs (uuid, usuario_uuid, acao, detalhes, data)
-        VALUES (?, ?, ?, ?, ?)
-    """, (log_id, usuario_uuid, acao, detalhes, data))
+        WITH lancados AS (
+            SELECT DISTINCT produto_uuid FROM razao_estoque WHERE id > :desde AND id <= :ate
+        ),
+        bases AS (
+            SELECT l.produto_uuid, COALESCE(MAX(f.razao_id), 0) as razao_id
+            FROM lancados l
+            LEFT JOIN fotos_estoque f ON f.produto_uuid = l.produto_uuid
+            GROUP BY l.produto_uuid
+        )
+        SELECT
+            b.produto_uuid,
+            COALESCE(f.quantidade, 0) + SUM(r.variacao) as quantidade,
+            COUNT(*) as lancamentos,
+            MAX(r.id) as razao_id,
+            p.quantidade as quantidade_atual
+        FROM bases b
+        JOIN razao_estoque r ON r.produto_uuid = b.produto_uuid AND r.id > b.razao_id AND r.id <= :ate
+        LEFT JOIN fotos_estoque f ON f.produto_uuid = b.produto_uuid AND f.razao_id = b.razao_id
+        LEFT JOIN produtos p ON p.uuid = b.produto_uuid
+        GROUP BY b.produto_uuid
+    """, {"desde": desde, "ate": ate})
+    lidos = cursor.fetchall()
 
+    fotos = [row for row in lidos if row["lancamentos"] >= minimo]
+    if fotos:
+        cursor.executemany("""
+            INSERT INTO fotos_estoque (produto_uuid, razao_id, quantidade, registrado_em)
+            SELECT ?, id, ?, registrado_em FROM razao_estoque WHERE id = ?
+        """, [(row["produto_uuid"], row["quantidade"], row["razao_id"]) for row in fotos])
+    cursor.execute("""
+        INSERT INTO posicoes_razao (leitor, razao_id) VALUES ('fotos', ?)
+        ON CONFLICT(leitor) DO UPDATE SET razao_id = excluded.razao_id
+    """, (ate,))
     db.commit()
 
-# Função para recortar a imagem da logo
-def cortar_logo(caminho_logo):
+    # Produto excluído: o lançamento de exclusão zera o saldo
+    divergencias = [
+        {
+            "produto_uuid": row["produto_uuid"],
+            "razao": row["quantidade"],
+            "gravado": row["quantidade_atual"] or 0
+        }
+        for row in lidos if row["quantidade"] != (row["quantidade_atual"] or 0)
+    ]
+    return {"fotos": len(fotos), "produtos_lidos": len(lidos), "divergencias": divergencias}
+
+def quantidade_no_razao(db: sqlite3.Connection, produto_uuid: str, ate: Optional[str] = None) -> dict:
+    """
+    Reconstrói a quantidade do produto a partir do razão: a última foto até
+    `ate` (data e hora no formato de registrado_em; None para agora) mais os
+    lançamentos seguintes, que as fotos periódicas mantêm poucos.
+    """
+    cursor = db.cursor()
+    limite = ate or "9999-12-31"
+    cursor.execute("""
+        SELECT razao_id, quantidade FROM fotos_estoque
+        WHERE produto_uuid = ? AND registrado_em <= ?
+        ORDER BY razao_id DESC LIMIT 1
+    """, (produto_uuid, limite))
+    foto = cursor.fetchone()
+    base, desde = (foto["quantidade"], foto["razao_id"]) if foto else (0, 0)
+
+    cursor.execute("""
+        SELECT COALESCE(SUM(variacao), 0) as variacao, COUNT(*) as lancamentos
+        FROM razao_estoque
+        WHERE produto_uuid = ? AND id > ? AND registrado_em <= ?
+    """, (produto_uuid, desde, limite))
+    row = cursor.fetchone()
+    return {
+        "quantidade": base + row["variacao"],
+        "foto_razao_id": desde or None,
+        "lancamentos_somados": row["lancamentos"],
+    }
+
+def _saldos_na_data(filtros: list) -> str:
+    # A última linha de estoque_diario até a data é uma busca na chave
+    # primária por produto: o custo cresce com os produtos, não com o histórico
+    return f"""
+        SELECT p.uuid as produto_uuid, p.nome, p.categoria, d.quantidade, d.dia as ultima_alteracao
+        FROM produtos p
+        JOIN estoque_diario d ON d.produto_uuid = p.uuid AND d.dia = (
+            SELECT MAX(dia) FROM estoque_diario WHERE produto_uuid = p.uuid AND dia <= :dia
+        )
+        WHERE {" AND ".join(["p.usuario_uuid = :usuario", *filtros])}
+    """
+
+def carregar_estoque_na_data(db: sqlite3.Connection, usuario_uuid: str, dia: str,
+                             produto_uuid: Optional[str] = None, categoria: Optional[str] = None) -> list:
+    """
+    Saldo no fim de `dia` de cada produto do usuário (ou de um produto ou
+    categoria), pela data das movimentações. Produtos ainda não cadastrados
+    nem movimentados até a data ficam de fora.
+    """
+    filtros = []
+    if produto_uuid:
+        filtros.append("p.uuid = :produto")
+    if categoria:
+        filtros.append("p.categoria = :categoria")
+    cursor = db.cursor()
+    cursor.execute(f"{_saldos_na_data(filtros)} ORDER BY p.nome, p.uuid", {
+        "usuario": usuario_uuid, "dia": dia, "produto": produto_uuid, "categoria": categoria
+    })
+    return [dict(row) for row in cursor.fetchall()]
+
+def carregar_estoque_na_data_por_categoria(db: sqlite3.Connection, usuario_uuid: str, dia: str) -> list:
+    """Totais por categoria do saldo no fim de `dia`."""
+    cursor = db.cursor()
+    cursor.execute(f"""
+        SELECT categoria, COUNT(*) as produtos, SUM(quantidade) as quantidade
+        FROM ({_saldos_na_data([])})
+        GROUP BY categoria
+        ORDER BY categoria
+    """, {"usuario": usuario_uuid, "dia": dia})
+    return [dict(row) for row in cursor.fetchall()]
+
+def termos_busca(texto: str) -> List[str]:
+    """Palavras do texto digitado, sem a sintaxe do FTS5 (aspas, operadores, parênteses)."""
+    return re.findall(r"\w+", texto)
+
+def buscar_produtos(db: sqlite3.Connection, usuario_uuid: str, texto: str, limite: int = 20) -> list:
+    """
+    Produtos do usuário que casam com todas as palavras do texto (cada uma
+    também como prefixo), dos mais relevantes aos menos. Nome pesa mais que
+    lote e registro, que pesam mais que fornecedor, descrição e localização.
+    """
+    termos = termos_busca(texto)
+    if not termos:
+        return []
+    palavras = " ".join(f'"{termo}"*' for termo in termos)
+    consulta = (
+        f'usuario : "{usuario_uuid}" AND '
+        f'{{{" ".join(COLUNAS_BUSCA)} fornecedor}} : ({palavras})'
+    )
+    cursor = db.cursor()
+    cursor.execute("""
+        SELECT p.*, f.nome as fornecedor_nome
+        FROM produtos_busca
+        JOIN busca_produtos b ON b.id = produtos_busca.rowid
+        JOIN produtos p ON p.uuid = b.produto_uuid
+        LEFT JOIN fornecedores f ON f.uuid = p.fornecedor_uuid
+        WHERE produtos_busca MATCH ?
+        ORDER BY bm25(produtos_busca, 10.0, 2.0, 4.0, 1.0, 4.0, 3.0, 0.0)
+        LIMIT ?
+    """, (consulta, limite))
+    return cursor.fetchall()
+
+def carregar_fornecedores_detalhados(db: sqlite3.Connection, usuario_uuid: str, limite_movimentos: int = 10):
+    """
+    Carrega os fornecedores do usuário com estatísticas, produtos e últimas
+    movimentações em três consultas, independente do número de fornecedores.
+    """
+    cursor = db.cursor()
+
+    # Agrega produtos e movimentos separadamente antes do JOIN para não
+    # multiplicar as linhas de um pelas do outro
+    cursor.execute("""
+        SELECT
+            f.*,
+            COALESCE(p.produtos_count, 0) as produtos_count,
+            COALESCE(m.entradas_count, 0) as entradas_count,
+            COALESCE(m.total_entradas, 0) as total_entradas,
+            COALESCE(m.total_saidas, 0) as total_saidas,
+            COALESCE(m.quantidade_total_entradas, 0) as quantidade_total_entradas,
+            COALESCE(m.quantidade_total_saidas, 0) as quantidade_total_saidas
+        FROM fornecedores f
+        LEFT JOIN (
+            SELECT fornecedor_uuid, COUNT(*) as produtos_count
+            FROM produtos
+            WHERE usuario_uuid = :usuario
+            GROUP BY fornecedor_uuid
+        ) p ON p.fornecedor_uuid = f.uuid
+        LEFT JOIN (
+            SELECT
+                fornecedor_uuid,
+                COUNT(*) as entradas_count,
+                SUM(tipo = 'entrada') as total_entradas,
+                SUM(tipo = 'saida') as total_saidas,
+                SUM(CASE WHEN tipo = 'entrada' THEN quantidade ELSE 0 END) as quantidade_total_entradas,
+                SUM(CASE WHEN tipo = 'saida' THEN quantidade ELSE 0 END) as quantidade_total_saidas
+            FROM movimentos
+            WHERE usuario_uuid = :usuario
+            GROUP BY fornecedor_uuid
+        ) m ON m.fornecedor_uuid = f.uuid
+        WHERE f.usuario_uuid = :usuario
+        ORDER BY f.nome
+    """, {"usuario": usuario_uuid})
+    fornecedores = [dict(row) for row in cursor.fetchall()]
+
+    produtos_por_fornecedor = {f["uuid"]: [] for f in fornecedores}
+    movimentos_por_fornecedor = {f["uuid"]: [] for f in fornecedores}
+
+    cursor.execute("""
+        SELECT fornecedor_uuid, uuid, nome, quantidade, status, data_validade, lote
+        FROM produtos
+        WHERE usuario_uuid = ?
+        ORDER BY nome
+    """, (usuario_uuid,))
+    for row in cursor.fetchall():
+        produto = dict(row)
+        lista = produtos_por_fornecedor.get(produto.pop("fornecedor_uuid"))
+        if lista is not None:
+            lista.append(produto)
+
+    # As N movimentações mais recentes de cada fornecedor
+    cursor.execute("""
+        SELECT r.fornecedor_uuid, r.uuid, r.tipo, r.quantidade, r.data, p.nome as produto_nome
+        FROM (
+            SELECT
+                uuid, tipo, quantidade, data, fornecedor_uuid, produto_uuid,
+                ROW_NUMBER() OVER (PARTITION BY fornecedor_uuid ORDER BY data DESC) as posicao
+            FROM movimentos
+            WHERE usuario_uuid = ?
+        ) r
+        LEFT JOIN produtos p ON r.produto_uuid = p.uuid
+        WHERE r.posicao <= ?
+        ORDER BY r.fornecedor_uuid, r.posicao
+    """, (usuario_uuid, limite_movimentos))
+    for row in cursor.fetchall():
+        movimento = dict(row)
+        lista = movimentos_por_fornecedor.get(movimento.pop("fornecedor_uuid"))
+        if lista is not None:
+            lista.append(movimento)
+
+    for fornecedor in fornecedores:
+        fornecedor["produtos_detalhados"] = produtos_por_fornecedor[fornecedor["uuid"]]
+        fornecedor["movimentos_detalhados"] = movimentos_por_fornecedor[fornecedor["uuid"]]
+        fornecedor["quantidade_produtos"] = len(fornecedor["produtos_detalhados"])
+
+    return fornecedores
+
+TAMANHO_LOTE_MAXIMO = 1000
+
+def registrar_movimentos_lote(db: sqlite3.Connection, movimentos: List[Movimento], usuario_uuid: str, dias_alerta: int = 7):
+    """
+    Registra um lote de entradas e saídas em uma única transação.
+    Produtos e fornecedores são validados com uma consulta cada; as linhas
+    são aplicadas em ordem (uma saída vê as entradas anteriores do mesmo lote)
+    e as inválidas são rejeitadas sem impedir as demais.
+    """
+    cursor = db.cursor()
+    # Trava de escrita desde a leitura das quantidades até o commit
+    cursor.execute("BEGIN IMMEDIATE")
+
+    produtos = {}
+    produtos_uuids = sorted({m.produto_uuid for m in movimentos})
+    if produtos_uuids:
+        marcadores = ", ".join("?" * len(produtos_uuids))
+        cursor.execute(f"""
+            SELECT uuid, nome, quantidade, data_validade FROM produtos
+            WHERE usuario_uuid = ? AND uuid IN ({marcadores})
+        """, [usuario_uuid, *produtos_uuids])
+        produtos = {row["uuid"]: dict(row) for row in cursor.fetchall()}
+
+    fornecedores = {}
+    fornecedores_uuids = sorted({m.fornecedor_uuid for m in movimentos})
+    if fornecedores_uuids:
+        marcadores = ", ".join("?" * len(fornecedores_uuids))
+        cursor.execute(f"SELECT uuid, nome FROM fornecedores WHERE uuid IN ({marcadores})", fornecedores_uuids)
+        fornecedores = {row["uuid"]: row["nome"] for row in cursor.fetchall()}
+
+    quantidades = {produto_uuid: produto["quantidade"] for produto_uuid, produto in produtos.items()}
+    resultados = []
+    novos_movimentos = []
+    totais = {TipoMovimento.entrada: [0, 0], TipoMovimento.saida: [0, 0]}
+
+    for linha, movimento in enumerate(movimentos):
+        erro = None
+        if movimento.tipo is None:
+            erro = "Tipo do movimento não informado."
+        elif movimento.quantidade <= 0:
+            erro = "A quantidade deve ser maior que zero."
+        elif movimento.produto_uuid not in produtos:
+            erro = "Produto não encontrado ou não pertence ao usuário."
+        elif movimento.fornecedor_uuid not in fornecedores:
+            erro = "Fornecedor não encontrado."
+        elif movimento.tipo == TipoMovimento.saida and quantidades[movimento.produto_uuid] < movimento.quantidade:
+            erro = "Estoque insuficiente"
+
+        if erro:
+            resultados.append({"linha": linha, "status": "erro", "erro": erro})
+            continue
+
+        if movimento.tipo == TipoMovimento.entrada:
+            quantidades[movimento.produto_uuid] += movimento.quantidade
+        else:
+            quantidades[movimento.produto_uuid] -= movimento.quantidade
+        totais[movimento.tipo][0] += 1
+        totais[movimento.tipo][1] += movimento.quantidade
+
+        movimento.uuid = str(uuid.uuid4())
+        movimento.usuario_uuid = usuario_uuid
+        movimento.produto_nome = produtos[movimento.produto_uuid]["nome"]
+        movimento.fornecedor_nome = fornecedores[movimento.fornecedor_uuid]
+        novos_movimentos.append(movimento)
+        resultados.append({"linha": linha, "status": "ok", "movimento": movimento})
+
+    if not novos_movimentos:
+        db.rollback()
+    else:
+        # Uma atualização por produto, com a variação líquida do lote
+        # (um lançamento no razão por produto)
+        alterados = sorted({m.produto_uuid for m in novos_movimentos})
+        cursor.executemany(
+            "UPDATE produtos SET quantidade = quantidade + ?, status = ? WHERE uuid = ?",
+            [
+                (quantidades[produto_uuid] - produtos[produto_uuid]["quantidade"],
+                 status_apos_movimento(quantidades[produto_uuid], produtos[produto_uuid]["data_validade"], dias_alerta),
+                 produto_uuid)
+                for produto_uuid in alterados
+            ]
+        )
+
+        # Movimentações depois da quantidade, como nas rotas individuais, da
+        # data mais recente para a mais antiga (os saldos diários de um dia
+        # novo partem das movimentações posteriores já gravadas)
+        cursor.executemany(
+            "INSERT INTO movimentos VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (m.uuid, m.produto_uuid, m.tipo.value, m.quantidade,
+                 m.data.isoformat(), m.fornecedor_uuid, m.usuario_uuid)
+                for m in sorted(novos_movimentos, key=lambda m: m.data, reverse=True)
+            ]
+        )
+
+        for m in novos_movimentos:
+            if m.tipo == TipoMovimento.saida:
+                registrar_consumo(db, m.produto_uuid, m.quantidade, m.data)
+
+        # Cada movimento é auditado como nas rotas individuais, mais um
+        # resumo do lote; tudo vai para o banco num único executemany
+        lote_uuid = str(uuid.uuid4())
+        auditoria = BufferAuditoria()
+        for m in novos_movimentos:
+            auditoria.registrar(
+                usuario_uuid,
+                "Entrada de Estoque" if m.tipo == TipoMovimento.entrada else "Saída de Estoque",
+                "movimento", m.uuid,
+                produto=m.produto_nome,
+                variacao=m.quantidade if m.tipo == TipoMovimento.entrada else -m.quantidade,
+                fornecedor=m.fornecedor_nome,
+                data=m.data.isoformat(),
+                lote_uuid=lote_uuid
+            )
+        entradas, saidas = totais[TipoMovimento.entrada], totais[TipoMovimento.saida]
+        auditoria.registrar(
+            usuario_uuid, "Movimentação em Lote", "lote", lote_uuid,
+            movimentos=len(novos_movimentos),
+            entradas=entradas[0],
+            unidades_entrada=entradas[1],
+            saidas=saidas[0],
+            unidades_saida=saidas[1],
+            produtos=len(alterados),
+            rejeitados=len(movimentos) - len(novos_movimentos)
+        )
+        auditoria.gravar(db)
+        db.commit()
+
+    return {
+        "total": len(movimentos),
+        "aplicados": len(novos_movimentos),
+        "rejeitados": len(movimentos) - len(novos_movimentos),
+        "resultados": resultados
+    }
+
+LOGO_PATH = os.path.join("static", "images", "logo_colorida.png")
+
+# Recorta a logo uma única vez e mantém o PNG em memória
+@lru_cache(maxsize=1)
+def obter_logo(caminho_logo=LOGO_PATH):
     """Remove automaticamente bordas vazias / transparentes da logo."""
     try:
         img = PILImage.open(caminho_logo)
         bbox = img.getbbox()
         if bbox:
-            img_crop = img.crop(bbox)
-        else:
-            img_crop = img
-        novo_caminho = caminho_logo.replace(".png", "_crop.png")
-        img_crop.save(novo_caminho)
-
-        return novo_caminho
+            img = img.crop(bbox)
+        buffer = BytesIO()
+        img.save(buffer, format="PNG")
+        return buffer.getvalue(), img.size
     except Exception as e:
         print("Erro ao recortar logo:", e)
-        return caminho_logo
+        return None
+
+
+class _FlowablesSobDemanda(list):
+    """
+    Lista de flowables que é reabastecida a partir de um gerador quando esvazia.
+    O reportlab consome os flowables do início da lista, então apenas as
+    linhas da página em montagem ficam em memória.
+    """
+
+    def __init__(self, fonte):
+        super().__init__()
+        self._fonte = iter(fonte)
+
+    def __len__(self):
+        if not super().__len__():
+            proximo = next(self._fonte, None)
+            if proximo is not None:
+                self.append(proximo)
+        return super().__len__()
+
+
+def ler_em_blocos(arquivo, tamanho_bloco: int = 64 * 1024):
+    """Entrega o conteúdo de um arquivo em blocos e o fecha ao final."""
+    try:
+        while True:
+            bloco = arquivo.read(tamanho_bloco)
+            if not bloco:
+                break
+            yield bloco
+    finally:
+        arquivo.close()
+
 
 def gerar_pdf_logs(logs, usuario_nome):
-    buffer_pdf = BytesIO()
+    """
+    Gera o relatório de logs lendo `logs` (qualquer iterável, de preferência
+    um gerador paginado) à medida que as páginas são montadas. Cada log vira
+    uma tabela de uma linha, o cabeçalho das colunas é desenhado pelo modelo
+    de página e o PDF vai para um arquivo temporário que só passa para o disco
+    quando fica grande. Retorna o arquivo posicionado no início.
+    """
+    arquivo_pdf = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
 
     # Styles
     styles = getSampleStyleSheet()
@@ -514,70 +1254,7 @@ def gerar_pdf_logs(logs, usuario_nome):
         textColor=colors.white
     )
 
-    # Documento
     margin = 2 * cm
-    doc = SimpleDocTemplate(
-        buffer_pdf,
-        pagesize=A4,
-        rightMargin=margin,
-        leftMargin=margin,
-        topMargin=margin,
-        bottomMargin=margin
-    )
-
-    elementos = []
-
-    # Logo
-    logo_path = os.path.join("static", "images", "logo_colorida.png")
-    logo_path_crop = cortar_logo(logo_path)
-
-    if os.path.exists(logo_path_crop):
-        img_reader = ImageReader(logo_path_crop)
-        iw, ih = img_reader.getSize()
-        largura = 5 * cm
-        proporcao = largura / iw
-        altura = ih * proporcao
-        img = Image(logo_path_crop, width=largura, height=altura)
-        img.hAlign = 'LEFT'
-        elementos.append(img)
-        elementos.append(Spacer(1, 12))
-
-    # Título
-    elementos.append(Paragraph("<br/>Relatório do Estoque", style_title))
-    elementos.append(Spacer(1, 12))
-
-    header = [
-        Paragraph("Data", style_header),
-        Paragraph("Usuário", style_header),
-        Paragraph("Ação", style_header),
-        Paragraph("Detalhes", style_header)
-    ]
-
-    tabela_dados = [header]
-
-    for row in logs:
-        data_raw = row["data"] or ""
-        usuario = row["usuario_nome"] or ""
-        acao = row["acao"] or ""
-        detalhes_raw = row["detalhes"] or "-"
-
-        linhas = detalhes_raw.split("|")
-        detalhes_formatado = ""
-        for linha in linhas:
-            if ":" in linha:
-                chave, valor = linha.split(":", 1)
-                detalhes_formatado += f"<b>{chave.strip()}:</b> {valor.strip()}<br/>"
-            else:
-                detalhes_formatado += linha.strip() + "<br/>"
-
-        tabela_dados.append([
-            Paragraph(data_raw, style_normal),
-            Paragraph(usuario, style_normal),
-            Paragraph(acao, style_normal),
-            Paragraph(detalhes_formatado, style_normal)
-        ])
-
-
     page_width, page_height = A4
     usable_width = page_width - (2 * margin)
 
@@ -589,11 +1266,34 @@ def gerar_pdf_logs(logs, usuario_nome):
         diff = total - usable_width
         colWidths[-1] -= diff
 
-    tabela = Table(tabela_dados, colWidths=colWidths, repeatRows=1)
+    estilo_base = [
+        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ('TEXTCOLOR', (0, 0), (-1, -1), colors.HexColor("#1C1C1C")),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+
+        # Padding interno
+        ('LEFTPADDING', (0, 0), (-1, -1), 6),
+        ('RIGHTPADDING', (0, 0), (-1, -1), 6),
+        ('TOPPADDING', (0, 0), (-1, -1), 6),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
 
-    # Estilo da tabela
-    tabela.setStyle(TableStyle([
-        # Cabeçalho
+        # Bordas suaves
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.lightgrey),
+    ]
+    # Linhas alternadas
+    estilos_linha = [
+        TableStyle(estilo_base + [('BACKGROUND', (0, 0), (-1, -1), colors.whitesmoke)]),
+        TableStyle(estilo_base + [('BACKGROUND', (0, 0), (-1, -1), colors.HexColor("#F8F9F9"))]),
+    ]
+
+    cabecalho = Table([[
+        Paragraph("Data", style_header),
+        Paragraph("Usuário", style_header),
+        Paragraph("Ação", style_header),
+        Paragraph("Detalhes", style_header)
+    ]], colWidths=colWidths)
+    cabecalho.setStyle(TableStyle([
         ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor("#96bd3e")),
         ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
         ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
@@ -602,28 +1302,77 @@ def gerar_pdf_logs(logs, usuario_nome):
         ('FONTSIZE', (0, 0), (-1, 0), 11),
         ('BOTTOMPADDING', (0, 0), (-1, 0), 10),
         ('TOPPADDING', (0, 0), (-1, 0), 10),
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.lightgrey),
+    ]))
+    _, altura_cabecalho = cabecalho.wrap(usable_width, page_height)
 
-        # Corpo
-        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 1), (-1, -1), 9),
-        ('TEXTCOLOR', (0, 1), (-1, -1), colors.HexColor("#1C1C1C")),
-        ('VALIGN', (0, 1), (-1, -1), 'TOP'),
+    def desenhar_cabecalho(canvas_pdf, doc):
+        cabecalho.drawOn(canvas_pdf, margin, page_height - margin - altura_cabecalho)
 
-        # Padding interno
-        ('LEFTPADDING', (0, 1), (-1, -1), 6),
-        ('RIGHTPADDING', (0, 1), (-1, -1), 6),
-        ('TOPPADDING', (0, 1), (-1, -1), 6),
-        ('BOTTOMPADDING', (0, 1), (-1, -1), 6),
+    # Documento: a primeira página tem logo e título, as demais repetem o cabeçalho da tabela
+    doc = BaseDocTemplate(
+        arquivo_pdf,
+        pagesize=A4,
+        rightMargin=margin,
+        leftMargin=margin,
+        topMargin=margin,
+        bottomMargin=margin,
+        pageCompression=1
+    )
+    altura_util = page_height - 2 * margin
+    doc.addPageTemplates([
+        PageTemplate(id="primeira", frames=[
+            Frame(margin, margin, usable_width, altura_util, id="primeira")
+        ]),
+        PageTemplate(id="demais", onPage=desenhar_cabecalho, frames=[
+            Frame(margin, margin, usable_width, altura_util - altura_cabecalho,
+                  id="demais", topPadding=0)
+        ]),
+    ])
 
-        # Linhas alternadas
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.whitesmoke, colors.HexColor("#F8F9F9")]),
+    elementos = [NextPageTemplate("demais")]
 
-        # Bordas suaves
-        ('GRID', (0, 0), (-1, -1), 0.25, colors.lightgrey),
-    ]))
+    # Logo
+    logo = obter_logo()
+    if logo:
+        logo_png, (iw, ih) = logo
+        largura = 5 * cm
+        proporcao = largura / iw
+        altura = ih * proporcao
+        img = Image(BytesIO(logo_png), width=largura, height=altura)
+        img.hAlign = 'LEFT'
+        elementos.append(img)
+        elementos.append(Spacer(1, 12))
 
-    elementos.append(tabela)
+    # Título
+    elementos.append(Paragraph("<br/>Relatório do Estoque", style_title))
+    elementos.append(Spacer(1, 12))
+    elementos.append(cabecalho)
+
+    def linhas_tabela():
+        for i, row in enumerate(logs):
+            data_raw = row["data"] or ""
+            usuario = row["usuario_nome"] or ""
+            acao = row["acao"] or ""
+            campos = campos_evento(row["entidade_uuid"], carregar_dados(row["dados"]))
+            detalhes_formatado = "".join(
+                f"<b>{escape(rotulo)}:</b> {escape(valor)}<br/>" for rotulo, valor in campos
+            ) or "-"
 
-    doc.build(elementos)
-    buffer_pdf.seek(0)
-    return buffer_pdf
+            tabela = Table([[
+                Paragraph(data_raw, style_normal),
+                Paragraph(usuario, style_normal),
+                Paragraph(acao, style_normal),
+                Paragraph(detalhes_formatado, style_normal)
+            ]], colWidths=colWidths)
+            tabela.setStyle(estilos_linha[i % 2])
+            yield tabela
+
+    fonte = itertools.chain(elementos, linhas_tabela())
+    try:
+        doc.build(_FlowablesSobDemanda(fonte))
+    except Exception:
+        arquivo_pdf.close()
+        raise
+    arquivo_pdf.seek(0)
+    return arquivo_pdf
@@ -0,0 +1,85 @@
+import json
+from datetime import date
+from enum import Enum
+from functools import lru_cache
+from typing import Union, get_args, get_origin
+
+from pydantic import TypeAdapter
+
+from instrumentacao import medir
+
+# Serialização direta de linhas do banco para as listagens grandes.
+# Gera o mesmo JSON, byte a byte, que o FastAPI produziria validando cada
+# linha contra response_model=List[modelo], mas sem instanciar os modelos:
+# as linhas vêm do próprio banco, então só precisamos das mesmas conversões
+# de tipo que o Pydantic faria na saída.
+
+
+def para_json(conteudo) -> bytes:
+    """Mesmas opções do JSONResponse do Starlette."""
+    return json.dumps(
+        conteudo,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def _tipo_base(anotacao):
+    if get_origin(anotacao) is Union:
+        tipos = [tipo for tipo in get_args(anotacao) if tipo is not type(None)]
+        return tipos[0] if len(tipos) == 1 else None
+    return anotacao
+
+
+def _expressao(anotacao, valor: str) -> str:
+    tipo = _tipo_base(anotacao)
+    if not isinstance(tipo, type) or issubclass(tipo, Enum):
+        # Enums são gravados pelo valor, que é o que vai no JSON
+        return valor
+    if tipo is bool:
+        return f"(None if {valor} is None else bool({valor}))"
+    if tipo in (int, float):
+        # Colunas TEXT/FLOAT podem devolver outro tipo (ex.: dias_para_vencer)
+        return f"(None if {valor} is None else {tipo.__name__}({valor}))"
+    if tipo is date:
+        # Já gravadas em ISO; texto vazio equivale a sem data
+        return f"({valor} or None)"
+    return valor
+
+
+@lru_cache(maxsize=32)
+def compilar_serializador(modelo, colunas: tuple):
+    """
+    Gera (uma vez por modelo e conjunto de colunas) uma função que recebe as
+    linhas e devolve a lista de dicts na ordem dos campos do modelo.
+    Campos ausentes da consulta recebem o valor padrão do modelo.
+    """
+    contexto = {}
+    itens = []
+    for nome, campo in modelo.model_fields.items():
+        if nome in colunas:
+            expressao = _expressao(campo.annotation, f"r[{colunas.index(nome)}]")
+        elif not campo.is_required():
+            contexto[f"padrao_{nome}"] = TypeAdapter(campo.annotation).dump_python(
+                campo.get_default(call_default_factory=True), mode="json"
+            )
+            expressao = f"padrao_{nome}"
+        else:
+            raise ValueError(f"Coluna obrigatória ausente na consulta: {nome}")
+        itens.append(f"{nome!r}: {expressao}")
+
+    codigo = f"def serializar(linhas):\n    return [{{{', '.join(itens)}}} for r in linhas]\n"
+    exec(compile(codigo, f"<serializador {modelo.__name__}>", "exec"), contexto)
+    return contexto["serializar"]
+
+
+def serializar_linhas(modelo, linhas) -> bytes:
+    """Linhas sqlite3.Row -> JSON de uma List[modelo]."""
+    if not linhas:
+        return b"[]"
+    with medir("serializacao"):
+        serializar = compilar_serializador(modelo, tuple(linhas[0].keys()))
+        return para_json(serializar(linhas))
+
@@ -0,0 +1,21 @@
+from datetime import date
+
+from consumo import HORIZONTE_PREVISAO, prever_esgotamento
+
+
+def test_saida_antiga_nao_gera_previsao():
+    # Dez meses sem saídas: o consumo decaído é ínfimo, mas não zero
+    previsao = prever_esgotamento(5.0, "2025-01-01", "2025-10-18", 3, date(2026, 10, 18))
+    assert previsao["dias_para_esgotar"] is None
+    assert previsao["data_prevista_esgotamento"] is None
+
+
+def test_previsao_perto_do_fim_do_calendario():
+    previsao = prever_esgotamento(5.0, "9999-12-01", "9999-12-01", 1000, date(9999, 12, 2))
+    assert previsao["data_prevista_esgotamento"] is None
+
+
+def test_consumo_recente_dentro_do_horizonte():
+    previsao = prever_esgotamento(5.0, "2026-09-01", "2026-10-10", 3, date(2026, 10, 18))
+    assert 0 < previsao["dias_para_esgotar"] <= HORIZONTE_PREVISAO
+    assert previsao["data_prevista_esgotamento"] > "2026-10-18"